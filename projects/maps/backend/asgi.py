@@ -0,0 +1,350 @@
+"""
+Asynchronous serving mode of the maps and tiles endpoints:
+
+    uvicorn maps.asgi:app --host 0.0.0.0 --port 8081
+
+The requests are validated with the same schemas of the Flask endpoints and
+resolved by the same lookup functions, run on a thread pool along with every
+blocking file access, so that a single process can keep thousands of slow
+downloads in flight.
+"""
+
+import asyncio
+import mimetypes
+import time
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, Optional, Type
+
+from anyio import to_thread
+from maps.endpoints.catalog import catalog, get_file_path
+from maps.endpoints.config import ASGI_THREADS, EVENTS_HEARTBEAT, EVENTS_TIMEOUT
+from maps.endpoints.crops import get_crop, locate_crop
+from maps.endpoints.delivery import (
+    FileValidators,
+    check_not_modified,
+    get_cache_headers,
+    get_data_validators,
+    get_packed_validators,
+    get_validators,
+    hot_images,
+    load_map,
+)
+from maps.endpoints.events import (
+    HEARTBEAT,
+    collect_events,
+    get_event_token,
+    get_events_schema,
+    open_stream,
+)
+from maps.endpoints.maps import (
+    get_image_schema,
+    get_map_set,
+    get_schema,
+    locate_legend,
+    locate_map_image,
+)
+from maps.endpoints.packfile import PackReader
+from maps.endpoints.thumbnails import get_bounding_box, get_thumbnail
+from maps.endpoints.tiles import get_tiles_info, get_tiles_schema, locate_tiles
+from maps.endpoints.variants import (
+    SUPPORTED_VARIANTS,
+    VARIANT_FORMATS,
+    get_variant,
+    pick_variant,
+)
+from marshmallow import EXCLUDE, ValidationError
+from restapi.exceptions import RestApiException
+from restapi.models import Schema
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header, parse_date, parse_etags
+
+API_PREFIX = "/api"
+# the event streams check for new runs in memory at this interval (seconds)
+EVENTS_POLL_INTERVAL = 1.0
+
+
+def load_query(schema: Type[Schema], request: Request) -> Dict[str, Any]:
+    return schema().load(dict(request.query_params), unknown=EXCLUDE)
+
+
+def is_not_modified(request: Request, validators: FileValidators) -> bool:
+    return check_not_modified(
+        validators,
+        parse_etags(request.headers.get("if-none-match")),
+        parse_date(request.headers.get("if-modified-since")),
+    )
+
+
+def not_modified(validators: FileValidators, reftime: Optional[str]) -> Response:
+    return Response(status_code=304, headers=get_cache_headers(validators, reftime))
+
+
+async def send_file(
+    request: Request,
+    path: Path,
+    reftime: Optional[str],
+    offset: str,
+    mime: str = "image/png",
+) -> Response:
+    validators = await run_in_threadpool(get_validators, path, reftime or "", offset)
+    if is_not_modified(request, validators):
+        return not_modified(validators, reftime)
+    # the file is read in chunks on the thread pool
+    return FileResponse(
+        path, media_type=mime, headers=get_cache_headers(validators, reftime)
+    )
+
+
+async def send_packed(
+    request: Request, reader: PackReader, key: str, reftime: str, mime: str
+) -> Optional[Response]:
+    validators = get_packed_validators(reader, key, reftime)
+    if not validators:
+        return None
+    if is_not_modified(request, validators):
+        return not_modified(validators, reftime)
+    view = reader.get(key)
+    # reading the mapped pages may hit the disk as well
+    content = await run_in_threadpool(bytes, view)
+    return Response(
+        content, media_type=mime, headers=get_cache_headers(validators, reftime)
+    )
+
+
+async def send_map(
+    request: Request,
+    base_path: Path,
+    area: str,
+    key: str,
+    reftime: Optional[str],
+    offset: str,
+    mime: str = "image/png",
+) -> Response:
+    if reftime:
+        reader = await run_in_threadpool(
+            catalog.get_pack_reader, base_path, area, reftime
+        )
+        if reader:
+            response = await send_packed(request, reader, key, reftime, mime)
+            if response:
+                return response
+    path = get_file_path(base_path, area, key)
+    return await send_file(request, path, reftime, offset, mime)
+
+
+async def send_hot_map(
+    request: Request, base_path: Path, area: str, key: str, reftime: str, offset: str
+) -> Response:
+    if not hot_images.max_size:
+        return await send_map(request, base_path, area, key, reftime, offset)
+    cache_key = (base_path, area, key, reftime)
+    cached = hot_images.get(cache_key)
+    if cached is None:
+        cached = await run_in_threadpool(
+            load_map, base_path, area, key, reftime, offset
+        )
+        hot_images.set(cache_key, cached, len(cached[0]))
+    data, validators = cached
+    if is_not_modified(request, validators):
+        return not_modified(validators, reftime)
+    return Response(
+        data, media_type="image/png", headers=get_cache_headers(validators, reftime)
+    )
+
+
+async def map_image(request: Request) -> Response:
+    kwargs = load_query(get_image_schema(), request)
+    width = kwargs.pop("width", None)
+    height = kwargs.pop("height", None)
+    size = kwargs.pop("size", None)
+    bbox = kwargs.pop("bbox", None)
+    region = kwargs.pop("region", None)
+    crop = None
+    if bbox or region:
+        resized = bool(width or height or size)
+        kwargs["area"], crop = locate_crop(
+            kwargs["field"], kwargs["res"], bbox, region, resized
+        )
+    field, area = kwargs["field"], kwargs["area"]
+    base_path, reftime, image_name, map_offset = await run_in_threadpool(
+        locate_map_image, request.path_params["map_offset"], **kwargs
+    )
+
+    accept = parse_accept_header(request.headers.get("accept"), MIMEAccept)
+    variant = pick_variant(accept)
+    if crop:
+        image_format = variant or "png"
+        crop_file, pixel_box = await run_in_threadpool(
+            get_crop,
+            base_path,
+            area,
+            field,
+            kwargs["res"],
+            image_name,
+            reftime,
+            crop,
+            image_format,
+        )
+        response = await send_file(
+            request,
+            crop_file,
+            reftime,
+            f"{map_offset}@{'-'.join(str(v) for v in pixel_box)}.{image_format}",
+            VARIANT_FORMATS[variant][1] if variant else "image/png",
+        )
+    elif width or height or size:
+        box_width, box_height = get_bounding_box(width, height, size)
+        image_format = variant or "png"
+        mime = VARIANT_FORMATS[variant][1] if variant else "image/png"
+        validators = get_data_validators(
+            f"{base_path}/{area}/{field}/{image_name}"
+            f"@{box_width}x{box_height}.{image_format}",
+            reftime,
+        )
+        if is_not_modified(request, validators):
+            response = not_modified(validators, reftime)
+        else:
+            data = await run_in_threadpool(
+                get_thumbnail,
+                base_path,
+                area,
+                field,
+                image_name,
+                reftime,
+                box_width,
+                box_height,
+                image_format,
+            )
+            response = Response(
+                data, media_type=mime, headers=get_cache_headers(validators, reftime)
+            )
+    elif variant:
+        variant_file = await run_in_threadpool(
+            get_variant, base_path, area, field, image_name, reftime, variant
+        )
+        response = await send_file(
+            request,
+            variant_file,
+            reftime,
+            f"{map_offset}.{variant}",
+            VARIANT_FORMATS[variant][1],
+        )
+    else:
+        response = await send_hot_map(
+            request, base_path, area, f"{field}/{image_name}", reftime, map_offset
+        )
+    if SUPPORTED_VARIANTS:
+        response.headers.append("Vary", "Accept")
+    return response
+
+
+async def map_set(request: Request) -> Response:
+    kwargs = load_query(get_schema(False), request)
+    return JSONResponse(await run_in_threadpool(get_map_set, **kwargs))
+
+
+async def map_legend(request: Request) -> Response:
+    kwargs = load_query(get_schema(True), request)
+    base_path, reftime, legend_key = await run_in_threadpool(
+        locate_legend,
+        kwargs["run"],
+        kwargs["res"],
+        kwargs["field"],
+        kwargs["area"],
+        kwargs["platform"],
+        kwargs.get("env", "PROD"),
+        kwargs.get("reftime"),
+    )
+    return await send_map(
+        request, base_path, kwargs["area"], legend_key, reftime, "legend"
+    )
+
+
+async def map_events(request: Request) -> Response:
+    filters = load_query(get_events_schema(), request)
+    since = get_event_token(
+        request.headers.get("last-event-id"), filters.pop("since", None)
+    )
+    timeout = filters.pop("timeout", None) or EVENTS_TIMEOUT
+    if catalog.live:
+        await run_in_threadpool(catalog.start)
+
+    async def stream() -> AsyncIterator[str]:
+        # no thread is held by the waiting clients
+        token, head = open_stream(since)
+        yield head
+        now = time.monotonic()
+        deadline, last_sent = now + timeout, now
+        while now < deadline:
+            await asyncio.sleep(min(EVENTS_POLL_INTERVAL, deadline - now))
+            now = time.monotonic()
+            token, chunk = collect_events(token, filters)
+            if chunk or now - last_sent >= EVENTS_HEARTBEAT:
+                yield chunk or HEARTBEAT
+                last_sent = now
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def tiles_info(request: Request) -> Response:
+    kwargs = load_query(get_tiles_schema(), request)
+    return JSONResponse(await run_in_threadpool(get_tiles_info, **kwargs))
+
+
+async def tile_image(request: Request) -> Response:
+    params = request.path_params
+    reader, reftime = await run_in_threadpool(
+        locate_tiles, params["dataset"], params["run"]
+    )
+    key = "/".join(params[p] for p in ("layer", "z", "x", "y"))
+    mime = mimetypes.guess_type(params["y"])[0] or "image/png"
+    response = await send_packed(request, reader, key, reftime, mime)
+    if not response:
+        return JSONResponse(f"Tile {key} not found", status_code=404)
+    return response
+
+
+async def validation_error(request: Request, exc: Exception) -> Response:
+    messages = exc.messages if isinstance(exc, ValidationError) else str(exc)
+    return JSONResponse(messages, status_code=400)
+
+
+async def api_error(request: Request, exc: Exception) -> Response:
+    status_code = getattr(exc, "status_code", 500)
+    return JSONResponse(str(exc), status_code=status_code)
+
+
+@asynccontextmanager
+async def lifespan(app: Starlette) -> AsyncIterator[None]:
+    to_thread.current_default_thread_limiter().total_tokens = ASGI_THREADS
+    yield
+
+
+app = Starlette(
+    routes=[
+        Route(f"{API_PREFIX}/maps/offset/{{map_offset}}", map_image),
+        Route(f"{API_PREFIX}/maps/ready", map_set),
+        Route(f"{API_PREFIX}/maps/legend", map_legend),
+        Route(f"{API_PREFIX}/maps/events", map_events),
+        Route(f"{API_PREFIX}/tiles", tiles_info),
+        Route(
+            f"{API_PREFIX}/tiles/{{dataset}}/{{run}}/{{layer:path}}/{{z}}/{{x}}/{{y}}",
+            tile_image,
+        ),
+    ],
+    exception_handlers={
+        ValidationError: validation_error,
+        RestApiException: api_error,
+    },
+    lifespan=lifespan,
+)
@@ -0,0 +1,147 @@
+import os
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+import click
+from maps.endpoints.config import (
+    AREAS,
+    DATASETS,
+    ENVS,
+    FIELDS,
+    FLOOD_FIELDS,
+    PLATFORMS,
+    RESOLUTIONS,
+    RUNS,
+    get_field_offsets,
+    get_image_name,
+    get_levels,
+)
+
+# offsets of the resolutions without metadata
+DEFAULT_OFFSETS = (0, 72, 1)
+
+
+def get_offsets(dataset: str, field: str) -> List[str]:
+    info = DATASETS.get(dataset)
+    if info:
+        start, end, step = info["start_offset"], info["end_offset"], info["step"]
+    else:
+        start, end, step = DEFAULT_OFFSETS
+    return get_field_offsets(field, start, end, step)
+
+
+def get_reftimes(runs: int, run: str) -> List[str]:
+    # one reftime per day, the last one being today
+    today = datetime.utcnow().replace(hour=int(run), minute=0, second=0)
+    return [
+        (today - timedelta(days=days)).strftime("%Y%m%d%H")
+        for days in reversed(range(runs))
+    ]
+
+
+def iter_map_folders(
+    root: Path, fields: List[str]
+) -> Iterator[Tuple[Path, str, List[str]]]:
+    """Yield the (area folder, dataset, fields) of the Magics and PROB runs"""
+    for platform in PLATFORMS:
+        for env in ENVS:
+            for run in RUNS:
+                magics_fields = [f for f in fields if f not in FLOOD_FIELDS]
+                for res in RESOLUTIONS:
+                    for area in AREAS:
+                        folder = root.joinpath(
+                            platform, env, f"Magics-{run}-{res}.web", area
+                        )
+                        yield folder, res, magics_fields
+                flood_fields = [f for f in fields if f in FLOOD_FIELDS]
+                if flood_fields:
+                    area = DATASETS["iff"]["area"]
+                    folder = root.joinpath(platform, env, f"PROB-{run}-iff.web", area)
+                    yield folder, "iff", flood_fields
+
+
+def link_file(template: Path, dest: Path) -> None:
+    try:
+        os.link(template, dest)
+    except FileExistsError:
+        pass
+    except OSError:
+        # e.g. a different filesystem
+        dest.write_bytes(template.read_bytes())
+
+
+def generate_tree(
+    root: Path, runs: int, image_size: int, fields: List[str]
+) -> Tuple[int, int]:
+    """
+    Create the data tree of all the platforms, envs, runs, resolutions and
+    areas, keeping the given number of runs (the older ones being leftovers).
+    All the images are hard links to the same file.
+    Return the number of images and .READY files created.
+    """
+    root.mkdir(parents=True, exist_ok=True)
+    template = root.joinpath(".benchmark.png")
+    template.write_bytes(os.urandom(image_size))
+
+    images = ready_files = 0
+    for folder, dataset, folder_fields in iter_map_folders(root, fields):
+        run = folder.parent.name.split("-")[1]
+        legends = folder.parent.joinpath("legends")
+        legends.mkdir(parents=True, exist_ok=True)
+        for reftime in get_reftimes(runs, run):
+            for field in folder_fields:
+                field_dir = folder.joinpath(field)
+                field_dir.mkdir(parents=True, exist_ok=True)
+                link_file(template, legends.joinpath(f"{field}.png"))
+                for offset in get_offsets(dataset, field):
+                    for level in get_levels(field):
+                        image_name = get_image_name(field, reftime, offset, level)
+                        link_file(template, field_dir.joinpath(image_name))
+                        images += 1
+            folder.joinpath(f"{reftime}.READY").touch()
+            ready_files += 1
+
+    # the tiles runs, metadata only
+    for platform in PLATFORMS:
+        for run in RUNS:
+            for dataset, info in DATASETS.items():
+                folder = root.joinpath(
+                    platform, "PROD", f"Tiles-{run}-{dataset}.web", info["area"]
+                )
+                folder.mkdir(parents=True, exist_ok=True)
+                for reftime in get_reftimes(runs, run):
+                    folder.joinpath(f"{reftime}.READY").touch()
+                    ready_files += 1
+
+    template.unlink()
+    return images, ready_files
+
+
+@click.command()
+@click.argument("folder", type=click.Path(file_okay=False, path_type=Path))
+@click.option("--runs", default=3, show_default=True, help="Reftimes of each run")
+@click.option(
+    "--image-size", default=50_000, show_default=True, help="Size of the images"
+)
+@click.option(
+    "--field",
+    "fields",
+    multiple=True,
+    type=click.Choice(FIELDS),
+    help="Restrict to the given fields (default all)",
+)
+def generate(folder: Path, runs: int, image_size: int, fields: Tuple[str]) -> None:
+    """
+    Build a production-like maps data tree to benchmark the endpoints.
+    The folder is required, so that the live data path is never written
+    by mistake: the generated runs would be served as real ones.
+    """
+    images, ready_files = generate_tree(
+        folder, runs, image_size, list(fields or FIELDS)
+    )
+    click.echo(f"{folder}: {images} images and {ready_files} .READY files created")
+
+
+if __name__ == "__main__":
+    generate()
@@ -0,0 +1,183 @@
+import random
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+import click
+from maps.benchmarks.datatree import get_offsets
+from maps.endpoints.config import (
+    AREAS,
+    DATASETS,
+    ENVS,
+    FIELDS,
+    FLOOD_FIELDS,
+    PLATFORMS,
+    RESOLUTIONS,
+    RUNS,
+    get_levels,
+)
+
+API_PREFIX = "/api/"
+# share of each kind of request in the generated mix
+REQUEST_MIX = {"offset": 70, "ready": 20, "legend": 5, "tiles": 5}
+ACCESS_LOG_REQUEST = re.compile(r'"(?:GET|HEAD) (\S+) HTTP/[\d.]+"')
+
+# (path, status, seconds)
+Sample = Tuple[str, int, float]
+
+
+def random_request(rng: random.Random) -> str:
+    kind = rng.choices(list(REQUEST_MIX), weights=list(REQUEST_MIX.values()))[0]
+    run = rng.choice(RUNS)
+    if kind == "tiles":
+        return f"/api/tiles?dataset={rng.choice(list(DATASETS))}&run={run}"
+
+    field = rng.choice(FIELDS)
+    res = rng.choice(RESOLUTIONS)
+    # the flood fields come from the PROB-*-iff runs, whatever the resolution
+    dataset = "iff" if field in FLOOD_FIELDS else res
+    area = DATASETS["iff"]["area"] if dataset == "iff" else rng.choice(AREAS)
+    params = f"field={field}&run={run}&res={res}&area={area}&env={rng.choice(ENVS)}"
+    level = rng.choice(get_levels(field))
+    if field == "percentile":
+        params += f"&level_pe={level}"
+    elif field == "probability":
+        params += f"&level_pr={level}"
+
+    if kind == "ready":
+        # most of the clients let the API choose the platform
+        if rng.random() < 0.2:
+            params += f"&platform={rng.choice(PLATFORMS)}"
+        return f"/api/maps/ready?{params}"
+    params += f"&platform={rng.choice(PLATFORMS)}"
+    if kind == "legend":
+        return f"/api/maps/legend?{params}"
+    offset = rng.choice(get_offsets(dataset, field))
+    return f"/api/maps/offset/{offset}?{params}"
+
+
+def read_access_log(path: Path) -> List[str]:
+    """Extract the API requests from an nginx access log (combined format)"""
+    requests = []
+    with open(path) as f:
+        for line in f:
+            match = ACCESS_LOG_REQUEST.search(line)
+            if match and match.group(1).startswith(API_PREFIX):
+                requests.append(match.group(1))
+    return requests
+
+
+def get_app_client() -> Callable[[str], int]:
+    """Send the requests in process, to the Flask app"""
+    from restapi.server import create_app
+
+    app = create_app(name="Maps benchmarks")
+    local = threading.local()
+
+    def send(path: str) -> int:
+        if not hasattr(local, "client"):
+            local.client = app.test_client()
+        response = local.client.get(path)
+        # consume the body as a real client would
+        response.get_data()
+        return response.status_code
+
+    return send
+
+
+def get_http_client(url: str) -> Callable[[str], int]:
+    """Send the requests to a running server"""
+
+    def send(path: str) -> int:
+        try:
+            with urlopen(f"{url.rstrip('/')}{path}") as response:
+                response.read()
+                return int(response.status)
+        except HTTPError as exc:
+            return exc.code
+
+    return send
+
+
+def run_load(
+    send: Callable[[str], int], paths: List[str], concurrency: int
+) -> Tuple[List[Sample], float]:
+    def timed(path: str) -> Sample:
+        start = time.perf_counter()
+        status = send(path)
+        return path, status, time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        samples = list(executor.map(timed, paths))
+    return samples, time.perf_counter() - start
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+
+def get_endpoint(path: str) -> str:
+    # /api/maps/offset/0003?... -> maps/offset
+    parts = path[len(API_PREFIX) :].split("?")[0].split("/")
+    return "/".join(parts[:2])
+
+
+def report(samples: List[Sample], elapsed: float) -> None:
+    groups: Dict[str, List[float]] = defaultdict(list)
+    for path, _, seconds in samples:
+        groups["all"].append(seconds)
+        groups[get_endpoint(path)].append(seconds)
+
+    statuses = Counter(status for _, status, _ in samples)
+    click.echo(f"{len(samples)} requests in {elapsed:.2f}s")
+    click.echo(f"throughput: {len(samples) / elapsed:.1f} req/s")
+    click.echo("status: " + ", ".join(f"{s}={n}" for s, n in sorted(statuses.items())))
+    click.echo(f"{'endpoint':<16}{'count':>8}{'p50 ms':>10}{'p99 ms':>10}")
+    for name, values in sorted(groups.items()):
+        p50, p99 = percentile(values, 50) * 1000, percentile(values, 99) * 1000
+        click.echo(f"{name:<16}{len(values):>8}{p50:>10.2f}{p99:>10.2f}")
+
+
+@click.command()
+@click.option("--requests", default=10_000, show_default=True, help="Total requests")
+@click.option("--concurrency", default=8, show_default=True, help="Parallel clients")
+@click.option(
+    "--replay",
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+    help="Replay the API requests of an nginx access log",
+)
+@click.option("--url", help="Base URL of a running server (default in process)")
+@click.option("--seed", default=0, help="Seed of the generated request mix")
+def load(
+    requests: int,
+    concurrency: int,
+    replay: Optional[Path],
+    url: Optional[str],
+    seed: int,
+) -> None:
+    """Load the maps API with a realistic request mix and report the latencies"""
+    if replay:
+        paths = read_access_log(replay)[:requests]
+    else:
+        rng = random.Random(seed)
+        paths = [random_request(rng) for _ in range(requests)]
+    if not paths:
+        raise click.ClickException("No requests to send")
+
+    send = get_http_client(url) if url else get_app_client()
+    # warm up the caches and the lazy initializations
+    run_load(send, paths[: min(100, len(paths))], concurrency)
+    samples, elapsed = run_load(send, paths, concurrency)
+    report(samples, elapsed)
+
+
+if __name__ == "__main__":
+    load()
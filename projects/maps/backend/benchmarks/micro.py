@@ -0,0 +1,73 @@
+import timeit
+from typing import Callable, List, Tuple
+
+import click
+from maps.benchmarks.load import get_app_client
+from maps.endpoints.catalog import catalog, scan_area
+from maps.endpoints.config import (
+    AREAS,
+    DEFAULT_PLATFORM,
+    ENVS,
+    RESOLUTIONS,
+    RUNS,
+    get_base_path,
+    get_ready_file,
+)
+
+# (name, function)
+Benchmark = Tuple[str, Callable[[], object]]
+
+
+def get_benchmarks(field: str) -> List[Benchmark]:
+    platform, env, run, res, area = (
+        DEFAULT_PLATFORM,
+        ENVS[0],
+        RUNS[0],
+        RESOLUTIONS[0],
+        AREAS[0],
+    )
+    base_path = get_base_path(field, platform, env, run, res)
+    area_path = base_path.joinpath(area)
+    uncached_base_path = getattr(get_base_path, "__wrapped__")
+    send = get_app_client()
+    params = f"field={field}&run={run}&res={res}&area={area}&env={env}"
+
+    return [
+        (
+            "get_base_path",
+            lambda: get_base_path(field, platform, env, run, res),
+        ),
+        (
+            "get_base_path (uncached)",
+            lambda: uncached_base_path(field, platform, env, run, res),
+        ),
+        ("get_ready_file", lambda: get_ready_file(base_path, area)),
+        ("scan_area", lambda: scan_area(area_path)),
+        (
+            "catalog.get_offsets",
+            lambda: catalog.get_offsets(base_path, area, field),
+        ),
+        (
+            "MapSet",
+            lambda: send(f"/api/maps/ready?{params}&platform={platform}"),
+        ),
+        ("MapSet (any platform)", lambda: send(f"/api/maps/ready?{params}")),
+    ]
+
+
+@click.command()
+@click.option("--field", default="t2m", show_default=True, help="Field to look up")
+@click.option("--repeat", default=5, show_default=True, help="Timing rounds")
+def micro(field: str, repeat: int) -> None:
+    """Time the lookups done by the maps endpoints on the current data tree"""
+    click.echo(f"{'benchmark':<28}{'calls':>10}{'best us':>12}{'mean us':>12}")
+    for name, function in get_benchmarks(field):
+        timer = timeit.Timer(function)
+        number, _ = timer.autorange()
+        timings = [t / number * 1e6 for t in timer.repeat(repeat, number)]
+        mean = sum(timings) / len(timings)
+        click.echo(f"{name:<28}{number:>10}{min(timings):>12.2f}{mean:>12.2f}")
+
+
+if __name__ == "__main__":
+    micro()
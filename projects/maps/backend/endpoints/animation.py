@@ -0,0 +1,149 @@
+import io
+import math
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple, Type
+
+from flask import Response
+from maps.endpoints.cache import build_file, prune_files
+from maps.endpoints.catalog import catalog, read_map
+from maps.endpoints.config import (
+    ANIMATION_MEMORY_SIZE,
+    get_base_path,
+    get_cache_path,
+    get_image_name,
+    get_level,
+)
+from maps.endpoints.delivery import send_map_file
+from maps.endpoints.maps import get_schema_attributes
+from maps.endpoints.metrics import instrument
+from PIL import Image
+from restapi import decorators
+from restapi.exceptions import NotFound
+from restapi.models import Schema, fields, validate
+from restapi.rest.definition import EndpointResource
+from restapi.utilities.logs import log
+
+ANIMATION_FORMATS = {
+    "webp": ("WEBP", "image/webp"),
+    "apng": ("PNG", "image/apng"),
+}
+
+
+def get_animation_schema() -> Type[Schema]:
+    attributes = get_schema_attributes(True)
+    attributes["format"] = fields.Str(
+        validate=validate.OneOf(ANIMATION_FORMATS.keys()), required=False
+    )
+    attributes["step"] = fields.Int(validate=validate.Range(min=1), required=False)
+    attributes["duration"] = fields.Int(
+        validate=validate.Range(min=50, max=5000), required=False
+    )
+    return Schema.from_dict(attributes, name="MapsAnimationSchema")
+
+
+def get_frame_size(width: int, height: int, count: int) -> Tuple[int, int]:
+    """The size of the frames keeping all of them within the memory budget"""
+    # RGBA pixels available to each frame
+    budget = ANIMATION_MEMORY_SIZE * 1024 * 1024 // (4 * count)
+    if width * height <= budget:
+        return width, height
+    scale = math.sqrt(budget / (width * height))
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+
+def load_frames(
+    base_path: Path, area: str, keys: List[str], reftime: str
+) -> Iterator[Image.Image]:
+    """
+    Decode the frames of an animation, one at a time, scaled down if the
+    whole animation does not fit into the memory budget
+    """
+    size: Optional[Tuple[int, int]] = None
+    for key in keys:
+        with Image.open(io.BytesIO(read_map(base_path, area, key, reftime))) as img:
+            if size is None:
+                size = get_frame_size(img.width, img.height, len(keys))
+            frame = img.convert("RGBA")
+        if frame.size != size:
+            frame = frame.resize(size, Image.LANCZOS)
+        yield frame
+
+
+def build_animation(
+    frames: Iterator[Image.Image], image_format: str, duration: int, dest: Path
+) -> None:
+    first = next(frames)
+    first.save(
+        dest,
+        format=image_format,
+        save_all=True,
+        append_images=list(frames),
+        duration=duration,
+        loop=0,
+    )
+
+
+class MapAnimation(EndpointResource):
+    labels = ["maps"]
+
+    @decorators.use_kwargs(get_animation_schema(), location="query")
+    @decorators.endpoint(
+        path="/maps/animation",
+        summary="Get the animated forecast maps of the last run.",
+        responses={
+            200: "Map animation successfully retrieved",
+            400: "Invalid parameters",
+            404: "Map animation does not exists",
+        },
+    )
+    @instrument
+    def get(
+        self,
+        run: str,
+        res: str,
+        field: str,
+        area: str,
+        platform: str,
+        level_pe: Optional[str] = None,
+        level_pr: Optional[str] = None,
+        env: str = "PROD",
+        format: str = "webp",
+        step: int = 1,
+        duration: int = 500,
+    ) -> Response:
+        """Get an animated image of all the maps of a run (one every step offsets)."""
+        log.debug("Retrieve map animation for run <{}, {}, {}>", run, res, field)
+
+        level = get_level(field, level_pe, level_pr)
+        base_path = get_base_path(field, platform, env, run, res)
+
+        # Check if the images are ready: 2017112900.READY
+        reftime = catalog.get_reftime(base_path, area)
+        if not reftime:
+            raise NotFound("no .READY files found")
+
+        offsets = catalog.get_offsets(base_path, area, field, level, reftime)[::step]
+        if not offsets:
+            raise NotFound(f"No maps found for field <{field}>")
+
+        frames = [
+            f"{field}/{get_image_name(field, reftime, offset, level)}"
+            for offset in offsets
+        ]
+
+        image_format, mime = ANIMATION_FORMATS[format]
+        cache_path = get_cache_path("animations", base_path, area, field)
+        product = f"{field}_{level}" if level else field
+        animation_file = cache_path.joinpath(
+            f"{product}.{reftime}.{step}-{duration}.{format}"
+        )
+
+        def build(dest: Path) -> None:
+            # built once per run: the animations of the previous runs
+            # are dropped as soon as the new one is requested
+            prune_files(cache_path, reftime)
+            images = load_frames(base_path, area, frames, reftime)
+            build_animation(images, image_format, duration, dest)
+
+        build_file(animation_file, build)
+        return send_map_file(animation_file, reftime, animation_file.name, mime=mime)
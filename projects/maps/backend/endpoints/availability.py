@@ -0,0 +1,143 @@
+import hashlib
+import json
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Hashable, Iterator, List, Tuple
+
+from flask import Response
+from maps.endpoints.cache import ReadyCache
+from maps.endpoints.catalog import LEVEL_FIELDS, OffsetKey, catalog
+from maps.endpoints.config import (
+    AREAS,
+    DATASETS,
+    ENVS,
+    PLATFORMS,
+    RESOLUTIONS,
+    RUNS,
+    get_base_path,
+)
+from maps.endpoints.delivery import FileValidators, is_not_modified, set_cache_headers
+from maps.endpoints.health import platform_monitor
+from maps.endpoints.metrics import instrument
+from restapi import decorators
+from restapi.rest.definition import EndpointResource
+
+# version of the layout of the document, increased on breaking changes
+CATALOG_FORMAT = 1
+
+# (kind, platform, env, run, dataset, area) of each run folder
+FolderKey = Tuple[str, str, str, str, str, str]
+
+# the whole document, valid until any of the run folders changes
+availability_cache = ReadyCache("availability", maxsize=1)
+
+
+def iter_folders(platforms: List[str]) -> Iterator[Tuple[FolderKey, Path]]:
+    """All the area folders where maps and tiles can be found"""
+    for platform in platforms:
+        for env in ENVS:
+            for run in RUNS:
+                for res in RESOLUTIONS:
+                    base_path = get_base_path("t2m", platform, env, run, res)
+                    for area in AREAS:
+                        yield ("maps", platform, env, run, res, area), base_path
+                # flash flood maps
+                base_path = get_base_path("percentile", platform, env, run, "")
+                for area in AREAS:
+                    yield ("maps", platform, env, run, "iff", area), base_path
+                for dataset, info in DATASETS.items():
+                    base_path = get_base_path("tiles", platform, env, run, dataset)
+                    key = ("tiles", platform, env, run, dataset, info["area"])
+                    yield key, base_path
+
+
+def get_fields(offsets: Dict[OffsetKey, List[str]], reftime: str) -> Dict[str, Any]:
+    """Offsets of each field of a run, by level for the flash flood maps"""
+    fields: Dict[str, Any] = {}
+    for (run_reftime, field, level), field_offsets in sorted(
+        offsets.items(), key=lambda item: (item[0][1], item[0][2] or "")
+    ):
+        if run_reftime != reftime:
+            continue
+        if field in LEVEL_FIELDS:
+            fields.setdefault(field, {})[level] = field_offsets
+        else:
+            fields[field] = field_offsets
+    return fields
+
+
+def build_document() -> Dict[str, Any]:
+    platforms = {pl: platform_monitor.is_up(pl) for pl in PLATFORMS}
+    maps: List[Dict[str, Any]] = []
+    tiles: List[Dict[str, Any]] = []
+    # the folders of the unavailable platforms are never accessed
+    for key, base_path in iter_folders([pl for pl, up in platforms.items() if up]):
+        kind, platform, env, run, dataset, area = key
+        entry = catalog.area(base_path, area)
+        if not entry.reftime:
+            continue
+        run_info: Dict[str, Any] = {
+            "platform": platform,
+            "env": env,
+            "run": run,
+            "area": area,
+            "reftime": entry.reftime,
+            "reftimes": list(entry.reftimes),
+        }
+        if kind == "tiles":
+            info = DATASETS[dataset]
+            run_info["dataset"] = dataset
+            run_info["start_offset"] = info["start_offset"]
+            run_info["end_offset"] = info["end_offset"]
+            run_info["step"] = info["step"]
+            run_info["boundaries"] = info["boundaries"]
+            tiles.append(run_info)
+        else:
+            run_info["res"] = dataset
+            run_info["fields"] = get_fields(entry.offsets, entry.reftime)
+            maps.append(run_info)
+    return {
+        "format": CATALOG_FORMAT,
+        "platforms": platforms,
+        "maps": maps,
+        "tiles": tiles,
+    }
+
+
+def get_availability() -> Tuple[bytes, FileValidators]:
+    """The availability document, serialized, along with its validators"""
+    cache_token: Hashable = (platform_monitor.generation,) + tuple(
+        catalog.version(base_path, key[5]) for key, base_path in iter_folders(PLATFORMS)
+    )
+    if cached := availability_cache.get("availability", cache_token):
+        return cached
+
+    document = build_document()
+    content = json.dumps(document, sort_keys=True, separators=(",", ":"))
+    digest = hashlib.sha1(content.encode()).hexdigest()
+    # the version is the digest of the content, i.e. the ETag
+    document["version"] = digest
+    body = json.dumps(document, separators=(",", ":")).encode()
+    last_modified = datetime.now(timezone.utc).replace(microsecond=0)
+    result = (body, FileValidators(digest, last_modified, len(body)))
+    availability_cache.set("availability", cache_token, result)
+    return result
+
+
+class MapCatalog(EndpointResource):
+    labels = ["maps"]
+
+    @decorators.endpoint(
+        path="/maps/catalog",
+        summary="Get the available runs of all the maps and tiled datasets.",
+        responses={200: "Catalog successfully retrieved"},
+    )
+    @instrument
+    def get(self) -> Response:
+        """Get the reftime and offsets of every map set and tiled dataset."""
+        body, validators = get_availability()
+        if is_not_modified(validators):
+            response = Response(status=304)
+        else:
+            response = Response(body, mimetype="application/json")
+        return set_cache_headers(response, validators, None)
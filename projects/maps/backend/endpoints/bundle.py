@@ -0,0 +1,314 @@
+import hashlib
+import struct
+import zlib
+from datetime import datetime
+from functools import lru_cache, partial
+from pathlib import Path
+from typing import Callable, Iterator, List, NamedTuple, Optional, Tuple, Type, Union
+
+from flask import Response, request
+from maps.endpoints.catalog import catalog
+from maps.endpoints.config import get_base_path, get_image_name, get_level
+from maps.endpoints.delivery import (
+    FileValidators,
+    get_packed_validators,
+    get_validators,
+    is_not_modified,
+    set_cache_headers,
+)
+from maps.endpoints.maps import get_schema_attributes
+from maps.endpoints.metrics import instrument
+from restapi import decorators
+from restapi.exceptions import NotFound
+from restapi.models import Schema, fields
+from restapi.rest.definition import EndpointResource
+from restapi.utilities.logs import log
+from werkzeug.datastructures import ContentRange
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
+
+CHUNK_SIZE = 256 * 1024
+
+# zip records (stored entries, no data descriptor)
+LOCAL_HEADER = struct.Struct("<IHHHHHIIIHH")
+CENTRAL_HEADER = struct.Struct("<IHHHHHHIIIHHHHHII")
+END_RECORD = struct.Struct("<IHHHHIIH")
+ZIP_VERSION = 20
+
+
+class BundleMember(NamedTuple):
+    name: str
+    # a loose file or a slice of the run archive
+    source: Union[Path, memoryview]
+    validators: FileValidators
+
+
+@lru_cache(maxsize=16384)
+def get_crc32(path: Path, etag: str) -> int:
+    crc = 0
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+
+def member_crc32(m: BundleMember) -> int:
+    if isinstance(m.source, Path):
+        return get_crc32(m.source, m.validators.etag)
+    return zlib.crc32(m.source)
+
+
+def dos_datetime(dt: datetime) -> Tuple[int, int]:
+    dos_time = (dt.hour << 11) | (dt.minute << 5) | (dt.second // 2)
+    dos_date = ((dt.year - 1980) << 9) | (dt.month << 5) | dt.day
+    return dos_time, dos_date
+
+
+def read_file(path: Path, start: int, stop: int) -> Iterator[bytes]:
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = stop - start
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                raise OSError(f"{path} is shorter than expected")
+            remaining -= len(chunk)
+            yield chunk
+
+
+class ZipBundle:
+    """
+    Uncompressed zip archive of a set of files, generated lazily.
+    The layout only depends on names and sizes, so that the archive length
+    is known in advance and any byte range can be produced on its own.
+    """
+
+    def __init__(self, members: List[BundleMember]) -> None:
+        self.members = members
+        self.header_offsets: List[int] = []
+        position = 0
+        for m in members:
+            self.header_offsets.append(position)
+            position += LOCAL_HEADER.size + len(m.name.encode()) + m.validators.size
+        self.central_offset = position
+        self.central_size = sum(
+            CENTRAL_HEADER.size + len(m.name.encode()) for m in members
+        )
+        self.size = self.central_offset + self.central_size + END_RECORD.size
+
+    @property
+    def etag(self) -> str:
+        etags = ":".join(m.validators.etag for m in self.members)
+        return hashlib.sha1(etags.encode()).hexdigest()
+
+    @property
+    def last_modified(self) -> datetime:
+        return max(m.validators.last_modified for m in self.members)
+
+    def local_header(self, m: BundleMember) -> bytes:
+        name = m.name.encode()
+        dos_time, dos_date = dos_datetime(m.validators.last_modified)
+        size = m.validators.size
+        crc = member_crc32(m)
+        return (
+            LOCAL_HEADER.pack(
+                0x04034B50,
+                ZIP_VERSION,
+                0,
+                0,
+                dos_time,
+                dos_date,
+                crc,
+                size,
+                size,
+                len(name),
+                0,
+            )
+            + name
+        )
+
+    def central_directory(self) -> bytes:
+        records: List[bytes] = []
+        for m, header_offset in zip(self.members, self.header_offsets):
+            name = m.name.encode()
+            dos_time, dos_date = dos_datetime(m.validators.last_modified)
+            size = m.validators.size
+            crc = member_crc32(m)
+            records.append(
+                CENTRAL_HEADER.pack(
+                    0x02014B50,
+                    ZIP_VERSION,
+                    ZIP_VERSION,
+                    0,
+                    0,
+                    dos_time,
+                    dos_date,
+                    crc,
+                    size,
+                    size,
+                    len(name),
+                    0,
+                    0,
+                    0,
+                    0,
+                    0,
+                    header_offset,
+                )
+                + name
+            )
+        return b"".join(records)
+
+    def end_record(self) -> bytes:
+        n = len(self.members)
+        return END_RECORD.pack(
+            0x06054B50, 0, 0, n, n, self.central_size, self.central_offset, 0
+        )
+
+    def segments(
+        self,
+    ) -> Iterator[Tuple[int, Union[Callable[[], bytes], Path, memoryview]]]:
+        for m in self.members:
+            yield LOCAL_HEADER.size + len(m.name.encode()), partial(
+                self.local_header, m
+            )
+            yield m.validators.size, m.source
+        yield self.central_size, self.central_directory
+        yield END_RECORD.size, self.end_record
+
+    def stream(self, start: int, stop: int) -> Iterator[bytes]:
+        """Produce the [start, stop) byte range of the archive"""
+        position = 0
+        for length, source in self.segments():
+            segment_start = position
+            position += length
+            if position <= start:
+                continue
+            if segment_start >= stop:
+                break
+            lo = max(start, segment_start) - segment_start
+            hi = min(stop, position) - segment_start
+            if isinstance(source, Path):
+                yield from read_file(source, lo, hi)
+            elif isinstance(source, memoryview):
+                yield bytes(source[lo:hi])
+            else:
+                yield source()[lo:hi]
+
+
+def get_bundle_schema() -> Type[Schema]:
+    attributes = get_schema_attributes(True)
+    attributes["offset_from"] = fields.Int(required=False)
+    attributes["offset_to"] = fields.Int(required=False)
+    return Schema.from_dict(attributes, name="MapsBundleSchema")
+
+
+def get_byte_range(bundle: ZipBundle) -> Optional[Tuple[int, int]]:
+    """Return the requested byte range, if any and still valid for the bundle"""
+    byte_range = request.range
+    if not byte_range or len(byte_range.ranges) != 1:
+        return None
+    # If-Range: ignore the range if the bundle has changed in the meantime
+    if_range = request.if_range
+    if if_range.etag and if_range.etag != bundle.etag:
+        return None
+    if if_range.date and bundle.last_modified > if_range.date:
+        return None
+    requested = byte_range.range_for_length(bundle.size)
+    if not requested:
+        raise RequestedRangeNotSatisfiable(length=bundle.size)
+    return requested
+
+
+class MapBundle(EndpointResource):
+    labels = ["maps"]
+
+    @decorators.use_kwargs(get_bundle_schema(), location="query")
+    @decorators.endpoint(
+        path="/maps/bundle",
+        summary="Get all the forecast maps of a run in a single zip archive.",
+        responses={
+            200: "Map bundle successfully retrieved",
+            206: "Partial map bundle successfully retrieved",
+            400: "Invalid parameters",
+            404: "Map bundle does not exists",
+            416: "Requested range not satisfiable",
+        },
+    )
+    @instrument
+    def get(
+        self,
+        run: str,
+        res: str,
+        field: str,
+        area: str,
+        platform: str,
+        level_pe: Optional[str] = None,
+        level_pr: Optional[str] = None,
+        env: str = "PROD",
+        offset_from: Optional[int] = None,
+        offset_to: Optional[int] = None,
+    ) -> Response:
+        """Get all the forecast maps of a run, optionally in an offset range."""
+        log.debug("Retrieve map bundle for run <{}, {}, {}>", run, res, field)
+
+        level = get_level(field, level_pe, level_pr)
+        base_path = get_base_path(field, platform, env, run, res)
+
+        # Check if the images are ready: 2017112900.READY
+        reftime = catalog.get_reftime(base_path, area)
+        if not reftime:
+            raise NotFound("no .READY files found")
+
+        offsets = [
+            offset
+            for offset in catalog.get_offsets(base_path, area, field, level, reftime)
+            if (offset_from is None or int(offset) >= offset_from)
+            and (offset_to is None or int(offset) <= offset_to)
+        ]
+        if not offsets:
+            raise NotFound("No maps found for the requested offsets")
+
+        image_path = base_path.joinpath(area, field)
+        reader = catalog.get_pack_reader(base_path, area, reftime)
+        members: List[BundleMember] = []
+        for offset in offsets:
+            image_name = get_image_name(field, reftime, offset, level)
+            map_offset = f"{offset}_{level}" if level else offset
+            key = f"{field}/{image_name}"
+            packed = reader.get(key) if reader else None
+            if reader and packed is not None:
+                packed_validators = get_packed_validators(reader, key, reftime)
+                if packed_validators:
+                    members.append(BundleMember(image_name, packed, packed_validators))
+                    continue
+            map_image_file = image_path.joinpath(image_name)
+            try:
+                validators = get_validators(map_image_file, reftime, map_offset)
+            except OSError:
+                raise NotFound(f"Map image not found for offset {map_offset}")
+            members.append(BundleMember(image_name, map_image_file, validators))
+
+        bundle = ZipBundle(members)
+        bundle_validators = FileValidators(
+            bundle.etag, bundle.last_modified, bundle.size
+        )
+
+        if is_not_modified(bundle_validators):
+            response = Response(status=304)
+        else:
+            byte_range = get_byte_range(bundle)
+            start, stop = byte_range or (0, bundle.size)
+            response = Response(
+                bundle.stream(start, stop),
+                status=206 if byte_range else 200,
+                mimetype="application/zip",
+                direct_passthrough=True,
+            )
+            response.content_length = stop - start
+            if byte_range:
+                response.content_range = ContentRange("bytes", start, stop, bundle.size)
+            product = f"{field}_{level}" if level else field
+            filename = f"{product}-{run}-{res}-{area}-{reftime}.zip"
+            response.headers["Content-Disposition"] = f"attachment; filename={filename}"
+
+        response.accept_ranges = "bytes"
+        return set_cache_headers(response, bundle_validators, reftime)
@@ -0,0 +1,282 @@
+import fcntl
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+from maps.endpoints.metrics import count_cache
+from restapi.utilities.logs import log
+
+
+class ReadyCache:
+    """
+    LRU cache of responses depending on the run folders.
+
+    Each entry is stored along with a token built from the catalog versions
+    of the area folders the response was computed from: an entry is valid as
+    long as the token is the same, i.e. until a new .READY file lands.
+    """
+
+    def __init__(self, name: str, maxsize: int = 1024) -> None:
+        self.name = name
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[Hashable, Tuple[Hashable, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, token: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                count_cache(self.name, False)
+                return None
+            if entry[0] != token:
+                del self._entries[key]
+                count_cache(self.name, False)
+                return None
+            self._entries.move_to_end(key)
+            count_cache(self.name, True)
+            return entry[1]
+
+    def set(self, key: Hashable, token: Hashable, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = (token, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class MemoryCache:
+    """
+    LRU cache of bytes bounded by their total size.
+    The evicted entries are handed to on_evict (e.g. to spill them to disk).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_size: int,
+        on_evict: Optional[Callable[[Hashable, bytes], None]] = None,
+    ) -> None:
+        self.name = name
+        self.max_size = max_size
+        self.on_evict = on_evict
+        self.size = 0
+        self._entries: "OrderedDict[Hashable, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[bytes]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+        count_cache(self.name, value is not None)
+        return value
+
+    def set(self, key: Hashable, value: bytes) -> None:
+        if len(value) > self.max_size:
+            return
+        evicted: List[Tuple[Hashable, bytes]] = []
+        with self._lock:
+            if old := self._entries.pop(key, None):
+                self.size -= len(old)
+            self._entries[key] = value
+            self.size += len(value)
+            while self.size > self.max_size:
+                evicted_key, evicted_value = self._entries.popitem(last=False)
+                self.size -= len(evicted_value)
+                evicted.append((evicted_key, evicted_value))
+        if self.on_evict:
+            for evicted_key, evicted_value in evicted:
+                self.on_evict(evicted_key, evicted_value)
+
+
+class SegmentedLRUCache:
+    """
+    Byte-bounded cache with a segmented LRU policy.
+
+    New entries enter the probation segment and are promoted to the protected
+    one when requested again: entries requested only once (crawlers, bulk
+    downloads) are evicted first and cannot flush the frequently used ones.
+    """
+
+    def __init__(self, name: str, max_size: int, protected_ratio: float = 0.8):
+        self.name = name
+        self.max_size = max_size
+        self.max_protected = int(max_size * protected_ratio)
+        # (value, size) by key, least recently used first
+        self._probation: "OrderedDict[Hashable, Tuple[Any, int]]" = OrderedDict()
+        self._protected: "OrderedDict[Hashable, Tuple[Any, int]]" = OrderedDict()
+        self._probation_size = 0
+        self._protected_size = 0
+        self._lock = threading.Lock()
+
+    @property
+    def size(self) -> int:
+        return self._probation_size + self._protected_size
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._protected.get(key)
+            if entry is not None:
+                self._protected.move_to_end(key)
+            elif (entry := self._probation.pop(key, None)) is not None:
+                self._probation_size -= entry[1]
+                self._protected[key] = entry
+                self._protected_size += entry[1]
+                # demote the least recently used protected entries
+                while self._protected_size > self.max_protected:
+                    old_key, old_entry = self._protected.popitem(last=False)
+                    self._protected_size -= old_entry[1]
+                    self._probation[old_key] = old_entry
+                    self._probation_size += old_entry[1]
+                self._trim()
+        count_cache(self.name, entry is not None)
+        return entry[0] if entry is not None else None
+
+    def set(self, key: Hashable, value: Any, size: int) -> None:
+        # an entry must not flush the whole probation segment
+        if size > self.max_size - self.max_protected:
+            return
+        with self._lock:
+            if key in self._protected or key in self._probation:
+                return
+            self._probation[key] = (value, size)
+            self._probation_size += size
+            self._trim()
+
+    def discard(self, predicate: Callable[[Hashable], bool]) -> None:
+        """Remove the entries whose key satisfies the predicate"""
+        with self._lock:
+            for key in [k for k in self._probation if predicate(k)]:
+                self._probation_size -= self._probation.pop(key)[1]
+            for key in [k for k in self._protected if predicate(k)]:
+                self._protected_size -= self._protected.pop(key)[1]
+
+    def _trim(self) -> None:
+        while self.size > self.max_size:
+            if self._probation:
+                _, entry = self._probation.popitem(last=False)
+                self._probation_size -= entry[1]
+            else:
+                _, entry = self._protected.popitem(last=False)
+                self._protected_size -= entry[1]
+
+
+def build_file(path: Path, build: Callable[[Path], None]) -> Path:
+    """
+    Create a cached file once: concurrent requests, also from other workers,
+    wait for the first one to complete it instead of building it again
+    """
+    if path.is_file():
+        return path
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path.with_name(f".{path.name}.lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            if not path.is_file():
+                tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+                try:
+                    build(tmp_path)
+                    os.replace(tmp_path, path)
+                finally:
+                    tmp_path.unlink(missing_ok=True)
+                log.info("{} created", path)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+    return path
+
+
+def prune_files(folder: Path, reftime: str) -> None:
+    """Remove the cached files not belonging to the given run"""
+    try:
+        cached_files = list(folder.iterdir())
+    except OSError:
+        return
+    for f in cached_files:
+        if f".{reftime}." not in f.name:
+            log.debug("Removing outdated {}", f)
+            f.unlink(missing_ok=True)
+
+
+class DiskCache:
+    """
+    Size-bounded folder of cached files with LRU eviction.
+
+    The modification time of the files is used as LRU clock, refreshed on
+    access at most once every touch_interval seconds, so that the workers
+    sharing the folder agree on which files are the least recently used.
+    """
+
+    def __init__(
+        self, name: str, root: Path, max_size: int, touch_interval: int = 600
+    ) -> None:
+        self.name = name
+        self.root = root
+        self.max_size = max_size
+        self.touch_interval = touch_interval
+        # size of the folder as estimated by this worker
+        self._size: Optional[int] = None
+        self._touched: Dict[Path, float] = {}
+        self._lock = threading.Lock()
+
+    def get_or_build(self, path: Path, build: Callable[[Path], None]) -> Path:
+        if path.is_file():
+            count_cache(self.name, True)
+            self.touch(path)
+            return path
+        count_cache(self.name, False)
+        build_file(path, build)
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan_size()
+            self._size += path.stat().st_size
+            if self._size > self.max_size:
+                self._evict()
+        return path
+
+    def touch(self, path: Path) -> None:
+        now = time.time()
+        if now - self._touched.get(path, 0) < self.touch_interval:
+            return
+        self._touched[path] = now
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def _files(self) -> List[Tuple[float, int, Path]]:
+        cached_files: List[Tuple[float, int, Path]] = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                # skip locks and files being written
+                if name.startswith("."):
+                    continue
+                path = Path(dirpath, name)
+                try:
+                    stat = path.stat()
+                except OSError:
+                    continue
+                cached_files.append((stat.st_mtime, stat.st_size, path))
+        return cached_files
+
+    def _scan_size(self) -> int:
+        return sum(size for _, size, _ in self._files())
+
+    def _evict(self) -> None:
+        # other workers may have added (or evicted) files as well
+        cached_files = sorted(self._files())
+        self._size = sum(size for _, size, _ in cached_files)
+        target = self.max_size * 0.9
+        for _, size, path in cached_files:
+            if self._size <= target:
+                break
+            log.debug("Evicting {} from {}", path, self.root)
+            path.unlink(missing_ok=True)
+            self._touched.pop(path, None)
+            self._size -= size
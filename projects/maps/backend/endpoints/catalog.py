@@ -0,0 +1,663 @@
+import bisect
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import threading
+import time
+from dataclasses import dataclass, field
+from functools import partial
+from pathlib import Path
+from typing import Callable, Dict, Hashable, List, Optional, Set, Tuple
+
+from maps.endpoints.config import (
+    CATALOG_POLL_INTERVAL,
+    CATALOG_SCAN_TIMEOUT,
+    CATALOG_WATCHER,
+    PLATFORMS,
+    is_ready_file,
+)
+from maps.endpoints.health import platform_monitor
+from maps.endpoints.manifest import MANIFEST_SUFFIX, get_manifest_path, read_manifest
+from maps.endpoints.metrics import FS_CALLS, SCAN_LATENCY
+from maps.endpoints.packfile import PACK_SUFFIX, PackReader, close_packs, open_pack
+from restapi.config import DATA_PATH, TESTING
+from restapi.utilities.logs import log
+
+# DATA_PATH/<platform>/<env>/<prefix>-<run>-<dataset>.web/<area>/<field>
+PLATFORM_DEPTH = 1
+AREA_DEPTH = 4
+FIELD_DEPTH = 5
+
+LEVEL_FIELDS = ("percentile", "probability")
+
+# (reftime, field, level)
+OffsetKey = Tuple[str, str, Optional[str]]
+# called with the area folder and the reftime of each new run
+RunListener = Callable[[Path, str], None]
+# reads a map (or legend) image given its base path, area, key and reftime
+MapReader = Callable[[Path, str, str, str], bytes]
+
+
+@dataclass
+class AreaEntry:
+    # sorted, the last one is the most recent run
+    reftimes: List[str] = field(default_factory=list)
+    offsets: Dict[OffsetKey, List[str]] = field(default_factory=dict)
+    # reftimes whose files are (also) packed in a single archive
+    packed: List[str] = field(default_factory=list)
+    generation: int = 0
+
+    @property
+    def reftime(self) -> Optional[str]:
+        if not self.reftimes:
+            return None
+        return self.reftimes[-1]
+
+    def find(self, reftime: Optional[str] = None) -> Optional[str]:
+        """Return the given run if available, the most recent one by default"""
+        if not reftime:
+            return self.reftime
+        i = bisect.bisect_left(self.reftimes, reftime)
+        if i < len(self.reftimes) and self.reftimes[i] == reftime:
+            return reftime
+        return None
+
+
+EMPTY_AREA = AreaEntry()
+
+
+def parse_map_name(field_name: str, name: str) -> Optional[OffsetKey]:
+    """
+    Split a map file name into its (reftime, offset, level) parts:
+    <field>.<reftime>.<offset>.png or <perc6|prob6>.<reftime>.<offset>_<level>.png
+    """
+    parts = name.split(".")
+    if len(parts) < 4:
+        return None
+    reftime = parts[-3]
+    offset = parts[-2]
+    level: Optional[str] = None
+    if field_name in LEVEL_FIELDS:
+        # flash flood offset is like this: 0006_10
+        offset, sep, level = offset.partition("_")
+        if not sep:
+            return None
+    return reftime, offset, level
+
+
+@SCAN_LATENCY.time()
+def scan_area(area_path: Path) -> AreaEntry:
+    """Build the catalog entry of an area folder by listing it"""
+    entry = AreaEntry()
+    FS_CALLS.labels("scan_area", "scandir").inc()
+    try:
+        children = list(os.scandir(area_path))
+    except OSError:
+        return entry
+
+    offsets: Dict[OffsetKey, Set[str]] = {}
+    # runs whose maps are already listed by their manifest
+    listed: Set[str] = set()
+
+    def add_map(field_name: str, name: str) -> None:
+        parsed = parse_map_name(field_name, name)
+        if parsed and parsed[0] not in listed:
+            reftime, offset, level = parsed
+            offsets.setdefault((reftime, field_name, level), set()).add(offset)
+
+    manifests: List[str] = []
+    field_dirs: List[os.DirEntry] = []
+    for child in children:
+        if child.is_file():
+            if is_ready_file(child.name):
+                entry.reftimes.append(child.name[:10])
+            elif child.name.endswith(PACK_SUFFIX):
+                entry.packed.append(child.name[:10])
+            elif child.name.endswith(MANIFEST_SUFFIX):
+                manifests.append(child.name[:10])
+        elif child.is_dir():
+            field_dirs.append(child)
+
+    # a single read instead of listing every field folder
+    FS_CALLS.labels("scan_area", "read_manifest").inc(len(manifests))
+    for reftime in manifests:
+        manifest = read_manifest(get_manifest_path(area_path, reftime))
+        if not manifest:
+            continue
+        for key in manifest["files"]:
+            field_name, _, name = key.partition("/")
+            add_map(field_name, name)
+        listed.add(reftime)
+
+    if not listed.union(entry.packed).issuperset(entry.reftimes):
+        FS_CALLS.labels("scan_area", "scandir").inc(len(field_dirs))
+        for child in field_dirs:
+            try:
+                names = [f.name for f in os.scandir(child.path) if f.is_file()]
+            except OSError:
+                continue
+            for name in names:
+                add_map(child.name, name)
+
+    # the maps of a packed run are listed by reading the archive index
+    FS_CALLS.labels("scan_area", "open_pack").inc(len(entry.packed))
+    for reftime in entry.packed:
+        reader = open_pack(area_path.joinpath(f"{reftime}{PACK_SUFFIX}"))
+        if not reader:
+            continue
+        for key in reader.keys():
+            field_name, _, name = key.partition("/")
+            add_map(field_name, name)
+
+    entry.reftimes.sort()
+    entry.packed.sort()
+    entry.offsets = {key: sorted(values) for key, values in offsets.items()}
+    return entry
+
+
+class RunCatalog:
+    """
+    In-memory index of the runs available under the data path.
+
+    Each area folder is indexed into its reftimes and the sorted offsets of
+    every field (and level, for percentile and probability maps).
+    The index is kept up to date by an inotify watcher or, where inotify is
+    not available (e.g. network filesystems), by polling the directory mtimes.
+    With the watcher disabled the area folders are scanned on every lookup.
+
+    The index is built in background: each platform is walked in its own
+    thread, within the scan timeout, so that a hung mount never blocks the
+    requests nor the updates of the other platforms. The platforms reported
+    as unavailable are skipped. Until a platform is indexed, its area
+    folders are scanned on lookup.
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        watcher: str,
+        poll_interval: int,
+        scan_timeout: float = CATALOG_SCAN_TIMEOUT,
+        available: Optional[Callable[[str], bool]] = None,
+    ) -> None:
+        self.root = root
+        self.watcher = watcher
+        self.poll_interval = poll_interval
+        self.scan_timeout = scan_timeout
+        self.available = available or (lambda platform: True)
+        self._areas: Dict[Path, AreaEntry] = {}
+        self._stamps: Dict[Path, Tuple[int, ...]] = {}
+        self._lock = threading.Lock()
+        self._index_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._generation = 0
+        self._listeners: List[RunListener] = []
+        # platform folders whose first scan is complete
+        self._indexed: Set[Path] = set()
+        self._ready = threading.Event()
+        # completion events of the background tasks, unset while running
+        self._tasks: Dict[str, threading.Event] = {}
+
+    @property
+    def live(self) -> bool:
+        return self.watcher != "off"
+
+    def area(self, base_path: Path, area: str) -> AreaEntry:
+        area_path = base_path.joinpath(area)
+        if not self.live:
+            return scan_area(area_path)
+        self.start()
+        if self.is_indexed(area_path):
+            return self._areas.get(area_path, EMPTY_AREA)
+        # the platform is still being indexed: look at this area only
+        return scan_area(area_path)
+
+    def version(self, base_path: Path, area: str) -> Hashable:
+        """A token changing whenever the content of the area folder changes"""
+        area_path = base_path.joinpath(area)
+        if not self.live:
+            return self._stamp(area_path)
+        self.start()
+        if self.is_indexed(area_path):
+            return self._areas.get(area_path, EMPTY_AREA).generation
+        return self._stamp(area_path)
+
+    def is_indexed(self, area_path: Path) -> bool:
+        """
+        Whether the lookups of an area are served by the index, i.e. its
+        platform has been scanned or is not available (never to be accessed)
+        """
+        platform_path = self.get_platform_path(area_path)
+        if not platform_path or platform_path in self._indexed:
+            return True
+        return not self.available(platform_path.name)
+
+    def get_platform_path(self, path: Path) -> Optional[Path]:
+        try:
+            platform = path.relative_to(self.root).parts[0]
+        except (ValueError, IndexError):
+            return None
+        return self.root.joinpath(platform)
+
+    def get_reftime(
+        self, base_path: Path, area: str, reftime: Optional[str] = None
+    ) -> Optional[str]:
+        return self.area(base_path, area).find(reftime)
+
+    def get_pack(
+        self, base_path: Path, area: str, reftime: Optional[str] = None
+    ) -> Optional[Path]:
+        """Return the archive of a run, if its files have been packed"""
+        entry = self.area(base_path, area)
+        reftime = reftime or entry.reftime
+        if not reftime or reftime not in entry.packed:
+            return None
+        return base_path.joinpath(area, f"{reftime}{PACK_SUFFIX}")
+
+    def get_pack_reader(
+        self, base_path: Path, area: str, reftime: Optional[str] = None
+    ) -> Optional[PackReader]:
+        pack_path = self.get_pack(base_path, area, reftime)
+        return open_pack(pack_path) if pack_path else None
+
+    def get_offsets(
+        self,
+        base_path: Path,
+        area: str,
+        field: str,
+        level: Optional[str] = None,
+        reftime: Optional[str] = None,
+    ) -> List[str]:
+        entry = self.area(base_path, area)
+        reftime = reftime or entry.reftime
+        if not reftime:
+            return []
+        return entry.offsets.get((reftime, field, level), [])
+
+    def subscribe(self, listener: RunListener) -> None:
+        """
+        Be notified of the runs landing while the catalog is running, i.e.
+        not of the ones already available when it starts (live mode only)
+        """
+        self._listeners.append(listener)
+
+    def start(self) -> None:
+        if self._thread:
+            return
+        with self._lock:
+            if self._thread:
+                return
+            # the initial scan is done by the catalog thread
+            self._thread = threading.Thread(
+                target=self._run, name="maps-catalog", daemon=True
+            )
+            self._thread.start()
+
+    def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        """Wait for the end of the initial scan"""
+        return self._ready.wait(timeout)
+
+    def list_platforms(self) -> List[Path]:
+        return self._walk(self.root, 0, PLATFORM_DEPTH)
+
+    def refresh(self) -> None:
+        """Rescan the area folders whose directory mtimes have changed"""
+        platforms = self.list_platforms()
+        scans: Dict[Path, Optional[threading.Event]] = {}
+        for platform_path in platforms:
+            if not self.available(platform_path.name):
+                log.debug("catalog: {} not available, skipped", platform_path)
+                continue
+            scans[platform_path] = self.start_task(
+                f"scan:{platform_path.name}",
+                partial(self.refresh_platform, platform_path),
+            )
+        self.wait_tasks(scans, "scan")
+        for area_path in list(self._areas):
+            if self.get_platform_path(area_path) not in platforms:
+                self._drop(area_path)
+
+    def refresh_platform(self, platform_path: Path) -> None:
+        seen: Set[Path] = set()
+        for area_path in self._walk(platform_path, PLATFORM_DEPTH, AREA_DEPTH):
+            seen.add(area_path)
+            self.refresh_area(area_path)
+        for area_path in list(self._areas):
+            if platform_path in area_path.parents and area_path not in seen:
+                self._drop(area_path)
+        if platform_path not in self._indexed:
+            log.info("catalog: {} indexed", platform_path)
+            self._indexed.add(platform_path)
+
+    def start_task(
+        self, name: str, target: Callable[[], None]
+    ) -> Optional[threading.Event]:
+        """
+        Run a task touching the filesystem in its own thread, unless the
+        previous run of the same task is still stuck on a mount
+        """
+        previous = self._tasks.get(name)
+        if previous and not previous.is_set():
+            return None
+        done = threading.Event()
+
+        def run() -> None:
+            try:
+                target()
+            except Exception as exc:  # pragma: no cover
+                log.error("catalog: {} failed: {}", name, exc)
+            finally:
+                done.set()
+
+        self._tasks[name] = done
+        threading.Thread(target=run, name=f"maps-catalog-{name}", daemon=True).start()
+        return done
+
+    def wait_tasks(
+        self, tasks: Dict[Path, Optional[threading.Event]], kind: str
+    ) -> List[Path]:
+        """Wait for the tasks within the scan timeout, return the late ones"""
+        deadline = time.monotonic() + self.scan_timeout
+        late: List[Path] = []
+        for path, done in tasks.items():
+            if done is None or not done.wait(max(0.0, deadline - time.monotonic())):
+                log.warning("catalog: {} of {} is taking too long", kind, path)
+                late.append(path)
+        return late
+
+    def refresh_area(self, area_path: Path, force: bool = False) -> None:
+        stamp = self._stamp(area_path)
+        if stamp is None:
+            self._drop(area_path)
+            return
+        if not force and stamp == self._stamps.get(area_path):
+            return
+        entry = scan_area(area_path)
+        with self._index_lock:
+            self._generation += 1
+            entry.generation = self._generation
+            previous = self._areas.get(area_path, EMPTY_AREA)
+            self._areas[area_path] = entry
+            self._stamps[area_path] = stamp
+        # release the mappings of the runs removed since
+        close_packs(area_path, entry.packed)
+        log.debug("catalog: {} indexed, reftimes {}", area_path, entry.reftimes)
+
+        # the runs found by the first scan of a platform are not new
+        if self._listeners and self.get_platform_path(area_path) in self._indexed:
+            for reftime in sorted(set(entry.reftimes) - set(previous.reftimes)):
+                for listener in self._listeners:
+                    try:
+                        listener(area_path, reftime)
+                    except Exception as exc:  # pragma: no cover
+                        log.error("catalog: listener failure: {}", exc)
+
+    def _drop(self, area_path: Path) -> None:
+        if self._areas.pop(area_path, None):
+            log.debug("catalog: {} removed", area_path)
+        self._stamps.pop(area_path, None)
+        close_packs(area_path)
+
+    @staticmethod
+    def _walk(path: Path, depth: int, max_depth: int) -> List[Path]:
+        if depth == max_depth:
+            return [path]
+        dirs: List[Path] = []
+        FS_CALLS.labels("catalog_walk", "scandir").inc()
+        try:
+            children = [Path(c.path) for c in os.scandir(path) if c.is_dir()]
+        except OSError:
+            return dirs
+        for child in children:
+            dirs.extend(RunCatalog._walk(child, depth + 1, max_depth))
+        return dirs
+
+    @staticmethod
+    def _stamp(area_path: Path) -> Optional[Tuple[int, ...]]:
+        # the mtime of a directory changes whenever an entry is added or removed
+        FS_CALLS.labels("catalog_stamp", "scandir").inc()
+        try:
+            stamp = [area_path.stat().st_mtime_ns]
+            for child in sorted(os.scandir(area_path), key=lambda c: c.name):
+                if child.is_dir():
+                    stamp.append(child.stat().st_mtime_ns)
+        except OSError:
+            return None
+        FS_CALLS.labels("catalog_stamp", "stat").inc(len(stamp))
+        return tuple(stamp)
+
+    def _run(self) -> None:
+        watcher: Optional[InotifyWatcher] = None
+        if self.watcher == "inotify":
+            try:
+                # watched before the initial scan, not to miss any change
+                watcher = InotifyWatcher(self)
+                watcher.setup()
+            except OSError as exc:
+                log.warning("catalog: inotify not available ({}), polling", exc)
+                watcher = None
+        try:
+            self.refresh()
+        finally:
+            self._ready.set()
+        if watcher:
+            watcher.run()
+            return
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                self.refresh()
+            except Exception as exc:  # pragma: no cover
+                log.error("catalog: refresh failed: {}", exc)
+
+
+class InotifyWatcher:
+    """Follow the data tree through the Linux inotify interface"""
+
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_ISDIR = 0x40000000
+    IN_IGNORED = 0x00008000
+    IN_Q_OVERFLOW = 0x00004000
+    MASK = IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+
+    EVENT = struct.Struct("iIII")
+    # a run is written by many files in a row: collect them before rescanning
+    DEBOUNCE = 0.5
+
+    def __init__(self, catalog: RunCatalog) -> None:
+        self.catalog = catalog
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches: Dict[int, Path] = {}
+        # directories that could not be watched (e.g. max_user_watches
+        # exhausted or platform not available), polled instead
+        self.unwatched: Set[Path] = set()
+
+    def depth(self, path: Path) -> int:
+        return len(path.relative_to(self.catalog.root).parts)
+
+    def add_watch(self, path: Path) -> bool:
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), self.MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            log.warning(
+                "catalog: cannot watch {} ({}), polling it", path, os.strerror(error)
+            )
+            self.unwatched.add(path)
+            return False
+        self.watches[wd] = path
+        return True
+
+    def watch(self, path: Path) -> None:
+        """Watch a directory and its subdirectories down to the field folders"""
+        if not self.add_watch(path) or self.depth(path) >= FIELD_DEPTH:
+            return
+        try:
+            children = [Path(c.path) for c in os.scandir(path) if c.is_dir()]
+        except OSError:
+            return
+        for child in children:
+            self.watch(child)
+
+    def watch_platforms(self) -> None:
+        watching: Dict[Path, Optional[threading.Event]] = {}
+        for platform_path in self.catalog.list_platforms():
+            if not self.catalog.available(platform_path.name):
+                self.unwatched.add(platform_path)
+                continue
+            watching[platform_path] = self.catalog.start_task(
+                f"watch:{platform_path.name}",
+                partial(self.watch, platform_path),
+            )
+        # partially watched: polled as well
+        self.unwatched.update(self.catalog.wait_tasks(watching, "watch"))
+
+    def poll_unwatched(self) -> None:
+        """Refresh the area folders that are not (fully) watched"""
+        by_platform: Dict[Path, List[Path]] = {}
+        for path in self.unwatched:
+            platform_path = self.catalog.get_platform_path(path)
+            if platform_path:
+                by_platform.setdefault(platform_path, []).append(path)
+        for platform_path, paths in by_platform.items():
+            if self.catalog.available(platform_path.name):
+                self.catalog.start_task(
+                    f"poll:{platform_path.name}",
+                    partial(self.poll, paths),
+                )
+
+    def poll(self, paths: List[Path]) -> None:
+        for path in paths:
+            depth = self.depth(path)
+            if depth > AREA_DEPTH:
+                self.catalog.refresh_area(path.parents[depth - AREA_DEPTH - 1])
+                continue
+            for area_path in RunCatalog._walk(path, depth, AREA_DEPTH):
+                self.catalog.refresh_area(area_path)
+
+    def setup(self) -> None:
+        if not self.add_watch(self.catalog.root):
+            raise OSError(ctypes.get_errno(), f"cannot watch {self.catalog.root}")
+        self.watch_platforms()
+        log.info(
+            "catalog: watching {} directories, polling {}",
+            len(self.watches),
+            len(self.unwatched),
+        )
+
+    def run(self) -> None:
+        last_poll = time.monotonic()
+        while True:
+            ready, _, _ = select.select([self.fd], [], [], self.catalog.poll_interval)
+            if self.unwatched and time.monotonic() - last_poll >= (
+                self.catalog.poll_interval
+            ):
+                self.poll_unwatched()
+                last_poll = time.monotonic()
+            if not ready:
+                continue
+            time.sleep(self.DEBOUNCE)
+            dirty: Set[Path] = set()
+            full_refresh = False
+            for wd, mask, name in self.read_events():
+                if mask & self.IN_Q_OVERFLOW:
+                    full_refresh = True
+                    continue
+                if mask & self.IN_IGNORED:
+                    self.watches.pop(wd, None)
+                    continue
+                path = self.watches.get(wd)
+                if path is None:
+                    continue
+                if mask & self.IN_ISDIR and mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                    self.watch(path.joinpath(name))
+                depth = self.depth(path)
+                if depth < AREA_DEPTH:
+                    # a platform, env, run or area folder was added or removed
+                    full_refresh = True
+                elif depth == AREA_DEPTH:
+                    dirty.add(path)
+                else:
+                    dirty.add(path.parent)
+
+            if full_refresh:
+                self.catalog.refresh()
+                continue
+            for area_path in dirty:
+                self.catalog.refresh_area(area_path, force=True)
+
+    def read_events(self) -> List[Tuple[int, int, str]]:
+        events: List[Tuple[int, int, str]] = []
+        while True:
+            ready, _, _ = select.select([self.fd], [], [], 0)
+            if not ready:
+                return events
+            buffer = os.read(self.fd, 64 * 1024)
+            pos = 0
+            while pos < len(buffer):
+                wd, mask, _, length = self.EVENT.unpack_from(buffer, pos)
+                pos += self.EVENT.size
+                name = buffer[pos : pos + length].rstrip(b"\0")
+                pos += length
+                events.append((wd, mask, os.fsdecode(name)))
+
+
+# tests create and remove files on the fly: scan on demand instead of watching
+def walk_areas(
+    root: Path, available: Optional[Callable[[str], bool]] = None
+) -> List[Path]:
+    """All the area folders under root, of the available platforms only"""
+    areas: List[Path] = []
+    for platform_path in RunCatalog._walk(root, 0, PLATFORM_DEPTH):
+        if available and not available(platform_path.name):
+            log.debug("{} not available, skipped", platform_path)
+            continue
+        areas.extend(RunCatalog._walk(platform_path, PLATFORM_DEPTH, AREA_DEPTH))
+    return areas
+
+
+catalog = RunCatalog(
+    DATA_PATH,
+    watcher="off" if TESTING else CATALOG_WATCHER,
+    poll_interval=CATALOG_POLL_INTERVAL,
+    # the folders of the platforms not available are never accessed
+    available=lambda platform: (
+        platform not in PLATFORMS or platform_monitor.is_up(platform)
+    ),
+)
+
+
+def get_file_path(base_path: Path, area: str, key: str) -> Path:
+    """Path of a loose map image, given its key: <field>/<image name>"""
+    # legends are shared by all the areas of a run folder
+    if key.startswith("legends/"):
+        return base_path.joinpath(key)
+    return base_path.joinpath(area, key)
+
+
+def read_map(base_path: Path, area: str, key: str, reftime: str) -> bytes:
+    """Read a map (or legend) image, from the run archive if it is packed"""
+    reader = catalog.get_pack_reader(base_path, area, reftime)
+    if reader and (data := reader.get(key)) is not None:
+        return bytes(data)
+    return get_file_path(base_path, area, key).read_bytes()
+
+
+def read_map_file(base_path: Path, area: str, key: str, reftime: str) -> bytes:
+    """
+    Read a map (or legend) image looking for the run archive on disk instead
+    of in the catalog, for the tasks which must not start the live catalog
+    """
+    pack_path = base_path.joinpath(area, f"{reftime}{PACK_SUFFIX}")
+    reader = open_pack(pack_path) if pack_path.is_file() else None
+    if reader and (data := reader.get(key)) is not None:
+        return bytes(data)
+    return get_file_path(base_path, area, key).read_bytes()
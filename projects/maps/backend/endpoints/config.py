@@ -1,7 +1,9 @@
+import re
 from functools import lru_cache
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple, TypedDict
 
+from maps.endpoints.metrics import FS_CALLS
 from restapi.config import DATA_PATH
 from restapi.env import Env
 from restapi.utilities.logs import log
@@ -25,12 +27,64 @@
     "percentile",
     "probability",
 ]
+# written by the flash flood runs (PROB-*-iff.web) only
+FLOOD_FIELDS = ["percentile", "probability"]
+# accumulated fields (prec3, snow6, ...) are available every period hours
+ACCUMULATED_FIELD = re.compile(r"^(?:prec|snow)(\d+)$")
 LEVELS_PE = ["1", "10", "25", "50", "70", "75", "80", "90", "95", "99"]
 LEVELS_PR = ["5", "10", "20", "50"]
 AREAS = ["Italia", "Nord_Italia", "Centro_Italia", "Sud_Italia", "Area_Mediterranea"]
 PLATFORMS = ["G100", "MEUCCI"]
 ENVS = ["PROD", "DEV"]
 DEFAULT_PLATFORM = Env.get("PLATFORM", "G100")
+# how the run catalog follows the data tree: inotify, poll or off
+CATALOG_WATCHER = Env.get("MAPS_CATALOG_WATCHER", "inotify")
+CATALOG_POLL_INTERVAL = Env.get_int("MAPS_CATALOG_POLL_INTERVAL", 10)
+# time (in seconds) waited for the scan of each platform
+CATALOG_SCAN_TIMEOUT = Env.get_int("MAPS_CATALOG_SCAN_TIMEOUT", 30)
+# bounds (in seconds) of the max-age sent to the clients along with the images
+CACHE_MIN_AGE = Env.get_int("MAPS_CACHE_MIN_AGE", 60)
+CACHE_MAX_AGE = Env.get_int("MAPS_CACHE_MAX_AGE", 3600)
+# where the derived images (animations, variants, ...) are stored
+CACHE_PATH = Path(Env.get("MAPS_CACHE_PATH", "/tmp/maps-cache"))
+# image formats served to the clients accepting them, in order of preference
+IMAGE_VARIANTS = [
+    v for v in Env.get("MAPS_IMAGE_VARIANTS", "avif,webp").split(",") if v
+]
+# max size (in MB) of the folder of the image variants
+VARIANTS_CACHE_SIZE = Env.get_int("MAPS_VARIANTS_CACHE_SIZE", 2048)
+# probes of the platform mounts: interval and timeout (seconds), number of
+# consecutive failed (fall) or successful (rise) probes to change state
+HEALTH_INTERVAL = Env.get_int("MAPS_HEALTH_INTERVAL", 5)
+HEALTH_TIMEOUT = Env.get_int("MAPS_HEALTH_TIMEOUT", 2)
+HEALTH_FALL = Env.get_int("MAPS_HEALTH_FALL", 3)
+HEALTH_RISE = Env.get_int("MAPS_HEALTH_RISE", 2)
+# time (in milliseconds) given to the platforms to tell their last run
+READY_DEADLINE = Env.get_int("MAPS_READY_DEADLINE", 1000)
+# runs kept in each folder (0 to keep them all) and pruning interval (seconds)
+RETENTION_RUNS = Env.get_int("MAPS_RETENTION_RUNS", 0)
+RETENTION_INTERVAL = Env.get_int("MAPS_RETENTION_INTERVAL", 3600)
+# warm up the new runs as soon as their .READY file lands
+PREWARM = Env.get_bool("MAPS_PREWARM", True)
+PREWARM_VARIANTS = Env.get_bool("MAPS_PREWARM_VARIANTS", False)
+# memory budget (in MB) of the resized images, spilled to the variants folder
+THUMBNAILS_MEMORY_SIZE = Env.get_int("MAPS_THUMBNAILS_MEMORY_SIZE", 64)
+# memory budget (in MB) of the frames of an animation being built
+ANIMATION_MEMORY_SIZE = Env.get_int("MAPS_ANIMATION_MEMORY_SIZE", 128)
+# memory budget (in MB) of the most requested map images, 0 to disable
+HOT_CACHE_SIZE = Env.get_int("MAPS_HOT_CACHE_SIZE", 256)
+# lifetime of an event stream and interval of its heartbeats (seconds)
+EVENTS_TIMEOUT = Env.get_int("MAPS_EVENTS_TIMEOUT", 300)
+EVENTS_HEARTBEAT = Env.get_int("MAPS_EVENTS_HEARTBEAT", 15)
+EVENTS_MAX_STREAMS = Env.get_int("MAPS_EVENTS_MAX_STREAMS", 4)
+# memory budget (in MB) of the map frames decoded for the point queries
+FRAMES_CACHE_SIZE = Env.get_int("MAPS_FRAMES_CACHE_SIZE", 256)
+# threads doing the file I/O of the ASGI server
+ASGI_THREADS = Env.get_int("MAPS_ASGI_THREADS", 64)
+# how the image files are sent: stream (by the app), accel (nginx) or sendfile
+SENDFILE_MODE = Env.get("MAPS_SENDFILE_MODE", "stream")
+# internal nginx location aliasing DATA_PATH, used by the accel mode
+ACCEL_LOCATION = Env.get("MAPS_ACCEL_LOCATION", "/protected-maps/")
 
 
 class Boundaries(TypedDict):
@@ -98,6 +152,16 @@ class DatasetType(TypedDict):
 }
 
 
+# named regions that can be cut out of the maps covering them
+REGIONS: Dict[str, Boundaries] = {
+    "Nord_Italia": {"SW": (43.5, 6.5), "NE": (47.2, 14.0)},
+    "Centro_Italia": {"SW": (41.0, 9.5), "NE": (44.5, 14.5)},
+    "Sud_Italia": {"SW": (36.5, 12.5), "NE": (42.0, 19.0)},
+    "Sardegna": {"SW": (38.8, 8.0), "NE": (41.3, 9.9)},
+    "Sicilia": {"SW": (36.6, 12.3), "NE": (38.4, 15.7)},
+}
+
+
 @lru_cache
 def get_base_path(field: str, platform: str, env: str, run: str, dataset: str) -> Path:
     # flood fields have a different path
@@ -120,15 +184,27 @@ def get_base_path(field: str, platform: str, env: str, run: str, dataset: str) -
     return base_path
 
 
+def get_cache_path(kind: str, base_path: Path, area: str, field: str) -> Path:
+    # derived images mirror the layout of the data folders
+    return CACHE_PATH.joinpath(kind, base_path.relative_to(DATA_PATH), area, field)
+
+
+def is_ready_file(name: str) -> bool:
+    """Whether a file marks a run as ready: <reftime>.READY"""
+    return ".READY" in name
+
+
 def get_ready_file(base_path: Path, area: str) -> Optional[Path]:
     ready_path = base_path.joinpath(area)
     log.debug(f"ready_path: {ready_path}")
 
     ready_files: List[Path] = []
+    FS_CALLS.labels("get_ready_file", "exists").inc()
     if ready_path.exists():
-        ready_files = [
-            f for f in ready_path.iterdir() if f.is_file() and ".READY" in f.name
-        ]
+        FS_CALLS.labels("get_ready_file", "iterdir").inc()
+        children = list(ready_path.iterdir())
+        FS_CALLS.labels("get_ready_file", "is_file").inc(len(children))
+        ready_files = [f for f in children if f.is_file() and is_ready_file(f.name)]
 
     # Check if .READY file exists (if not, images are not ready yet)
     log.debug(f"Looking for .READY files in: {ready_path}")
@@ -136,8 +212,56 @@ def get_ready_file(base_path: Path, area: str) -> Optional[Path]:
         return None
 
     log.debug(f".READY files found: {ready_files}")
-    return ready_files[0]
+    # named after the reftime: the last one is the most recent run
+    return max(ready_files)
+
+
+def get_level(
+    field: str, level_pe: Optional[str], level_pr: Optional[str]
+) -> Optional[str]:
+    # flash flood maps are also split by level
+    if field == "percentile":
+        return level_pe
+    if field == "probability":
+        return level_pr
+    return None
+
+
+def get_levels(field: str) -> List[Optional[str]]:
+    """The levels a field is split by, [None] if not split"""
+    if field == "percentile":
+        return list(LEVELS_PE)
+    if field == "probability":
+        return list(LEVELS_PR)
+    return [None]
+
+
+def get_dataset_fields(dataset: str) -> List[str]:
+    """The fields a complete run of a dataset is made of"""
+    if dataset == "iff":
+        return list(FLOOD_FIELDS)
+    return [f for f in FIELDS if f not in FLOOD_FIELDS]
+
+
+def get_field_offsets(field: str, start: int, end: int, step: int) -> List[str]:
+    """The offsets of a field in a run from start to end hours, every step"""
+    if match := ACCUMULATED_FIELD.match(field):
+        period = int(match.group(1))
+        # the first accumulation is available after a whole period, and
+        # then every period hours
+        start, step = max(start, period), max(step, period)
+    return [f"{offset:04d}" for offset in range(start, end + 1, step)]
+
+
+def get_image_name(field: str, reftime: str, offset: str, level: Optional[str]) -> str:
+    # flash flood maps have a different naming: perc6.2017112900.0006_10.png
+    if field == "percentile":
+        return f"perc6.{reftime}.{offset}_{level}.png"
+    if field == "probability":
+        return f"prob6.{reftime}.{offset}_{level}.png"
+    return f"{field}.{reftime}.{offset}.png"
 
 
 def check_platform_availability(platform: str) -> bool:
+    FS_CALLS.labels("check_platform_availability", "exists").inc()
     return DATA_PATH.joinpath(platform).exists()
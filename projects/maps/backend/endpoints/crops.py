@@ -0,0 +1,136 @@
+import io
+import math
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from maps.endpoints.catalog import LEVEL_FIELDS, read_map
+from maps.endpoints.config import DATASETS, REGIONS, Boundaries, get_cache_path
+from maps.endpoints.variants import VARIANT_FORMATS, variants_cache
+from PIL import Image
+from restapi.exceptions import BadRequest
+from restapi.utilities.logs import log
+
+# left, top, right, bottom (pixels)
+PixelBox = Tuple[int, int, int, int]
+# west, south, east, north (degrees)
+GeoBox = Tuple[float, float, float, float]
+
+
+def get_area_boundaries(field: str, res: str) -> Dict[str, Boundaries]:
+    """The georeferenced areas of the maps of a dataset"""
+    dataset = "iff" if field in LEVEL_FIELDS else res
+    return {
+        info["area"]: info["boundaries"]
+        for name, info in DATASETS.items()
+        if name == dataset
+    }
+
+
+def get_boundaries(field: str, res: str, area: str) -> Optional[Boundaries]:
+    """The georeferencing of the maps of an area, if known"""
+    return get_area_boundaries(field, res).get(area)
+
+
+def parse_bbox(bbox: str) -> GeoBox:
+    west, south, east, north = (float(v) for v in bbox.split(","))
+    if west >= east or south >= north:
+        raise BadRequest(f"Invalid bounding box {bbox}")
+    return west, south, east, north
+
+
+def contains(boundaries: Boundaries, box: GeoBox) -> bool:
+    west, south, east, north = box
+    (b_south, b_west), (b_north, b_east) = boundaries["SW"], boundaries["NE"]
+    return b_west <= west and b_south <= south and b_east >= east and b_north >= north
+
+
+def get_extent(boundaries: Boundaries) -> float:
+    (south, west), (north, east) = boundaries["SW"], boundaries["NE"]
+    return (north - south) * (east - west)
+
+
+def find_enclosing_area(field: str, res: str, box: GeoBox) -> str:
+    """The smallest georeferenced area containing the bounding box"""
+    candidates = [
+        (get_extent(b), area)
+        for area, b in get_area_boundaries(field, res).items()
+        if contains(b, box)
+    ]
+    if not candidates:
+        raise BadRequest(f"No {res} map contains the bounding box {box}")
+    return min(candidates)[1]
+
+
+def get_pixel_box(
+    box: GeoBox, boundaries: Boundaries, width: int, height: int
+) -> PixelBox:
+    """The pixels covering the bounding box, on a regular lat/lon grid"""
+    west, south, east, north = box
+    (b_south, b_west), (b_north, b_east) = boundaries["SW"], boundaries["NE"]
+    x_scale = width / (b_east - b_west)
+    y_scale = height / (b_north - b_south)
+    left = max(0, math.floor((west - b_west) * x_scale))
+    right = min(width, math.ceil((east - b_west) * x_scale))
+    top = max(0, math.floor((b_north - north) * y_scale))
+    bottom = min(height, math.ceil((b_north - south) * y_scale))
+    return left, top, max(right, left + 1), max(bottom, top + 1)
+
+
+def locate_crop(
+    field: str, res: str, bbox: Optional[str], region: Optional[str], resized: bool
+) -> Tuple[str, GeoBox]:
+    """The area to be cropped and the requested bounding box"""
+    if bbox and region:
+        raise BadRequest("Either bbox or region can be requested")
+    if resized:
+        raise BadRequest("Cropped maps cannot be resized")
+    if region:
+        sw, ne = REGIONS[region]["SW"], REGIONS[region]["NE"]
+        box: GeoBox = (sw[1], sw[0], ne[1], ne[0])
+    else:
+        box = parse_bbox(bbox or "")
+    return find_enclosing_area(field, res, box), box
+
+
+@lru_cache(maxsize=4096)
+def get_map_size(base_path: Path, area: str, key: str, reftime: str) -> Tuple[int, int]:
+    data = read_map(base_path, area, key, reftime)
+    with Image.open(io.BytesIO(data)) as img:
+        return img.size
+
+
+def get_crop(
+    base_path: Path,
+    area: str,
+    field: str,
+    res: str,
+    image_name: str,
+    reftime: str,
+    box: GeoBox,
+    image_format: str,
+) -> Tuple[Path, PixelBox]:
+    """
+    Return the part of a map image covering the bounding box, cropping it
+    the first time. Crops are named after the image (and then the run) and
+    the pixels they cover, so that close bounding boxes share the same file.
+    """
+    boundaries = get_boundaries(field, res, area)
+    if not boundaries:
+        raise BadRequest(f"Maps of {res} are not georeferenced for area {area}")
+    key = f"{field}/{image_name}"
+    width, height = get_map_size(base_path, area, key, reftime)
+    pixel_box = get_pixel_box(box, boundaries, width, height)
+    crop_name = "-".join(str(v) for v in pixel_box)
+    crop_path = get_cache_path("variants", base_path, area, field).joinpath(
+        f"{Path(image_name).stem}.crop-{crop_name}.{image_format}"
+    )
+
+    def build(dest: Path) -> None:
+        log.debug("Cropping {} to {}", image_name, pixel_box)
+        pil_format, _, options = VARIANT_FORMATS.get(image_format, ("PNG", "", {}))
+        data = read_map(base_path, area, key, reftime)
+        with Image.open(io.BytesIO(data)) as img:
+            img.crop(pixel_box).save(dest, format=pil_format, **options)
+
+    return variants_cache.get_or_build(crop_path, build), pixel_box
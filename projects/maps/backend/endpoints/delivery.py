@@ -0,0 +1,267 @@
+import hashlib
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from functools import lru_cache
+from pathlib import Path
+from typing import Callable, Dict, NamedTuple, Optional, Tuple
+from urllib.parse import quote
+
+from flask import Response, request, send_file
+from maps.endpoints.cache import SegmentedLRUCache
+from maps.endpoints.catalog import catalog, get_file_path
+from maps.endpoints.config import (
+    ACCEL_LOCATION,
+    CACHE_MAX_AGE,
+    CACHE_MIN_AGE,
+    HOT_CACHE_SIZE,
+    SENDFILE_MODE,
+)
+from maps.endpoints.packfile import PackReader
+from restapi.config import DATA_PATH
+from restapi.utilities.logs import log
+from werkzeug.datastructures import ETags
+from werkzeug.wsgi import wrap_file
+
+
+class FileValidators(NamedTuple):
+    etag: str
+    last_modified: datetime
+    size: int
+
+
+def get_validators(path: Path, reftime: str, offset: str) -> FileValidators:
+    """
+    The validators of a map file, from its size and mtime: they change
+    whenever the file is written again, even under the same run
+    """
+    stat = path.stat()
+    return compute_validators(reftime, offset, stat.st_size, stat.st_mtime_ns)
+
+
+@lru_cache(maxsize=16384)
+def compute_validators(
+    reftime: str, offset: str, size: int, mtime_ns: int
+) -> FileValidators:
+    digest = hashlib.sha1(f"{reftime}:{offset}:{size}:{mtime_ns}".encode()).hexdigest()
+    last_modified = datetime.fromtimestamp(mtime_ns // 10**9, tz=timezone.utc)
+    return FileValidators(digest, last_modified, size)
+
+
+def get_max_age(reftime: Optional[str]) -> int:
+    """
+    A run is replaced by the same run of the next day at the earliest:
+    until then its maps can be safely reused by the clients
+    """
+    if not reftime:
+        return CACHE_MIN_AGE
+    next_run = datetime.strptime(reftime, "%Y%m%d%H") + timedelta(days=1)
+    remaining = (next_run - datetime.utcnow()).total_seconds()
+    return int(min(CACHE_MAX_AGE, max(CACHE_MIN_AGE, remaining)))
+
+
+def check_not_modified(
+    validators: FileValidators,
+    if_none_match: ETags,
+    if_modified_since: Optional[datetime],
+) -> bool:
+    # If-Modified-Since is ignored when If-None-Match is present (RFC 7232)
+    if if_none_match:
+        return if_none_match.contains(validators.etag)
+    if if_modified_since:
+        return validators.last_modified <= if_modified_since
+    return False
+
+
+def is_not_modified(validators: FileValidators) -> bool:
+    return check_not_modified(
+        validators, request.if_none_match, request.if_modified_since
+    )
+
+
+def offload_file(path: Path, mime: str) -> Response:
+    """
+    Let the frontend server send the file: the app only returns the
+    X-Accel-Redirect (nginx) or X-Sendfile header pointing to it
+    """
+    response = Response(mimetype=mime)
+    if SENDFILE_MODE == "accel":
+        location = ACCEL_LOCATION.rstrip("/")
+        relative_path = path.relative_to(DATA_PATH).as_posix()
+        response.headers["X-Accel-Redirect"] = quote(f"{location}/{relative_path}")
+    else:
+        response.headers["X-Sendfile"] = str(path)
+    return response
+
+
+def send_map_file(
+    path: Path, reftime: Optional[str], offset: str, mime: str = "image/png"
+) -> Response:
+    """Send a map (or legend) image honouring the conditional request headers"""
+    validators = get_validators(path, reftime or "", offset)
+
+    if is_not_modified(validators):
+        log.debug("{} not modified", path)
+        response = Response(status=304)
+    elif SENDFILE_MODE in ("accel", "sendfile") and DATA_PATH in path.parents:
+        log.debug("Offloading {} ({})", path, SENDFILE_MODE)
+        response = offload_file(path, mime)
+    else:
+        log.info("Sending file content from {}", path)
+        response = send_file(path, mimetype=mime, conditional=False, etag=False)
+
+    return set_cache_headers(response, validators, reftime)
+
+
+def get_packed_validators(
+    reader: PackReader, key: str, reftime: str
+) -> Optional[FileValidators]:
+    location = reader.locate(key)
+    if not location:
+        return None
+    offset, length = location
+    digest = hashlib.sha1(f"{reftime}:{key}:{offset}:{length}".encode()).hexdigest()
+    last_modified = datetime.fromtimestamp(int(reader.mtime), tz=timezone.utc)
+    return FileValidators(digest, last_modified, length)
+
+
+def send_packed_file(
+    reader: PackReader, key: str, reftime: str, mime: str
+) -> Optional[Response]:
+    """Send a file from an archive, None if the archive does not contain it"""
+    validators = get_packed_validators(reader, key, reftime)
+    if not validators:
+        return None
+
+    if is_not_modified(validators):
+        response = Response(status=304)
+    else:
+        packed_file = reader.open(key)
+        # served by the WSGI server, with sendfile where supported
+        response = Response(
+            wrap_file(request.environ, packed_file),
+            mimetype=mime,
+            direct_passthrough=True,
+        )
+        response.content_length = validators.size
+
+    return set_cache_headers(response, validators, reftime)
+
+
+def send_map(
+    base_path: Path,
+    area: str,
+    key: str,
+    reftime: Optional[str],
+    offset: str,
+    mime: str = "image/png",
+) -> Response:
+    """Send a map (or legend) image, from the run archive if it is packed"""
+    if reftime:
+        reader = catalog.get_pack_reader(base_path, area, reftime)
+        response = send_packed_file(reader, key, reftime, mime) if reader else None
+        if response:
+            return response
+    return send_map_file(get_file_path(base_path, area, key), reftime, offset, mime)
+
+
+# the most requested map images, along with their validators, by
+# (base path, area, key, reftime): the base path identifies platform, env,
+# run and resolution. Disabled when the transfer is offloaded, for the
+# files to be read by the frontend server instead of the workers.
+hot_images = SegmentedLRUCache(
+    "hot_images",
+    HOT_CACHE_SIZE * 1024 * 1024 if SENDFILE_MODE == "stream" else 0,
+)
+
+
+def drop_hot_images(area_path: Path, reftime: str) -> None:
+    """Forget the images of the older runs of an area when a new one lands"""
+    hot_images.discard(lambda k: k[0].joinpath(k[1]) == area_path and k[3] != reftime)
+
+
+catalog.subscribe(drop_hot_images)
+
+
+def load_map(
+    base_path: Path, area: str, key: str, reftime: str, offset: str
+) -> Tuple[bytes, FileValidators]:
+    """Read a map image along with its validators"""
+    reader = catalog.get_pack_reader(base_path, area, reftime)
+    if reader and (validators := get_packed_validators(reader, key, reftime)):
+        return bytes(reader.get(key)), validators
+    path = get_file_path(base_path, area, key)
+    validators = get_validators(path, reftime, offset)
+    return path.read_bytes(), validators
+
+
+def send_hot_map(
+    base_path: Path,
+    area: str,
+    key: str,
+    reftime: str,
+    offset: str,
+    mime: str = "image/png",
+) -> Response:
+    """
+    Send a map image from memory: once cached, neither the stat nor the
+    open of the file are needed anymore
+    """
+    if not hot_images.max_size:
+        return send_map(base_path, area, key, reftime, offset, mime)
+    cache_key = (base_path, area, key, reftime)
+    cached = hot_images.get(cache_key)
+    if cached is None:
+        cached = load_map(base_path, area, key, reftime, offset)
+        hot_images.set(cache_key, cached, len(cached[0]))
+    data, validators = cached
+
+    if is_not_modified(validators):
+        response = Response(status=304)
+    else:
+        response = Response(data, mimetype=mime)
+    return set_cache_headers(response, validators, reftime)
+
+
+def get_data_validators(etag_source: str, reftime: str) -> FileValidators:
+    digest = hashlib.sha1(f"{reftime}:{etag_source}".encode()).hexdigest()
+    # derived images only change with the run
+    last_modified = datetime.strptime(reftime, "%Y%m%d%H").replace(tzinfo=timezone.utc)
+    return FileValidators(digest, last_modified, 0)
+
+
+def send_image_data(
+    etag_source: str, reftime: str, mime: str, render: Callable[[], bytes]
+) -> Response:
+    """
+    Send an image derived from the maps of a run, rendering it only when
+    the client does not already hold it
+    """
+    validators = get_data_validators(etag_source, reftime)
+
+    if is_not_modified(validators):
+        response = Response(status=304)
+    else:
+        response = Response(render(), mimetype=mime)
+    return set_cache_headers(response, validators, reftime)
+
+
+def set_cache_headers(
+    response: Response, validators: FileValidators, reftime: Optional[str]
+) -> Response:
+    response.set_etag(validators.etag)
+    response.last_modified = validators.last_modified
+    response.cache_control.public = True
+    response.cache_control.max_age = get_max_age(reftime)
+    response.cache_control.must_revalidate = True
+    return response
+
+
+def get_cache_headers(
+    validators: FileValidators, reftime: Optional[str]
+) -> Dict[str, str]:
+    """The headers set by set_cache_headers, for the responses built without Flask"""
+    return {
+        "ETag": f'"{validators.etag}"',
+        "Last-Modified": format_datetime(validators.last_modified, usegmt=True),
+        "Cache-Control": f"public, max-age={get_max_age(reftime)}, must-revalidate",
+    }
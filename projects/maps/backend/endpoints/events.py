@@ -0,0 +1,243 @@
+import json
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple, Type
+
+from flask import Response, request, stream_with_context
+from maps.endpoints.catalog import catalog
+from maps.endpoints.config import (
+    AREAS,
+    DATASETS,
+    ENVS,
+    EVENTS_HEARTBEAT,
+    EVENTS_MAX_STREAMS,
+    EVENTS_TIMEOUT,
+    PLATFORMS,
+    RESOLUTIONS,
+    RUNS,
+)
+from restapi import decorators
+from restapi.config import DATA_PATH
+from restapi.exceptions import ServiceUnavailable
+from restapi.models import Schema, fields, validate
+from restapi.rest.definition import EndpointResource
+from restapi.utilities.logs import log
+
+# events kept for the clients reconnecting with their last event id
+MAX_EVENTS = 256
+HEARTBEAT = ": heartbeat\n\n"
+
+RunEvent = Dict[str, Any]
+
+
+def describe_run(area_path: Path, reftime: str) -> Optional[RunEvent]:
+    """The event of a new run, from <platform>/<env>/<folder>/<area>"""
+    try:
+        platform, env, folder, area = area_path.relative_to(DATA_PATH).parts
+    except ValueError:
+        return None
+    prefix, _, rest = folder.removesuffix(".web").partition("-")
+    run, _, dataset = rest.partition("-")
+    if not run or not dataset:
+        return None
+    return {
+        # the same in all the workers, as they all get the run notifications
+        "id": f"{platform}/{env}/{folder}/{area}/{reftime}",
+        "kind": "tiles" if prefix == "Tiles" else "maps",
+        "platform": platform,
+        "env": env,
+        "run": run,
+        "dataset": dataset,
+        "area": area,
+        "reftime": reftime,
+    }
+
+
+class RunEvents:
+    """
+    Fan-out of the new runs notified by the catalog: a single subscription
+    is shared by all the connected clients, which wait on a condition for
+    the events following their last one (the generation token).
+    The generation only orders the events of this process: the clients
+    know the events by their id, derived from the run.
+    """
+
+    def __init__(self, size: int = MAX_EVENTS) -> None:
+        self.generation = 0
+        self._events: Deque[Tuple[int, RunEvent]] = deque(maxlen=size)
+        self._condition = threading.Condition()
+
+    def publish(self, area_path: Path, reftime: str) -> None:
+        event = describe_run(area_path, reftime)
+        if not event:
+            return
+        with self._condition:
+            self.generation += 1
+            self._events.append((self.generation, event))
+            self._condition.notify_all()
+        log.debug("New run event: {}", event)
+
+    def find(self, event_id: str) -> Optional[int]:
+        """The generation of an event, None if not (or no longer) available"""
+        for generation, event in reversed(list(self._events)):
+            if event["id"] == event_id:
+                return generation
+        return None
+
+    def get(self, since: int) -> List[Tuple[int, RunEvent]]:
+        return [(g, e) for g, e in list(self._events) if g > since]
+
+    def wait(self, since: int, timeout: float) -> List[RunEvent]:
+        with self._condition:
+            self._condition.wait_for(lambda: self.generation > since, timeout)
+        return self.get(since)
+
+
+run_events = RunEvents()
+catalog.subscribe(run_events.publish)
+
+
+def match_event(event: RunEvent, filters: Dict[str, str]) -> bool:
+    return all(event.get(k) == v for k, v in filters.items())
+
+
+def format_event(event: RunEvent) -> str:
+    return f"id: {event['id']}\nevent: run\ndata: {json.dumps(event)}\n\n"
+
+
+def get_event_token(
+    last_event_id: Optional[str], since: Optional[str]
+) -> Optional[int]:
+    """
+    The generation token of the last event received by the client, from the
+    EventSource reconnection or the query, None if that event is not known
+    (e.g. after a restart or when missed). New clients only get new events.
+    """
+    event_id = last_event_id or since
+    if not event_id:
+        return run_events.generation
+    return run_events.find(event_id)
+
+
+def open_stream(since: Optional[int]) -> Tuple[int, str]:
+    # the client reconnects after this delay (ms) once the stream is closed
+    head = "retry: 1000\n\n"
+    if since is None:
+        # the client has to look for the last runs by itself and, with the
+        # last event id cleared, reconnects as a new client
+        since = run_events.generation
+        head += "id\nevent: reset\ndata: {}\n\n"
+    return since, head
+
+
+def collect_events(since: int, filters: Dict[str, str]) -> Tuple[int, str]:
+    """The events following since matching the filters, and the new token"""
+    chunks: List[str] = []
+    for since, event in run_events.get(since):
+        if match_event(event, filters):
+            chunks.append(format_event(event))
+    return since, "".join(chunks)
+
+
+def stream_events(
+    since: Optional[int], filters: Dict[str, str], timeout: float
+) -> Iterator[str]:
+    """
+    Server-Sent Events stream of the new runs. The stream is closed after
+    the timeout: the clients reconnect sending their Last-Event-ID
+    """
+    since, head = open_stream(since)
+    yield head
+    deadline = time.monotonic() + timeout
+    while (remaining := deadline - time.monotonic()) > 0:
+        run_events.wait(since, min(remaining, EVENTS_HEARTBEAT))
+        since, chunk = collect_events(since, filters)
+        # the heartbeat keeps the connection alive through the proxies
+        yield chunk or HEARTBEAT
+
+
+def get_events_schema() -> Type[Schema]:
+    attributes: Dict[str, Any] = {}
+    attributes["kind"] = fields.Str(validate=validate.OneOf(["maps", "tiles"]))
+    attributes["platform"] = fields.Str(validate=validate.OneOf(PLATFORMS))
+    attributes["env"] = fields.Str(validate=validate.OneOf(ENVS))
+    attributes["run"] = fields.Str(validate=validate.OneOf(RUNS))
+    attributes["dataset"] = fields.Str(
+        validate=validate.OneOf(sorted(set(RESOLUTIONS) | set(DATASETS)))
+    )
+    attributes["area"] = fields.Str(validate=validate.OneOf(AREAS))
+    # the id of the last event received
+    attributes["since"] = fields.Str()
+    attributes["timeout"] = fields.Int(
+        validate=validate.Range(min=1, max=EVENTS_TIMEOUT)
+    )
+    return Schema.from_dict(attributes, name="MapEventsSchema")
+
+
+class StreamLimit:
+    """Limit of the streams open at the same time in a process"""
+
+    def __init__(self, size: int) -> None:
+        self.size = size
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def is_full(self) -> bool:
+        return self.count >= self.size
+
+    def track(self, stream: Iterator[str]) -> Iterator[str]:
+        """Count the stream as open until it is closed"""
+        with self._lock:
+            self.count += 1
+        try:
+            yield from stream
+        finally:
+            with self._lock:
+                self.count -= 1
+
+
+# each open stream holds a thread of a Flask worker
+flask_streams = StreamLimit(EVENTS_MAX_STREAMS)
+
+
+class MapEvents(EndpointResource):
+    labels = ["maps"]
+
+    @decorators.use_kwargs(get_events_schema(), location="query")
+    @decorators.endpoint(
+        path="/maps/events",
+        summary="Stream the new runs as Server-Sent Events.",
+        responses={
+            200: "Event stream successfully opened",
+            400: "Invalid parameters",
+            503: "Too many open streams",
+        },
+    )
+    def get(
+        self,
+        since: Optional[str] = None,
+        timeout: Optional[int] = None,
+        **filters: str,
+    ) -> Response:
+        """Push an event whenever a new run of the requested datasets is ready."""
+        if flask_streams.is_full():
+            raise ServiceUnavailable(
+                "Too many event streams, subscribe through the ASGI application"
+            )
+        if catalog.live:
+            catalog.start()
+        token = get_event_token(request.headers.get("Last-Event-ID"), since)
+        response = Response(
+            stream_with_context(
+                flask_streams.track(
+                    stream_events(token, filters, timeout or EVENTS_TIMEOUT)
+                )
+            ),
+            mimetype="text/event-stream",
+        )
+        response.headers["Cache-Control"] = "no-cache"
+        # the frontend server must not buffer the stream
+        response.headers["X-Accel-Buffering"] = "no"
+        return response
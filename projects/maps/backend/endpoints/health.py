@@ -0,0 +1,147 @@
+import threading
+import time
+from typing import Dict, List, Optional
+
+from maps.endpoints.config import (
+    HEALTH_FALL,
+    HEALTH_INTERVAL,
+    HEALTH_RISE,
+    HEALTH_TIMEOUT,
+    PLATFORMS,
+    check_platform_availability,
+)
+from maps.endpoints.metrics import PLATFORM_TRANSITIONS
+from restapi.config import TESTING
+from restapi.utilities.logs import log
+
+
+class PlatformMonitor:
+    """
+    Up/down state of the platform mounts, probed in background.
+
+    Each probe runs in its own thread and is considered failed if it does not
+    complete within the timeout: a hung mount never blocks the requests nor
+    the monitor. A platform changes state only after `fall` consecutive
+    failed probes (or `rise` consecutive successful ones), so that a single
+    slow probe does not make the maps flap between the platforms.
+    """
+
+    def __init__(
+        self,
+        platforms: List[str],
+        interval: float,
+        timeout: float,
+        fall: int,
+        rise: int,
+        enabled: bool = True,
+    ) -> None:
+        self.platforms = platforms
+        self.interval = interval
+        self.timeout = timeout
+        self.fall = fall
+        self.rise = rise
+        self.enabled = enabled
+        # incremented at each state change, to invalidate the cached responses
+        self.generation = 0
+        self._up: Dict[str, bool] = {}
+        self._streaks: Dict[str, int] = {}
+        # completion events of the probes, still unset if a probe is hanging
+        self._probes: Dict[str, threading.Event] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def is_up(self, platform: str) -> bool:
+        if not self.enabled:
+            return check_platform_availability(platform)
+        self.start()
+        return self._up.get(platform, False)
+
+    def start(self) -> None:
+        if self._thread:
+            return
+        with self._lock:
+            if self._thread:
+                return
+            # the first round is waited for, never longer than the timeout
+            self.probe_all()
+            self._thread = threading.Thread(
+                target=self._run, name="platform-monitor", daemon=True
+            )
+            self._thread.start()
+
+    def probe_all(self) -> None:
+        results: Dict[str, bool] = {}
+        probes = {p: self._start_probe(p, results) for p in self.platforms}
+        deadline = time.monotonic() + self.timeout
+        for platform, done in probes.items():
+            completed = done is not None and done.wait(
+                max(0.0, deadline - time.monotonic())
+            )
+            if not completed:
+                log.warning("Platform {} probe timed out", platform)
+            self.update(platform, completed and results.get(platform, False))
+
+    def _start_probe(
+        self, platform: str, results: Dict[str, bool]
+    ) -> Optional[threading.Event]:
+        previous = self._probes.get(platform)
+        if previous and not previous.is_set():
+            # the previous probe is still stuck on the mount
+            return None
+        done = threading.Event()
+
+        def probe() -> None:
+            try:
+                results[platform] = check_platform_availability(platform)
+            except OSError:
+                results[platform] = False
+            done.set()
+
+        self._probes[platform] = done
+        threading.Thread(
+            target=probe, name=f"platform-probe-{platform}", daemon=True
+        ).start()
+        return done
+
+    def update(self, platform: str, success: bool) -> None:
+        current = self._up.get(platform)
+        if current is None:
+            # no history yet: trust the first probe
+            self._set(platform, success)
+            return
+        if success == current:
+            self._streaks[platform] = 0
+            return
+        self._streaks[platform] = self._streaks.get(platform, 0) + 1
+        if self._streaks[platform] >= (self.rise if success else self.fall):
+            self._set(platform, success)
+
+    def _set(self, platform: str, up: bool) -> None:
+        self._up[platform] = up
+        self._streaks[platform] = 0
+        self.generation += 1
+        state = "up" if up else "down"
+        PLATFORM_TRANSITIONS.labels(platform, state).inc()
+        if up:
+            log.info("Platform {} is available", platform)
+        else:
+            log.warning("Platform {} is not available", platform)
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.probe_all()
+            except Exception as exc:  # pragma: no cover
+                log.error("Platform monitor failure: {}", exc)
+
+
+# in tests the platform folders are created and removed on the fly
+platform_monitor = PlatformMonitor(
+    PLATFORMS,
+    interval=HEALTH_INTERVAL,
+    timeout=HEALTH_TIMEOUT,
+    fall=HEALTH_FALL,
+    rise=HEALTH_RISE,
+    enabled=not TESTING,
+)
@@ -0,0 +1,53 @@
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, TypedDict, cast
+
+from restapi.utilities.logs import log
+
+# Per-run manifest, written next to the .READY file by the ingest task:
+#
+#   {"format": 1, "reftime": "2022022300", "complete": true,
+#    "files": {"t2m/t2m.2022022300.0000.png": [size, "crc32"], ...},
+#    "missing": ["t2m/t2m.2022022300.0072.png", ...]}
+#
+# The catalog lists the maps of a run by reading its manifest, instead of
+# scanning the field folders.
+MANIFEST_SUFFIX = ".manifest.json"
+MANIFEST_FORMAT = 1
+
+
+class Manifest(TypedDict):
+    format: int
+    reftime: str
+    complete: bool
+    # (size, crc32) of each file, by key: <field>/<image name>
+    files: Dict[str, Tuple[int, str]]
+    missing: List[str]
+
+
+def get_manifest_path(area_path: Path, reftime: str) -> Path:
+    return area_path.joinpath(f"{reftime}{MANIFEST_SUFFIX}")
+
+
+def read_manifest(path: Path) -> Optional[Manifest]:
+    try:
+        with open(path) as f:
+            manifest: Any = json.load(f)
+    except (OSError, ValueError) as exc:
+        log.warning("Cannot read manifest {}: {}", path, exc)
+        return None
+    if not isinstance(manifest, dict) or manifest.get("format") != MANIFEST_FORMAT:
+        log.warning("Unsupported manifest {}", path)
+        return None
+    return cast(Manifest, manifest)
+
+
+def write_manifest(area_path: Path, manifest: Manifest) -> Path:
+    dest = get_manifest_path(area_path, manifest["reftime"])
+    tmp_dest = area_path.joinpath(f".{dest.name}.tmp")
+    with open(tmp_dest, "w") as f:
+        json.dump(manifest, f, separators=(",", ":"))
+    # never seen half written
+    os.replace(tmp_dest, dest)
+    return dest
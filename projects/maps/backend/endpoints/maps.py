@@ -1,6 +1,22 @@
-from datetime import datetime
-from typing import Dict, Optional, Type, Union
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from functools import partial
+from pathlib import Path
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Type,
+    TypeVar,
+    Union,
+)
 
+from maps.endpoints.cache import ReadyCache
+from maps.endpoints.catalog import catalog
 from maps.endpoints.config import (
     AREAS,
     DEFAULT_PLATFORM,
@@ -9,21 +25,47 @@
     LEVELS_PE,
     LEVELS_PR,
     PLATFORMS,
+    PREWARM,
+    READY_DEADLINE,
+    REGIONS,
     RESOLUTIONS,
     RUNS,
-    check_platform_availability,
     get_base_path,
-    get_ready_file,
+    get_image_name,
+    get_level,
+)
+from maps.endpoints.crops import get_crop, locate_crop
+from maps.endpoints.delivery import (
+    send_hot_map,
+    send_image_data,
+    send_map,
+    send_map_file,
+)
+from maps.endpoints.health import platform_monitor
+from maps.endpoints.metrics import instrument
+from maps.endpoints.retention import retention
+from maps.endpoints.thumbnails import (
+    MAX_THUMBNAIL_SIZE,
+    MIN_THUMBNAIL_SIZE,
+    THUMBNAIL_SIZES,
+    get_bounding_box,
+    get_thumbnail,
 )
+from maps.endpoints.variants import (
+    SUPPORTED_VARIANTS,
+    VARIANT_FORMATS,
+    get_variant,
+    negotiate_variant,
+)
+from maps.tasks.prewarm import prewarmer
 from restapi import decorators
 from restapi.exceptions import NotFound, ServiceUnavailable
 from restapi.models import Schema, fields, validate
 from restapi.rest.definition import EndpointResource, Response
-from restapi.services.download import Downloader
 from restapi.utilities.logs import log
 
 
-def get_schema(set_required: bool) -> Type[Schema]:
+def get_schema_attributes(set_required: bool) -> Dict[str, Union[fields.Field, type]]:
     attributes: Dict[str, Union[fields.Field, type]] = {}
     attributes["run"] = fields.Str(validate=validate.OneOf(RUNS), required=True)
     attributes["res"] = fields.Str(validate=validate.OneOf(RESOLUTIONS), required=True)
@@ -39,21 +81,344 @@ def get_schema(set_required: bool) -> Type[Schema]:
         validate=validate.OneOf(LEVELS_PR), required=False
     )
     attributes["env"] = fields.Str(validate=validate.OneOf(ENVS), required=False)
+    return attributes
+
+
+def add_reftime_attribute(attributes: Dict[str, Union[fields.Field, type]]) -> None:
+    # a specific run among the ones retained, the last one by default
+    attributes["reftime"] = fields.Str(
+        validate=validate.Regexp(r"^\d{10}$"), required=False
+    )
+
 
+def get_schema(set_required: bool) -> Type[Schema]:
+    attributes = get_schema_attributes(set_required)
+    add_reftime_attribute(attributes)
     return Schema.from_dict(attributes, name="MapsSchema")
 
 
+def get_image_schema() -> Type[Schema]:
+    attributes = get_schema_attributes(True)
+    add_reftime_attribute(attributes)
+    size_range = validate.Range(min=MIN_THUMBNAIL_SIZE, max=MAX_THUMBNAIL_SIZE)
+    attributes["width"] = fields.Int(validate=size_range, required=False)
+    attributes["height"] = fields.Int(validate=size_range, required=False)
+    attributes["size"] = fields.Str(
+        validate=validate.OneOf(THUMBNAIL_SIZES.keys()), required=False
+    )
+    # west,south,east,north in degrees, or a named region
+    attributes["bbox"] = fields.Str(
+        validate=validate.Regexp(r"^-?\d+(\.\d+)?(,-?\d+(\.\d+)?){3}$"),
+        required=False,
+    )
+    attributes["region"] = fields.Str(
+        validate=validate.OneOf(REGIONS.keys()), required=False
+    )
+    return Schema.from_dict(attributes, name="MapsImageSchema")
+
+
+# MapSet responses, valid until a new run lands
+ready_cache = ReadyCache("ready")
+
+if PREWARM:
+    catalog.subscribe(prewarmer.submit)
+
+
 class MapReadyOutputSchema(Schema):
     reftime = fields.Str(required=True)
     offsets = fields.List(fields.Str(), required=True)
     platform = fields.Str(required=True)
+    # platforms not considered: not available or too slow to answer
+    skipped = fields.List(fields.Str(), required=False)
+
+
+# lookups of the runs of each platform, bounded by READY_DEADLINE
+reftime_executor = ThreadPoolExecutor(
+    max_workers=4 * len(PLATFORMS), thread_name_prefix="reftime"
+)
+# lookups still running past the deadline, by platform: a hung mount is not
+# given any other thread of the pool until they return
+stuck_lookups: Dict[str, Future] = {}
+
+T = TypeVar("T")
+
+
+class RunLookup(NamedTuple):
+    reftime: str
+    offsets: List[str]
+
+
+def lookup_run(
+    base_path: Path,
+    area: str,
+    field: str,
+    level: Optional[str],
+    reftime: Optional[str] = None,
+) -> Optional[RunLookup]:
+    """Find the last (or the given) run of an area folder and its offsets"""
+    found = catalog.get_reftime(base_path, area, reftime)
+    if not found:
+        return None
+    offsets = catalog.get_offsets(base_path, area, field, level, found)
+    return RunLookup(found, offsets)
+
+
+def run_lookups(
+    lookups: Dict[str, Tuple[Path, Callable[[], T]]], deadline: float
+) -> Tuple[Dict[str, T], List[str]]:
+    """
+    Run the lookups of the area folder of each platform. The ones served by
+    the catalog index are done inline, the others read the run folders and
+    run concurrently in the pool.
+    Return the results and the platforms not answering before the deadline.
+    """
+    results: Dict[str, T] = {}
+    futures: Dict[Future, str] = {}
+    late: List[str] = []
+    for pl, (area_path, lookup) in lookups.items():
+        if catalog.live and catalog.is_indexed(area_path):
+            results[pl] = lookup()
+            continue
+        stuck = stuck_lookups.get(pl)
+        if stuck and not stuck.done():
+            late.append(pl)
+            continue
+        stuck_lookups.pop(pl, None)
+        futures[reftime_executor.submit(lookup)] = pl
+    if not futures:
+        return results, late
+    done, not_done = wait(futures, timeout=max(0, deadline - time.monotonic()))
+    for future in done:
+        try:
+            results[futures[future]] = future.result()
+        except OSError as exc:
+            log.warning("Cannot read the runs of {}: {}", futures[future], exc)
+    for future in not_done:
+        stuck_lookups[futures[future]] = future
+        late.append(futures[future])
+    for pl in late:
+        log.warning("Platform {} skipped: no answer within the deadline", pl)
+    return results, late
+
+
+def not_ready_message(reftime: Optional[str]) -> str:
+    if reftime:
+        return f"run {reftime} not found"
+    return "no .READY files found"
+
+
+class MapImageInfo(NamedTuple):
+    base_path: Path
+    reftime: str
+    image_name: str
+    # offset, along with the level for the flash flood maps
+    label: str
+
+
+def locate_map_image(
+    map_offset: str,
+    run: str,
+    res: str,
+    field: str,
+    area: str,
+    platform: str,
+    level_pe: Optional[str] = None,
+    level_pr: Optional[str] = None,
+    env: str = "PROD",
+    reftime: Optional[str] = None,
+) -> MapImageInfo:
+    """Find the map image of the last (or given) run, raise NotFound if missing"""
+    offset = map_offset
+    level = get_level(field, level_pe, level_pr)
+
+    # flash flood offset is a bit more complicate
+    if field == "percentile":
+        map_offset = f"{map_offset}_{level_pe}"
+    elif field == "probability":
+        map_offset = f"{map_offset}_{level_pr}"
+
+    log.debug(f"Retrieve map image by offset <{map_offset}>")
+
+    base_path = get_base_path(field, platform, env, run, res)
+
+    # Check if the images are ready: 2017112900.READY
+    requested = reftime
+    reftime = catalog.get_reftime(base_path, area, requested)
+    if not reftime:
+        raise NotFound(not_ready_message(requested))
+
+    # get map image
+    image_name = get_image_name(field, reftime, offset, level)
+    log.debug(f"map image: {image_name}")
+
+    if offset not in catalog.get_offsets(base_path, area, field, level, reftime):
+        raise NotFound(f"Map image not found for offset {map_offset}")
+
+    return MapImageInfo(base_path, reftime, image_name, map_offset)
+
+
+def get_map_set(
+    run: str,
+    res: str,
+    field: str,
+    area: str,
+    platform: Optional[str] = None,
+    level_pe: Optional[str] = None,
+    level_pr: Optional[str] = None,
+    env: str = "PROD",
+    reftime: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Get the last available map set for a specific run
+    and return the reference time as well
+    """
+
+    log.debug(f"Retrieve map set for last run <{run}>")
+
+    if field == "percentile" or field == "probability":
+        platform = "G100"
+        log.warning("Forcing platform to {} because field is {}", platform, field)
+
+    retention.start()
+    level = get_level(field, level_pe, level_pr)
+    cache_key = (run, res, field, area, platform, level, env, reftime)
+
+    skipped: List[str] = []
+    # if PLATFORM is not provided, set as default the first available
+    # in the order: DEFAULT_PLATFORM + others
+    if not platform:
+        log.debug(f"PLATFORMS: {PLATFORMS}")
+        log.debug(f"DEFAULT PLATFORM: {DEFAULT_PLATFORM}")
+        platforms_to_be_check = [DEFAULT_PLATFORM] + list(
+            set(PLATFORMS) - {DEFAULT_PLATFORM}
+        )
+
+        # check platform availability
+        platforms_available = []
+        for check_pl in platforms_to_be_check:
+            if not platform_monitor.is_up(check_pl):
+                log.warning(f"platform {check_pl} not available")
+                skipped.append(check_pl)
+                continue
+            platforms_available.append(check_pl)
+        if not platforms_available:
+            raise ServiceUnavailable("Map service is currently unavailable")
+    else:
+        # check platform availability
+        if not platform_monitor.is_up(platform):
+            raise ServiceUnavailable(
+                f"Map service is currently unavailable for {platform} platform"
+            )
+        platforms_available = [platform]
+
+    # the run folders are only read by the lookups, within the deadline
+    deadline = time.monotonic() + READY_DEADLINE / 1000
+    base_paths = {
+        pl: get_base_path(field, pl, env, run, res) for pl in platforms_available
+    }
+    versions, late = run_lookups(
+        {
+            pl: (path.joinpath(area), partial(catalog.version, path, area))
+            for pl, path in base_paths.items()
+        },
+        deadline,
+    )
+    # the response is valid until any of the involved run folders changes
+    cache_token = (platform_monitor.generation,) + tuple(
+        versions.get(pl) for pl in platforms_available
+    )
+    if not late and (cached_data := ready_cache.get(cache_key, cache_token)):
+        return cached_data
+
+    runs, late_runs = run_lookups(
+        {
+            pl: (
+                base_paths[pl].joinpath(area),
+                partial(lookup_run, base_paths[pl], area, field, level, reftime),
+            )
+            for pl in versions
+        },
+        deadline,
+    )
+    late.extend(late_runs)
+    skipped.extend(late)
+
+    # check if maps are ready and which platform has the latest one
+    best: Optional[RunLookup] = None
+    for pl in platforms_available:
+        # Check if the images are ready: 2017112900.READY
+        pl_run = runs.get(pl)
+        if not pl_run:
+            continue
+        # reftimes are sortable strings: YYYYMMDDHH
+        if not best or pl_run.reftime > best.reftime:
+            best = pl_run
+            platform = pl
+
+    if not best:
+        if late:
+            raise ServiceUnavailable("Map service is currently too slow")
+        raise NotFound(not_ready_message(reftime))
+
+    log.debug("data offsets: {}", best.offsets)
+
+    data: Dict[str, Any] = {
+        "reftime": best.reftime,
+        "offsets": best.offsets,
+        "platform": platform,
+    }
+    if skipped:
+        data["skipped"] = skipped
+    # a slow platform may have a more recent run: do not keep a partial answer
+    if not late:
+        ready_cache.set(cache_key, cache_token, data)
+    return data
+
+
+def locate_legend(
+    run: str,
+    res: str,
+    field: str,
+    area: str,
+    platform: str,
+    env: str = "PROD",
+    reftime: Optional[str] = None,
+) -> Tuple[Path, Optional[str], str]:
+    """Return the base path, reftime and key of the legend of a field"""
+    base_path = get_base_path(field, platform, env, run, res)
+
+    # Get legend image
+    legend_path = base_path.joinpath("legends")
+    if field == "percentile":
+        map_legend_file = "perc6.png"
+    elif field == "probability":
+        map_legend_file = "prob6.png"
+    else:
+        map_legend_file = field + ".png"
+
+    map_legend_path = legend_path.joinpath(map_legend_file)
+    log.debug(map_legend_path)
+
+    # legends are overwritten by each run: bind them to the current one
+    requested = reftime
+    reftime = catalog.get_reftime(base_path, area, requested)
+    if requested and not reftime:
+        raise NotFound(not_ready_message(requested))
+    legend_key = f"legends/{map_legend_file}"
+
+    reader = catalog.get_pack_reader(base_path, area, reftime)
+    packed = reader is not None and reader.locate(legend_key) is not None
+    if not packed and not map_legend_path.is_file():
+        raise NotFound(f"Map legend not found for field <{field}>")
+
+    return base_path, reftime, legend_key
 
 
 class MapImage(EndpointResource):
     labels = ["maps"]
 
     # @decorators.cache(timeout=900)
-    @decorators.use_kwargs(get_schema(True), location="query")
+    @decorators.use_kwargs(get_image_schema(), location="query")
     @decorators.endpoint(
         path="/maps/offset/<map_offset>",
         summary="Get a forecast map for a specific run.",
@@ -63,6 +428,7 @@ class MapImage(EndpointResource):
             404: "Map does not exists",
         },
     )
+    @instrument
     def get(
         self,
         map_offset: str,
@@ -74,50 +440,89 @@ def get(
         level_pe: Optional[str] = None,
         level_pr: Optional[str] = None,
         env: str = "PROD",
+        reftime: Optional[str] = None,
+        width: Optional[int] = None,
+        height: Optional[int] = None,
+        size: Optional[str] = None,
+        bbox: Optional[str] = None,
+        region: Optional[str] = None,
     ) -> Response:
-        """Get a forecast map for a specific run."""
-
-        # flash flood offset is a bit more complicate
-        if field == "percentile":
-            map_offset = f"{map_offset}_{level_pe}"
-        elif field == "probability":
-            map_offset = f"{map_offset}_{level_pr}"
-
-        log.debug(f"Retrieve map image by offset <{map_offset}>")
-
-        base_path = get_base_path(field, platform, env, run, res)
+        """Get a forecast map for a specific run, optionally resized or cropped."""
+
+        crop = None
+        if bbox or region:
+            # the crop is cut out of the smallest map containing it
+            resized = bool(width or height or size)
+            area, crop = locate_crop(field, res, bbox, region, resized)
+
+        base_path, reftime, image_name, map_offset = locate_map_image(
+            map_offset,
+            run,
+            res,
+            field,
+            area,
+            platform,
+            level_pe,
+            level_pr,
+            env,
+            reftime,
+        )
 
-        # Check if the images are ready: 2017112900.READY
-        ready_file = get_ready_file(base_path, area)
-        if not ready_file:
-            raise NotFound("no .READY files found")
-        reftime = ready_file.name[:10]
-
-        # get map image
-        if field == "percentile":
-            image_name = f"perc6.{reftime}.{map_offset}.png"
-        elif field == "probability":
-            image_name = f"prob6.{reftime}.{map_offset}.png"
+        variant = negotiate_variant()
+        if crop:
+            image_format = variant or "png"
+            crop_file, pixel_box = get_crop(
+                base_path, area, field, res, image_name, reftime, crop, image_format
+            )
+            response = send_map_file(
+                crop_file,
+                reftime,
+                f"{map_offset}@{'-'.join(str(v) for v in pixel_box)}.{image_format}",
+                mime=VARIANT_FORMATS[variant][1] if variant else "image/png",
+            )
+        elif width or height or size:
+            box_width, box_height = get_bounding_box(width, height, size)
+            image_format = variant or "png"
+            mime = VARIANT_FORMATS[variant][1] if variant else "image/png"
+            response = send_image_data(
+                f"{base_path}/{area}/{field}/{image_name}"
+                f"@{box_width}x{box_height}.{image_format}",
+                reftime,
+                mime,
+                lambda: get_thumbnail(
+                    base_path,
+                    area,
+                    field,
+                    image_name,
+                    reftime,
+                    box_width,
+                    box_height,
+                    image_format,
+                ),
+            )
+        # serve a lighter image format if the client supports it
+        elif variant:
+            variant_file = get_variant(
+                base_path, area, field, image_name, reftime, variant
+            )
+            response = send_map_file(
+                variant_file,
+                reftime,
+                f"{map_offset}.{variant}",
+                mime=VARIANT_FORMATS[variant][1],
+            )
         else:
-            image_name = f"{field}.{reftime}.{map_offset}.png"
-
-        image_path = base_path.joinpath(area, field)
-        map_image_file = image_path.joinpath(image_name)
-
-        log.debug(f"map_image_file: {map_image_file}")
-
-        if not map_image_file.is_file():
-            raise NotFound(f"Map image not found for offset {map_offset}")
-
-        return Downloader.send_file_content(
-            image_name, subfolder=image_path, mime="image/png"
-        )
+            response = send_hot_map(
+                base_path, area, f"{field}/{image_name}", reftime, map_offset
+            )
+        if SUPPORTED_VARIANTS:
+            response.vary.add("Accept")
+        return response
 
 
 class MapSet(EndpointResource):
     labels = ["maps"]
 
-    # @decorators.cache(timeout=900)
     @decorators.use_kwargs(get_schema(False), location="query")
     @decorators.endpoint(
         path="/maps/ready",
@@ -130,6 +535,7 @@ class MapSet(EndpointResource):
         },
     )
     @decorators.marshal_with(MapReadyOutputSchema, code=200)
+    @instrument
     def get(
         self,
         run: str,
@@ -140,94 +546,17 @@ def get(
         level_pe: Optional[str] = None,
         level_pr: Optional[str] = None,
         env: str = "PROD",
+        reftime: Optional[str] = None,
     ) -> Response:
         """
         Get the last available map set for a specific run
         and return the reference time as well
         """
-
-        log.debug(f"Retrieve map set for last run <{run}>")
-
-        if field == "percentile" or field == "probability":
-            platform = "G100"
-            log.warning("Forcing platform to {} because field is {}", platform, field)
-
-        # if PLATFORM is not provided, set as default the first available
-        # in the order: DEFAULT_PLATFORM + others
-        if not platform:
-            log.debug(f"PLATFORMS: {PLATFORMS}")
-            log.debug(f"DEFAULT PLATFORM: {DEFAULT_PLATFORM}")
-            platforms_to_be_check = [DEFAULT_PLATFORM] + list(
-                set(PLATFORMS) - {DEFAULT_PLATFORM}
+        return self.response(
+            get_map_set(
+                run, res, field, area, platform, level_pe, level_pr, env, reftime
             )
-
-            # check platform availability
-            platforms_available = []
-            for check_pl in platforms_to_be_check:
-                if not check_platform_availability(check_pl):
-                    log.warning(f"platform {check_pl} not available")
-                    continue
-                platforms_available.append(check_pl)
-            if not platforms_available:
-                raise ServiceUnavailable("Map service is currently unavailable")
-
-            # check if maps are ready and which platform has the latest one
-            base_path = None
-            reftime = None
-            for pl in platforms_available:
-                # Check if the images are ready: 2017112900.READY
-                temp_base_path = get_base_path(field, pl, env, run, res)
-                ready_file = get_ready_file(temp_base_path, area)
-                if not ready_file:
-                    continue
-
-                dt_reftime = datetime.strptime(ready_file.name[:10], "%Y%m%d%H")
-                if not reftime or dt_reftime > reftime:  # type: ignore
-                    reftime = dt_reftime
-                    base_path = get_base_path(field, pl, env, run, res)
-                    platform = pl
-                    last_reftime = reftime.strftime("%Y%m%d%H")
-
-            if not base_path:
-                raise NotFound("no .READY files found")
-
-        else:
-            # check platform availability
-            if not check_platform_availability(platform):
-                raise ServiceUnavailable(
-                    f"Map service is currently unavailable for {platform} platform"
-                )
-            # check if there is a ready file
-            base_path = get_base_path(field, platform, env, run, res)
-            ready_file = get_ready_file(base_path, area)
-            if not ready_file:
-                raise NotFound("no .READY files found")
-            last_reftime = ready_file.name[:10]
-
-        # load image offsets
-        images_path = base_path.joinpath(area, field)
-
-        list_file = sorted(images_path.iterdir())
-
-        if field == "percentile" or field == "probability":
-            offsets = []
-            # flash flood offset is a bit more complicate
-            for f in list_file:
-                if f.is_file():
-                    offset = f.name.split(".")[-2]
-                    # offset is like this now: 0006_10
-                    offset, level = offset.split("_")
-                    if field == "percentile" and level_pe == level:
-                        offsets.append(offset)
-                    elif field == "probability" and level_pr == level:
-                        offsets.append(offset)
-        else:
-            offsets = [f.name.split(".")[-2] for f in list_file if f.is_file()]
-
-        log.debug("data offsets: {}", offsets)
-
-        data = {"reftime": last_reftime, "offsets": offsets, "platform": platform}
-        return self.response(data)
+        )
 
 
 class MapLegend(EndpointResource):
@@ -244,6 +573,7 @@ class MapLegend(EndpointResource):
             404: "Legend does not exists",
         },
     )
+    @instrument
     def get(
         self,
         run: str,
@@ -254,29 +584,14 @@ def get(
         level_pe: Optional[str] = None,
         level_pr: Optional[str] = None,
         env: str = "PROD",
+        reftime: Optional[str] = None,
     ) -> Response:
         """Get a forecast legend for a specific run."""
         # NOTE: 'area' param is not strictly necessary here
         # although present among the parameters of the request
         log.debug("Retrieve legend for run <{}, {}, {}>", run, res, field)
 
-        base_path = get_base_path(field, platform, env, run, res)
-
-        # Get legend image
-        legend_path = base_path.joinpath("legends")
-        if field == "percentile":
-            map_legend_file = "perc6.png"
-        elif field == "probability":
-            map_legend_file = "prob6.png"
-        else:
-            map_legend_file = field + ".png"
-
-        map_legend_path = legend_path.joinpath(map_legend_file)
-        log.debug(map_legend_path)
-
-        if not map_legend_path.is_file():
-            raise NotFound(f"Map legend not found for field <{field}>")
-
-        return Downloader.send_file_content(
-            map_legend_file, subfolder=legend_path, mime="image/png"
+        base_path, reftime, legend_key = locate_legend(
+            run, res, field, area, platform, env, reftime
         )
+        return send_map(base_path, area, legend_key, reftime, "legend")
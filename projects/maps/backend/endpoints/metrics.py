@@ -0,0 +1,105 @@
+import os
+import time
+from functools import wraps
+from typing import Any, Callable, TypeVar, cast
+
+from flask import Response
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from restapi import decorators
+from restapi.rest.definition import EndpointResource
+
+# With PROMETHEUS_MULTIPROC_DIR set, each gunicorn worker writes its samples
+# into that folder and the /metrics endpoint aggregates all of them
+MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+if MULTIPROC_DIR:
+    os.makedirs(MULTIPROC_DIR, exist_ok=True)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+REQUEST_LATENCY = Histogram(
+    "maps_request_duration_seconds",
+    "Time spent to answer the requests",
+    ["endpoint"],
+    buckets=LATENCY_BUCKETS,
+)
+REQUESTS = Counter(
+    "maps_requests_total",
+    "Requests answered, by status code, field and platform",
+    ["endpoint", "status", "field", "platform"],
+)
+BYTES_SERVED = Counter(
+    "maps_bytes_served_total", "Size of the response bodies", ["endpoint"]
+)
+FS_CALLS = Counter(
+    "maps_fs_calls_total", "Filesystem calls done by the helpers", ["helper", "call"]
+)
+SCAN_LATENCY = Histogram(
+    "maps_catalog_scan_duration_seconds",
+    "Time spent to list an area folder",
+    buckets=LATENCY_BUCKETS,
+)
+PLATFORM_TRANSITIONS = Counter(
+    "maps_platform_transitions_total",
+    "State changes of the platform mounts",
+    ["platform", "state"],
+)
+CACHE_REQUESTS = Counter(
+    "maps_cache_requests_total", "Cache lookups, by result", ["cache", "result"]
+)
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+
+def count_cache(cache: str, hit: bool) -> None:
+    CACHE_REQUESTS.labels(cache, "hit" if hit else "miss").inc()
+
+
+def instrument(func: F) -> F:
+    """Measure the latency, outcome and response size of an endpoint method"""
+
+    @wraps(func)
+    def wrapper(self: EndpointResource, *args: Any, **kwargs: Any) -> Any:
+        endpoint = self.__class__.__name__
+        field = kwargs.get("field") or kwargs.get("dataset") or ""
+        platform = kwargs.get("platform") or ""
+        start = time.perf_counter()
+        status = 500
+        try:
+            response = func(self, *args, **kwargs)
+            status = getattr(response, "status_code", 200)
+            BYTES_SERVED.labels(endpoint).inc(
+                getattr(response, "content_length", None) or 0
+            )
+            return response
+        except Exception as exc:
+            status = getattr(exc, "status_code", 500)
+            raise
+        finally:
+            REQUEST_LATENCY.labels(endpoint).observe(time.perf_counter() - start)
+            REQUESTS.labels(endpoint, str(status), field, platform).inc()
+
+    return cast(F, wrapper)
+
+
+class Metrics(EndpointResource):
+    labels = ["metrics"]
+
+    @decorators.endpoint(
+        path="/metrics",
+        summary="Prometheus metrics of the maps service",
+        responses={200: "Metrics successfully retrieved"},
+    )
+    def get(self) -> Response:
+        registry = REGISTRY
+        if MULTIPROC_DIR:
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
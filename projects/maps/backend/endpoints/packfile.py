@@ -0,0 +1,180 @@
+import mmap
+import os
+import struct
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from restapi.utilities.logs import log
+
+# Single-file archive of many small files (map images, tiles):
+#
+#   header: magic, version, index offset, number of entries
+#   data:   the files content, one after the other
+#   index:  one record per file (key offset, key length, data offset,
+#           data length) sorted by key, followed by the keys
+#
+# Lookups are binary searches on the memory-mapped index, so that opening an
+# archive costs nothing regardless of the number of files it contains.
+MAGIC = b"MHPK"
+VERSION = 1
+HEADER = struct.Struct("<4sHHQQ")
+RECORD = struct.Struct("<QIQI")
+PACK_SUFFIX = ".pack"
+COPY_BUFFER = 1024 * 1024
+
+
+def write_pack(dest: Path, entries: Iterable[Tuple[str, Path]]) -> int:
+    """Pack the given (key, file) entries into dest, return the number of files"""
+    index: List[Tuple[bytes, int, int]] = []
+    with open(dest, "wb") as out:
+        out.write(HEADER.pack(MAGIC, VERSION, 0, 0, 0))
+        for key, path in entries:
+            position = out.tell()
+            with open(path, "rb") as f:
+                while chunk := f.read(COPY_BUFFER):
+                    out.write(chunk)
+            index.append((key.encode(), position, out.tell() - position))
+
+        index.sort()
+        keys_offset = out.tell() + RECORD.size * len(index)
+        index_offset = out.tell()
+        for key, position, length in index:
+            out.write(RECORD.pack(keys_offset, len(key), position, length))
+            keys_offset += len(key)
+        for key, _, _ in index:
+            out.write(key)
+
+        out.seek(0)
+        out.write(HEADER.pack(MAGIC, VERSION, 0, index_offset, len(index)))
+    log.info("{} files packed into {}", len(index), dest)
+    return len(index)
+
+
+class PackSlice:
+    """
+    File-like view of a single packed file.
+    It owns a descriptor positioned at the file start, so that the WSGI
+    server can send it with sendfile (bounded by the Content-Length).
+    """
+
+    def __init__(self, path: Path, offset: int, length: int) -> None:
+        self._fd = os.open(path, os.O_RDONLY)
+        os.lseek(self._fd, offset, os.SEEK_SET)
+        self.length = length
+        self._remaining = length
+
+    def fileno(self) -> int:
+        return self._fd
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0 or size > self._remaining:
+            size = self._remaining
+        data = os.read(self._fd, size) if size else b""
+        self._remaining -= len(data)
+        return data
+
+    def close(self) -> None:
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+class PackReader:
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        with open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            self.mtime = stat.st_mtime
+            # identity of the mapped file, changing when re-packed
+            self.stamp = (stat.st_ino, stat.st_mtime_ns)
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, self._index_offset, self.count = HEADER.unpack_from(
+            self._mmap, 0
+        )
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a valid archive")
+
+    def _record(self, i: int) -> Tuple[int, int, int, int]:
+        return RECORD.unpack_from(self._mmap, self._index_offset + i * RECORD.size)
+
+    def _key(self, i: int) -> bytes:
+        key_offset, key_length, _, _ = self._record(i)
+        return self._mmap[key_offset : key_offset + key_length]
+
+    def _bisect(self, key: bytes) -> int:
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def locate(self, key: str) -> Optional[Tuple[int, int]]:
+        """Return the (offset, length) of a packed file"""
+        encoded = key.encode()
+        i = self._bisect(encoded)
+        if i == self.count or self._key(i) != encoded:
+            return None
+        _, _, offset, length = self._record(i)
+        return offset, length
+
+    def get(self, key: str) -> Optional[memoryview]:
+        """Zero-copy view of a packed file"""
+        location = self.locate(key)
+        if not location:
+            return None
+        offset, length = location
+        return memoryview(self._mmap)[offset : offset + length]
+
+    def open(self, key: str) -> Optional[PackSlice]:
+        location = self.locate(key)
+        if not location:
+            return None
+        return PackSlice(self.path, *location)
+
+    def keys(self, prefix: str = "") -> Iterator[str]:
+        """Iterate over the (sorted) keys starting with prefix"""
+        encoded = prefix.encode()
+        for i in range(self._bisect(encoded), self.count):
+            key = self._key(i)
+            if not key.startswith(encoded):
+                return
+            yield key.decode()
+
+
+# open archives: an archive is immutable, but a run can be packed again
+# under the same name, which replaces the file
+_readers: Dict[Path, PackReader] = {}
+MAX_READERS = 256
+
+
+def open_pack(path: Path) -> Optional[PackReader]:
+    reader = _readers.get(path)
+    if reader is not None:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            stat = None
+        if not stat or reader.stamp != (stat.st_ino, stat.st_mtime_ns):
+            _readers.pop(path, None)
+            reader = None
+    if reader is None:
+        try:
+            reader = PackReader(path)
+        except (OSError, ValueError) as exc:
+            log.warning("Cannot open archive {}: {}", path, exc)
+            return None
+        _readers[path] = reader
+        while len(_readers) > MAX_READERS:
+            _readers.pop(next(iter(_readers)))
+    return reader
+
+
+def close_packs(area_path: Path, keep: Iterable[str] = ()) -> None:
+    """Forget the open archives of an area folder, but the ones of keep runs"""
+    names = {f"{reftime}{PACK_SUFFIX}" for reftime in keep}
+    for path in list(_readers):
+        if path.parent == area_path and path.name not in names:
+            _readers.pop(path, None)
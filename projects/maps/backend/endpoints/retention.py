@@ -0,0 +1,122 @@
+import fcntl
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Callable, List, Optional
+
+from maps.endpoints.catalog import catalog, walk_areas
+from maps.endpoints.config import (
+    CACHE_PATH,
+    RETENTION_INTERVAL,
+    RETENTION_RUNS,
+    is_ready_file,
+)
+from maps.endpoints.manifest import get_manifest_path
+from maps.endpoints.packfile import PACK_SUFFIX
+from restapi.config import DATA_PATH
+from restapi.utilities.logs import log
+
+
+def get_expired_reftimes(area_path: Path, keep: int) -> List[str]:
+    """The runs of an area folder exceeding the most recent keep ones"""
+    try:
+        reftimes = sorted(
+            f.name[:10] for f in os.scandir(area_path) if is_ready_file(f.name)
+        )
+    except OSError:
+        return []
+    return reftimes[:-keep] if keep else []
+
+
+def prune_run(area_path: Path, reftime: str) -> int:
+    """Remove all the files of a run from an area folder"""
+    # the run is no longer listed before its files are removed
+    area_path.joinpath(f"{reftime}.READY").unlink(missing_ok=True)
+    area_path.joinpath(f"{reftime}{PACK_SUFFIX}").unlink(missing_ok=True)
+    get_manifest_path(area_path, reftime).unlink(missing_ok=True)
+
+    removed = 0
+    for dirpath, dirnames, filenames in os.walk(area_path):
+        # tiles are grouped in <reftime>.<offset> folders
+        for name in [d for d in dirnames if d.startswith(f"{reftime}.")]:
+            shutil.rmtree(Path(dirpath, name), ignore_errors=True)
+            dirnames.remove(name)
+            removed += 1
+        for name in filenames:
+            if f".{reftime}." in name:
+                Path(dirpath, name).unlink(missing_ok=True)
+                removed += 1
+    log.info("Run {} removed from {}", reftime, area_path)
+    return removed
+
+
+def prune_area(area_path: Path, keep: int) -> List[str]:
+    expired = get_expired_reftimes(area_path, keep)
+    for reftime in expired:
+        prune_run(area_path, reftime)
+    return expired
+
+
+class RetentionPolicy:
+    """
+    Keep the most recent runs of each area folder, removing the older ones
+    in background. Only one worker at a time does the pruning, and the
+    platforms not available are skipped: a stalled mount would hold the lock.
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        keep: int,
+        interval: int,
+        available: Optional[Callable[[str], bool]] = None,
+    ) -> None:
+        self.root = root
+        self.keep = keep
+        self.interval = interval
+        self.available = available
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        if not self.keep or self._thread:
+            return
+        with self._lock:
+            if self._thread:
+                return
+            self._thread = threading.Thread(
+                target=self._run, name="maps-retention", daemon=True
+            )
+            self._thread.start()
+
+    def prune(self) -> int:
+        """Prune all the area folders, return the number of runs removed"""
+        CACHE_PATH.mkdir(parents=True, exist_ok=True)
+        with open(CACHE_PATH.joinpath(".retention.lock"), "w") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                log.debug("Retention already running in another worker")
+                return 0
+            try:
+                return sum(
+                    len(prune_area(area_path, self.keep))
+                    for area_path in walk_areas(self.root, self.available)
+                )
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _run(self) -> None:
+        while True:
+            try:
+                self.prune()
+            except Exception as exc:  # pragma: no cover
+                log.error("Retention failure: {}", exc)
+            time.sleep(self.interval)
+
+
+retention = RetentionPolicy(
+    DATA_PATH, RETENTION_RUNS, RETENTION_INTERVAL, available=catalog.available
+)
@@ -0,0 +1,102 @@
+import io
+import os
+from pathlib import Path
+from typing import Dict, Hashable, Optional, Tuple
+
+from maps.endpoints.cache import MemoryCache
+from maps.endpoints.catalog import read_map
+from maps.endpoints.config import THUMBNAILS_MEMORY_SIZE, get_cache_path
+from maps.endpoints.metrics import count_cache
+from maps.endpoints.variants import VARIANT_FORMATS, variants_cache
+from PIL import Image
+from restapi.utilities.logs import log
+
+# preset sizes of the bounding box of the resized images
+THUMBNAIL_SIZES: Dict[str, int] = {"small": 160, "medium": 320, "large": 640}
+MIN_THUMBNAIL_SIZE = 16
+MAX_THUMBNAIL_SIZE = 2048
+
+# base path, area, field, image name, reftime, width, height, format
+ThumbnailKey = Tuple[Path, str, str, str, str, int, int, str]
+
+
+def get_thumbnail_path(key: ThumbnailKey) -> Path:
+    base_path, area, field, image_name, _, width, height, image_format = key
+    return get_cache_path("variants", base_path, area, field).joinpath(
+        f"{Path(image_name).stem}.{width}x{height}.{image_format}"
+    )
+
+
+def spill_thumbnail(key: Hashable, data: bytes) -> None:
+    """Move a thumbnail evicted from memory to the disk cache"""
+    path = get_thumbnail_path(key)  # type: ignore
+    if path.is_file():
+        return
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, path)
+
+
+thumbnails_cache = MemoryCache(
+    "thumbnails", THUMBNAILS_MEMORY_SIZE * 1024 * 1024, on_evict=spill_thumbnail
+)
+
+
+def get_bounding_box(
+    width: Optional[int], height: Optional[int], size: Optional[str]
+) -> Tuple[int, int]:
+    if size:
+        return THUMBNAIL_SIZES[size], THUMBNAIL_SIZES[size]
+    return width or MAX_THUMBNAIL_SIZE, height or MAX_THUMBNAIL_SIZE
+
+
+def render_thumbnail(data: bytes, width: int, height: int, image_format: str) -> bytes:
+    pil_format, _, options = VARIANT_FORMATS.get(image_format, ("PNG", "", {}))
+    output = io.BytesIO()
+    with Image.open(io.BytesIO(data)) as img:
+        img.thumbnail((width, height), Image.LANCZOS)
+        img.save(output, format=pil_format, **options)
+    return output.getvalue()
+
+
+def get_thumbnail(
+    base_path: Path,
+    area: str,
+    field: str,
+    image_name: str,
+    reftime: str,
+    width: int,
+    height: int,
+    image_format: str,
+) -> bytes:
+    """
+    Return a resized map image, looking for it in memory first,
+    then in the disk cache and rendering it as the last resort
+    """
+    key: ThumbnailKey = (
+        base_path,
+        area,
+        field,
+        image_name,
+        reftime,
+        width,
+        height,
+        image_format,
+    )
+    if (data := thumbnails_cache.get(key)) is not None:
+        return data
+
+    path = get_thumbnail_path(key)
+    try:
+        data = path.read_bytes()
+        variants_cache.touch(path)
+        count_cache("thumbnails_disk", True)
+    except OSError:
+        count_cache("thumbnails_disk", False)
+        log.debug("Resizing {} to {}x{}", image_name, width, height)
+        source = read_map(base_path, area, f"{field}/{image_name}", reftime)
+        data = render_thumbnail(source, width, height, image_format)
+
+    thumbnails_cache.set(key, data)
+    return data
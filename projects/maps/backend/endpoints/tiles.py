@@ -1,32 +1,117 @@
-from typing import List, Optional
+import mimetypes
+from typing import Any, Dict, List, Optional, Tuple, Type, Union
 
+from maps.endpoints.cache import ReadyCache
+from maps.endpoints.catalog import catalog
 from maps.endpoints.config import (
     DATASETS,
     DEFAULT_PLATFORM,
     RUNS,
     DatasetType,
     get_base_path,
-    get_ready_file,
 )
+from maps.endpoints.delivery import send_packed_file
+from maps.endpoints.metrics import instrument
+from maps.endpoints.packfile import PackReader
 from restapi import decorators
 from restapi.exceptions import NotFound
-from restapi.models import fields, validate
+from restapi.models import Schema, fields, validate
 from restapi.rest.definition import EndpointResource, Response
 from restapi.utilities.logs import log
 
 
+def get_tiles_schema() -> Type[Schema]:
+    attributes: Dict[str, Union[fields.Field, type]] = {}
+    attributes["dataset"] = fields.Str(
+        required=True, validate=validate.OneOf(DATASETS.keys())
+    )
+    attributes["run"] = fields.Str(validate=validate.OneOf(RUNS))
+    return Schema.from_dict(attributes, name="TilesSchema")
+
+
+# TilesEndpoint responses, valid until a new run lands
+tiles_cache = ReadyCache("tiles")
+
+
+def get_tiles_info(dataset: str, run: Optional[str] = None) -> Dict[str, Any]:
+    """Metadata of a tiled dataset, along with the reftime of its last run"""
+    info: Optional[DatasetType] = DATASETS.get(dataset)
+    if not info:
+        raise NotFound(f"Dataset {dataset} is not available")
+
+    area: str = info.get("area", "")
+
+    if not area:
+        raise NotFound(f"Dataset area not available for {dataset}")
+
+    runs = [run] if run else RUNS
+    cache_key = (dataset, run)
+    cache_token = tuple(
+        catalog.version(
+            get_base_path("tiles", DEFAULT_PLATFORM, "PROD", r, dataset), area
+        )
+        for r in runs
+    )
+    if cached_response := tiles_cache.get(cache_key, cache_token):
+        return cached_response
+
+    ready_file: Optional[str] = None
+    # check for run param: if not provided get the "last" run available
+    if not run:
+        log.debug("No run param provided: look for the last run available")
+        ready_files: List[str] = []
+
+        for r in runs:
+            base_path = get_base_path("tiles", DEFAULT_PLATFORM, "PROD", r, dataset)
+            if x := catalog.get_reftime(base_path, area):
+                ready_files.append(x)
+        try:
+            ready_file = max(ready_files)
+        except ValueError:
+            log.warning("No Run is available: .READY file not found")
+    else:
+        base_path = get_base_path("tiles", DEFAULT_PLATFORM, "PROD", run, dataset)
+        ready_file = catalog.get_reftime(base_path, area)
+
+    if not ready_file:
+        raise NotFound("No .READY file found")
+
+    response = {
+        "dataset": dataset,
+        "area": info["area"],
+        "start_offset": info["start_offset"],
+        "end_offset": info["end_offset"],
+        "step": info["step"],
+        "boundaries": info["boundaries"],
+        "reftime": ready_file[:10],
+        "platform": None,
+    }
+    tiles_cache.set(cache_key, cache_token, response)
+    return response
+
+
+def locate_tiles(dataset: str, run: str) -> Tuple[PackReader, str]:
+    """Return the tiles archive of the last run of a dataset and its reftime"""
+    info: Optional[DatasetType] = DATASETS.get(dataset)
+    if not info or run not in RUNS:
+        raise NotFound(f"Dataset {dataset} is not available for run {run}")
+
+    area = info["area"]
+    base_path = get_base_path("tiles", DEFAULT_PLATFORM, "PROD", run, dataset)
+    reftime = catalog.get_reftime(base_path, area)
+    if not reftime:
+        raise NotFound("No .READY file found")
+
+    reader = catalog.get_pack_reader(base_path, area, reftime)
+    if not reader:
+        raise NotFound(f"No tile archive found for run {reftime}")
+    return reader, reftime
+
+
 class TilesEndpoint(EndpointResource):
     labels = ["tiles"]
 
-    @decorators.use_kwargs(
-        {
-            "dataset": fields.Str(
-                required=True, validate=validate.OneOf(DATASETS.keys())
-            ),
-            "run": fields.Str(validate=validate.OneOf(RUNS)),
-        },
-        location="query",
-    )
+    @decorators.use_kwargs(get_tiles_schema(), location="query")
     @decorators.endpoint(
         path="/tiles",
         summary="Get the last available tiled map set as a reference time.",
@@ -36,50 +121,33 @@ class TilesEndpoint(EndpointResource):
             404: "Tiled map does not exists",
         },
     )
+    @instrument
     def get(self, dataset: str, run: Optional[str] = None) -> Response:
 
-        info: Optional[DatasetType] = DATASETS.get(dataset)
-        if not info:
-            raise NotFound(f"Dataset {dataset} is not available")
-
-        area: str = info.get("area", "")
-
-        if not area:
-            raise NotFound(f"Dataset area not available for {dataset}")
-
-        ready_file: Optional[str] = None
-        # check for run param: if not provided get the "last" run available
-        if not run:
-            log.debug("No run param provided: look for the last run available")
-            ready_files: List[str] = []
-
-            for r in ["00", "12"]:
-                base_path = get_base_path("tiles", DEFAULT_PLATFORM, "PROD", r, dataset)
-                x = get_ready_file(base_path, area)
-                # add walrus here
-                if x:
-                    ready_files.append(x.name)
-            try:
-                ready_file = max(ready_files)
-            except ValueError:
-                log.warning("No Run is available: .READY file not found")
-        else:
-            base_path = get_base_path("tiles", DEFAULT_PLATFORM, "PROD", run, dataset)
-            tmp_ready_file = get_ready_file(base_path, area)
-            if tmp_ready_file:
-                ready_file = tmp_ready_file.name
-
-        if not ready_file:
-            raise NotFound("No .READY file found")
-
-        response = {
-            "dataset": dataset,
-            "area": info["area"],
-            "start_offset": info["start_offset"],
-            "end_offset": info["end_offset"],
-            "step": info["step"],
-            "boundaries": info["boundaries"],
-            "reftime": ready_file[:10],
-            "platform": None,
-        }
-        return self.response(response)
+        return self.response(get_tiles_info(dataset, run))
+
+
+class TileImage(EndpointResource):
+    labels = ["tiles"]
+
+    @decorators.endpoint(
+        path="/tiles/<dataset>/<run>/<path:layer>/<z>/<x>/<y>",
+        summary="Get a tile of the last available tiled map set.",
+        description="Tiles are served from the packed archive of the run",
+        responses={
+            200: "Tile successfully retrieved",
+            404: "Tile does not exists",
+        },
+    )
+    @instrument
+    def get(
+        self, dataset: str, run: str, layer: str, z: str, x: str, y: str
+    ) -> Response:
+
+        reader, reftime = locate_tiles(dataset, run)
+        key = f"{layer}/{z}/{x}/{y}"
+        mime = mimetypes.guess_type(y)[0] or "image/png"
+        response = send_packed_file(reader, key, reftime, mime)
+        if not response:
+            raise NotFound(f"Tile {key} not found")
+        return response
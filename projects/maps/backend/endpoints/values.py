@@ -0,0 +1,390 @@
+import io
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Type
+
+import numpy as np
+from maps.endpoints.cache import SegmentedLRUCache, build_file, prune_files
+from maps.endpoints.catalog import catalog, read_map
+from maps.endpoints.config import (
+    FRAMES_CACHE_SIZE,
+    Boundaries,
+    get_base_path,
+    get_cache_path,
+    get_image_name,
+    get_level,
+)
+from maps.endpoints.crops import get_boundaries
+from maps.endpoints.maps import (
+    add_reftime_attribute,
+    get_schema_attributes,
+    locate_legend,
+    locate_map_image,
+    not_ready_message,
+)
+from maps.endpoints.metrics import instrument
+from PIL import Image
+from restapi import decorators
+from restapi.exceptions import BadRequest, NotFound
+from restapi.models import Schema, fields, validate
+from restapi.rest.definition import EndpointResource, Response
+from restapi.utilities.logs import log
+
+# colours covering less than this share of the legend are text or borders
+MIN_LEGEND_SHARE = 0.002
+# max squared RGB distance of a map pixel from its legend colour (blending
+# with coastlines and borders)
+MAX_COLOR_DISTANCE = 3 * 24**2
+# no class: transparent, background or overlay pixel. The classes are stored
+# one byte per pixel, so a legend can have up to 255 of them
+NO_CLASS = 255
+# points of a single time series request
+MAX_SERIES_POINTS = 1000
+
+
+def to_pixels(
+    lat: np.ndarray, lon: np.ndarray, boundaries: Boundaries, shape: Tuple[int, ...]
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Map coordinates into (row, column) indexes of a frame spanning the
+    boundaries on a regular lat/lon grid, along with the mask of the points
+    falling inside it
+    """
+    (south, west), (north, east) = boundaries["SW"], boundaries["NE"]
+    height, width = shape[:2]
+    rows = np.floor((north - lat) / (north - south) * height).astype(np.int64)
+    cols = np.floor((lon - west) / (east - west) * width).astype(np.int64)
+    inside = (rows >= 0) & (rows < height) & (cols >= 0) & (cols < width)
+    return np.clip(rows, 0, height - 1), np.clip(cols, 0, width - 1), inside
+
+
+def decode_image(data: bytes) -> np.ndarray:
+    """Decode an image into a (height, width, 4) RGBA array"""
+    with Image.open(io.BytesIO(data)) as img:
+        return np.asarray(img.convert("RGBA"))
+
+
+def decode_legend(data: bytes) -> np.ndarray:
+    """
+    Extract the colours of a legend bar, ordered from the lowest class:
+    left to right for horizontal legends, bottom to top for vertical ones
+    """
+    pixels = decode_image(data)
+    height, width = pixels.shape[:2]
+    rgb = pixels[..., :3].astype(np.int32)
+    # the labels and the frame are grey, the background transparent or white
+    saturated = (rgb.max(axis=-1) - rgb.min(axis=-1)) > 16
+    mask = (pixels[..., 3] > 0) & saturated
+    rows, cols = np.nonzero(mask)
+    packed = (rgb[rows, cols] * np.array([1 << 16, 1 << 8, 1])).sum(axis=-1)
+    colors, inverse, counts = np.unique(packed, return_inverse=True, return_counts=True)
+    keep = counts >= max(1, MIN_LEGEND_SHARE * height * width)
+    position = cols if width >= height else height - rows
+    centers = np.bincount(inverse, weights=position) / counts
+    order = [i for i in np.argsort(centers) if keep[i]]
+    return np.stack([(colors[order] >> shift) & 0xFF for shift in (16, 8, 0)], -1)
+
+
+def classify(pixels: np.ndarray, colors: np.ndarray) -> np.ndarray:
+    """The legend class of each RGBA pixel, NO_CLASS if none is close enough"""
+    if not len(colors):
+        return np.full(pixels.shape[:-1], NO_CLASS, dtype=np.uint8)
+    rgb = pixels[..., :3].astype(np.int32)
+    distances = ((rgb[..., None, :] - colors.astype(np.int32)) ** 2).sum(axis=-1)
+    classes = distances.argmin(axis=-1)
+    valid = (pixels[..., 3] > 0) & (distances.min(axis=-1) <= MAX_COLOR_DISTANCE)
+    return np.where(valid, classes, NO_CLASS).astype(np.uint8)
+
+
+def classify_frame(frame: np.ndarray, colors: np.ndarray) -> np.ndarray:
+    """The legend class of each pixel of a frame, as a (height, width) array"""
+    # maps have few distinct colours: classify them once
+    packed = frame.view(np.uint32).reshape(frame.shape[:2])
+    values, inverse = np.unique(packed, return_inverse=True)
+    palette = values.view(np.uint8).reshape(-1, 4)
+    classes = classify(palette, colors)
+    return classes[inverse].reshape(frame.shape[:2])
+
+
+@lru_cache(maxsize=256)
+def get_legend_colors(
+    base_path: Path, area: str, legend_key: str, reftime: str
+) -> np.ndarray:
+    """Decode the legend of a run once: the (n, 3) RGB colours of its classes"""
+    colors = decode_legend(read_map(base_path, area, legend_key, reftime))
+    if len(colors) > NO_CLASS:
+        log.warning("Too many classes in {}, only {} kept", legend_key, NO_CLASS)
+        colors = colors[:NO_CLASS]
+    return colors
+
+
+# decoded frames, by (base path, area, key, reftime)
+frames_cache = SegmentedLRUCache("frames", FRAMES_CACHE_SIZE * 1024 * 1024)
+
+
+def get_frame(base_path: Path, area: str, key: str, reftime: str) -> np.ndarray:
+    cache_key = (base_path, area, key, reftime)
+    frame = frames_cache.get(cache_key)
+    if frame is None:
+        frame = decode_image(read_map(base_path, area, key, reftime))
+        frames_cache.set(cache_key, frame, frame.nbytes)
+    return frame
+
+
+def get_point_class(
+    map_offset: str,
+    lat: float,
+    lon: float,
+    run: str,
+    res: str,
+    field: str,
+    area: str,
+    platform: str,
+    level_pe: Optional[str] = None,
+    level_pr: Optional[str] = None,
+    env: str = "PROD",
+    reftime: Optional[str] = None,
+) -> Dict[str, Any]:
+    boundaries = get_boundaries(field, res, area)
+    if not boundaries:
+        raise NotFound(f"Maps of {res} are not georeferenced for area {area}")
+    base_path, reftime, image_name, label = locate_map_image(
+        map_offset, run, res, field, area, platform, level_pe, level_pr, env, reftime
+    )
+    _, _, legend_key = locate_legend(run, res, field, area, platform, env, reftime)
+    colors = get_legend_colors(base_path, area, legend_key, reftime)
+
+    frame = get_frame(base_path, area, f"{field}/{image_name}", reftime)
+    rows, cols, inside = to_pixels(
+        np.array([lat]), np.array([lon]), boundaries, frame.shape
+    )
+    if not inside[0]:
+        raise BadRequest(f"Point ({lat}, {lon}) is outside the {area} map")
+    pixel = frame[rows[0], cols[0]]
+    index = int(classify(pixel, colors))
+    return {
+        "reftime": reftime,
+        "offset": label,
+        "lat": lat,
+        "lon": lon,
+        "color": "#{:02x}{:02x}{:02x}".format(*pixel[:3]),
+        "class": None if index == NO_CLASS else index,
+    }
+
+
+def build_series_stack(
+    dest: Path,
+    base_path: Path,
+    area: str,
+    keys: List[str],
+    reftime: str,
+    colors: np.ndarray,
+) -> None:
+    """Decode all the frames of a run into a (offsets, height, width) array"""
+    first = decode_image(read_map(base_path, area, keys[0], reftime))
+    height, width = first.shape[:2]
+    stack = np.lib.format.open_memmap(
+        dest, mode="w+", dtype=np.uint8, shape=(len(keys), height, width)
+    )
+    for i, key in enumerate(keys):
+        frame = decode_image(read_map(base_path, area, key, reftime)) if i else first
+        if frame.shape[:2] != (height, width):
+            log.warning("{} does not match the size of the run frames", key)
+            stack[i] = NO_CLASS
+            continue
+        stack[i] = classify_frame(frame, colors)
+    stack.flush()
+    del stack
+
+
+@lru_cache(maxsize=64)
+def open_series_stack(path: Path) -> np.ndarray:
+    # read-only mapping: the pages are shared by the workers
+    return np.load(path, mmap_mode="r")
+
+
+def get_point_series(
+    lat: List[float],
+    lon: List[float],
+    run: str,
+    res: str,
+    field: str,
+    area: str,
+    platform: str,
+    level_pe: Optional[str] = None,
+    level_pr: Optional[str] = None,
+    env: str = "PROD",
+    reftime: Optional[str] = None,
+) -> Dict[str, Any]:
+    """The legend class of each offset of a run at the given points"""
+    if len(lat) != len(lon):
+        raise BadRequest("lat and lon must have the same number of values")
+    if len(lat) > MAX_SERIES_POINTS:
+        raise BadRequest(f"At most {MAX_SERIES_POINTS} points can be requested")
+    boundaries = get_boundaries(field, res, area)
+    if not boundaries:
+        raise NotFound(f"Maps of {res} are not georeferenced for area {area}")
+
+    level = get_level(field, level_pe, level_pr)
+    base_path = get_base_path(field, platform, env, run, res)
+    requested = reftime
+    reftime = catalog.get_reftime(base_path, area, requested)
+    if not reftime:
+        raise NotFound(not_ready_message(requested))
+    offsets = catalog.get_offsets(base_path, area, field, level, reftime)
+    if not offsets:
+        raise NotFound(f"No maps found for field <{field}>")
+    _, _, legend_key = locate_legend(run, res, field, area, platform, env, reftime)
+    colors = get_legend_colors(base_path, area, legend_key, reftime)
+
+    cache_path = get_cache_path("series", base_path, area, field)
+    product = f"{field}_{level}" if level else field
+    # the offsets of a run only grow while it is being written
+    stack_file = cache_path.joinpath(f"{product}.{reftime}.{len(offsets)}.npy")
+    keys = [
+        f"{field}/{get_image_name(field, reftime, offset, level)}" for offset in offsets
+    ]
+
+    def build(dest: Path) -> None:
+        prune_files(cache_path, reftime)
+        build_series_stack(dest, base_path, area, keys, reftime, colors)
+
+    stack = open_series_stack(build_file(stack_file, build))
+    rows, cols, inside = to_pixels(
+        np.array(lat), np.array(lon), boundaries, stack.shape[1:]
+    )
+    if not inside.all():
+        raise BadRequest(f"Some points are outside the {area} map")
+
+    # a single gather across the time axis: (offsets, points)
+    classes = stack[:, rows, cols].T.tolist()
+    points = [
+        {
+            "lat": lat[i],
+            "lon": lon[i],
+            "classes": [None if c == NO_CLASS else c for c in point_classes],
+        }
+        for i, point_classes in enumerate(classes)
+    ]
+    return {"reftime": reftime, "offsets": offsets, "points": points}
+
+
+def get_class_schema() -> Type[Schema]:
+    attributes = get_schema_attributes(True)
+    add_reftime_attribute(attributes)
+    attributes["offset"] = fields.Str(
+        validate=validate.Regexp(r"^\d{4}$"), required=True
+    )
+    attributes["lat"] = fields.Float(
+        validate=validate.Range(min=-90, max=90), required=True
+    )
+    attributes["lon"] = fields.Float(
+        validate=validate.Range(min=-180, max=180), required=True
+    )
+    return Schema.from_dict(attributes, name="MapClassSchema")
+
+
+class MapClass(EndpointResource):
+    labels = ["maps"]
+
+    @decorators.use_kwargs(get_class_schema(), location="query")
+    @decorators.endpoint(
+        path="/maps/class",
+        summary="Get the legend class of a forecast map at a point.",
+        responses={
+            200: "Class successfully retrieved",
+            400: "Invalid parameters",
+            404: "Map image does not exists",
+        },
+    )
+    @instrument
+    def get(
+        self,
+        offset: str,
+        lat: float,
+        lon: float,
+        run: str,
+        res: str,
+        field: str,
+        area: str,
+        platform: str,
+        level_pe: Optional[str] = None,
+        level_pr: Optional[str] = None,
+        env: str = "PROD",
+        reftime: Optional[str] = None,
+    ) -> Response:
+        """Get the legend class of a forecast map at the given coordinates."""
+        return self.response(
+            get_point_class(
+                offset,
+                lat,
+                lon,
+                run,
+                res,
+                field,
+                area,
+                platform,
+                level_pe,
+                level_pr,
+                env,
+                reftime,
+            )
+        )
+
+
+def get_series_schema() -> Type[Schema]:
+    attributes = get_schema_attributes(True)
+    add_reftime_attribute(attributes)
+    attributes["lat"] = fields.List(
+        fields.Float(validate=validate.Range(min=-90, max=90)), required=True
+    )
+    attributes["lon"] = fields.List(
+        fields.Float(validate=validate.Range(min=-180, max=180)), required=True
+    )
+    return Schema.from_dict(attributes, name="MapSeriesSchema")
+
+
+class MapSeries(EndpointResource):
+    labels = ["maps"]
+
+    @decorators.use_kwargs(get_series_schema(), location="query")
+    @decorators.endpoint(
+        path="/maps/series",
+        summary="Get the legend classes of all the maps of a run at some points.",
+        responses={
+            200: "Time series successfully retrieved",
+            400: "Invalid parameters",
+            404: "Map set does not exists",
+        },
+    )
+    @instrument
+    def get(
+        self,
+        lat: List[float],
+        lon: List[float],
+        run: str,
+        res: str,
+        field: str,
+        area: str,
+        platform: str,
+        level_pe: Optional[str] = None,
+        level_pr: Optional[str] = None,
+        env: str = "PROD",
+        reftime: Optional[str] = None,
+    ) -> Response:
+        """Get the legend class of every offset of a run at the given points."""
+        return self.response(
+            get_point_series(
+                lat,
+                lon,
+                run,
+                res,
+                field,
+                area,
+                platform,
+                level_pe,
+                level_pr,
+                env,
+                reftime,
+            )
+        )
@@ -0,0 +1,79 @@
+import io
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+from flask import request
+from maps.endpoints.cache import DiskCache
+from maps.endpoints.catalog import MapReader, read_map
+from maps.endpoints.config import (
+    CACHE_PATH,
+    IMAGE_VARIANTS,
+    VARIANTS_CACHE_SIZE,
+    get_cache_path,
+)
+from PIL import Image
+from restapi.utilities.logs import log
+from werkzeug.datastructures import MIMEAccept
+
+# format: (PIL format, mime type, encoder options)
+VARIANT_FORMATS: Dict[str, Tuple[str, str, Dict[str, Any]]] = {
+    "avif": ("AVIF", "image/avif", {"quality": 60}),
+    "webp": ("WEBP", "image/webp", {"quality": 80, "method": 4}),
+}
+
+Image.init()
+# AVIF is only available with recent Pillow versions (or its plugin)
+SUPPORTED_VARIANTS = [
+    v
+    for v in IMAGE_VARIANTS
+    if v in VARIANT_FORMATS and VARIANT_FORMATS[v][0] in Image.SAVE
+]
+
+variants_cache = DiskCache(
+    "variants", CACHE_PATH.joinpath("variants"), VARIANTS_CACHE_SIZE * 1024 * 1024
+)
+
+
+def negotiate_variant() -> Optional[str]:
+    """Return the preferred variant explicitly accepted by the client, if any"""
+    return pick_variant(request.accept_mimetypes)
+
+
+def pick_variant(accept_mimetypes: MIMEAccept) -> Optional[str]:
+    # wildcards are not enough: every browser sends */*
+    accepted = {mime for mime, quality in accept_mimetypes if quality > 0}
+    for variant in SUPPORTED_VARIANTS:
+        if VARIANT_FORMATS[variant][1] in accepted:
+            return variant
+    return None
+
+
+def encode_variant(data: bytes, variant: str, dest: Path) -> None:
+    image_format, _, options = VARIANT_FORMATS[variant]
+    with Image.open(io.BytesIO(data)) as img:
+        img.save(dest, format=image_format, **options)
+
+
+def get_variant(
+    base_path: Path,
+    area: str,
+    field: str,
+    image_name: str,
+    reftime: str,
+    variant: str,
+    read: MapReader = read_map,
+) -> Path:
+    """
+    Return the variant of a map image, encoding it the first time.
+    Concurrent requests for the same missing variant wait for the first one.
+    """
+    variant_path = get_cache_path("variants", base_path, area, field).joinpath(
+        f"{Path(image_name).stem}.{variant}"
+    )
+
+    def build(dest: Path) -> None:
+        log.debug("Encoding {} as {}", image_name, variant)
+        data = read(base_path, area, f"{field}/{image_name}", reftime)
+        encode_variant(data, variant, dest)
+
+    return variants_cache.get_or_build(variant_path, build)
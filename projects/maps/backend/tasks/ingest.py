@@ -0,0 +1,145 @@
+import zlib
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import click
+from maps.endpoints.catalog import parse_map_name
+from maps.endpoints.config import (
+    DATASETS,
+    get_dataset_fields,
+    get_field_offsets,
+    get_image_name,
+    get_levels,
+)
+from maps.endpoints.manifest import MANIFEST_FORMAT, Manifest, write_manifest
+
+READ_BUFFER = 1024 * 1024
+
+
+def get_dataset(folder: Path) -> str:
+    """The dataset of a run folder: Magics-00-lm5.web -> lm5"""
+    return folder.name.removesuffix(".web").split("-", 2)[-1]
+
+
+def get_expected_offsets(dataset: str, field: str) -> Optional[List[str]]:
+    """The offsets a complete run is made of, None if not known"""
+    info = DATASETS.get(dataset)
+    if not info:
+        return None
+    return get_field_offsets(
+        field, info["start_offset"], info["end_offset"], info["step"]
+    )
+
+
+def get_checksum(path: Path) -> str:
+    crc = 0
+    with open(path, "rb") as f:
+        while chunk := f.read(READ_BUFFER):
+            crc = zlib.crc32(chunk, crc)
+    return f"{crc:08x}"
+
+
+def find_reftime(area_path: Path) -> Optional[str]:
+    """The most recent run found in the map names of an area"""
+    reftimes = set()
+    for field_path in area_path.iterdir():
+        if field_path.is_dir():
+            for map_path in field_path.iterdir():
+                parsed = parse_map_name(field_path.name, map_path.name)
+                if parsed:
+                    reftimes.add(parsed[0])
+    return max(reftimes, default=None)
+
+
+def check_area(
+    area_path: Path, reftime: str, dataset: str, fields: List[str]
+) -> Manifest:
+    """
+    List the maps of a run in an area folder and check them against the
+    offsets and levels expected for the dataset
+    """
+    files: Dict[str, Tuple[int, str]] = {}
+    missing: List[str] = []
+    present = {p.name for p in area_path.iterdir() if p.is_dir()}
+    # the fields never written are missing too
+    for field in fields or sorted(present.union(get_dataset_fields(dataset))):
+        field_path = area_path.joinpath(field)
+        found: Dict[str, Path] = {}
+        if field_path.is_dir():
+            for map_path in field_path.iterdir():
+                parsed = parse_map_name(field, map_path.name)
+                if parsed and parsed[0] == reftime and map_path.is_file():
+                    found[map_path.name] = map_path
+        for name, map_path in sorted(found.items()):
+            size = map_path.stat().st_size
+            # still being written or failed
+            if not size:
+                missing.append(f"{field}/{name}")
+                continue
+            files[f"{field}/{name}"] = (size, get_checksum(map_path))
+
+        expected = get_expected_offsets(dataset, field)
+        if expected is None:
+            continue
+        for level in get_levels(field):
+            for offset in expected:
+                name = get_image_name(field, reftime, offset, level)
+                if name not in found:
+                    missing.append(f"{field}/{name}")
+
+    return {
+        "format": MANIFEST_FORMAT,
+        "reftime": reftime,
+        "complete": not missing,
+        "files": files,
+        "missing": sorted(missing),
+    }
+
+
+@click.command()
+@click.argument("folder", type=click.Path(exists=True, file_okay=False, path_type=Path))
+@click.option("--reftime", help="Run to check (default the last one found)")
+@click.option(
+    "--field",
+    "fields",
+    multiple=True,
+    help="Field required in each area (default the ones of the dataset), repeatable",
+)
+@click.option("--ready", is_flag=True, help="Mark the complete runs as ready")
+@click.option("--force", is_flag=True, help="Mark the incomplete runs as ready too")
+def ingest(
+    folder: Path, reftime: Optional[str], fields: Tuple[str], ready: bool, force: bool
+) -> None:
+    """
+    Check the run just published in each area of a run folder (e.g.
+    Magics-00-lm5.web) against the offsets, steps and levels of its
+    dataset, and write the run manifest next to its .READY file
+    """
+    dataset = get_dataset(folder)
+    if dataset not in DATASETS:
+        click.echo(f"{dataset}: offsets not known, the maps are only listed")
+    incomplete = 0
+    for area_path in sorted(
+        p for p in folder.iterdir() if p.is_dir() and p.name != "legends"
+    ):
+        area_reftime = reftime or find_reftime(area_path)
+        if not area_reftime:
+            click.echo(f"{area_path}: no maps found, skipped")
+            continue
+        manifest = check_area(area_path, area_reftime, dataset, list(fields))
+        # the manifest is in place before the run is visible
+        dest = write_manifest(area_path, manifest)
+        click.echo(f"{area_path}: {len(manifest['files'])} maps in {dest.name}")
+        if not manifest["complete"]:
+            incomplete += 1
+            click.echo(f"{area_path}: {len(manifest['missing'])} maps missing")
+            for key in manifest["missing"]:
+                click.echo(f"  {key}")
+        if ready and (manifest["complete"] or force):
+            area_path.joinpath(f"{area_reftime}.READY").touch()
+    if incomplete:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    ingest()
@@ -0,0 +1,98 @@
+import os
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+import click
+from maps.endpoints.config import is_ready_file
+from maps.endpoints.manifest import MANIFEST_SUFFIX
+from maps.endpoints.packfile import PACK_SUFFIX, write_pack
+
+
+def get_ready_reftime(area_path: Path) -> str:
+    ready_files = sorted(f.name for f in area_path.iterdir() if is_ready_file(f.name))
+    return ready_files[-1][:10] if ready_files else ""
+
+
+def get_run_files(area_path: Path, reftime: str) -> Iterator[Tuple[Path, str]]:
+    """Yield the (loose) files of a run along with their path in the area"""
+    for dirpath, dirnames, filenames in os.walk(area_path):
+        # keep nearby tiles close in the archive too
+        dirnames.sort()
+        relative_dir = Path(dirpath).relative_to(area_path)
+        # tiles are grouped in <reftime>.<offset> folders
+        in_run_dir = any(p.startswith(f"{reftime}.") for p in relative_dir.parts)
+        for name in sorted(filenames):
+            # temporary files and markers are hidden
+            if name.startswith("."):
+                continue
+            if in_run_dir or f".{reftime}." in name:
+                yield Path(dirpath, name), relative_dir.joinpath(name).as_posix()
+
+
+def get_packable_files(area_path: Path, reftime: str) -> List[Tuple[str, Path]]:
+    """
+    The files of a run, by their path in the area: the files of the other
+    runs retained in the same folder are left as they are
+    """
+    return [
+        (key, path)
+        for path, key in get_run_files(area_path, reftime)
+        if not is_ready_file(path.name)
+        and not path.name.endswith((PACK_SUFFIX, MANIFEST_SUFFIX))
+    ]
+
+
+def get_legends(folder: Path) -> List[Tuple[str, Path]]:
+    legends_path = folder.joinpath("legends")
+    if not legends_path.is_dir():
+        return []
+    return [
+        (f"legends/{f.name}", f) for f in sorted(legends_path.iterdir()) if f.is_file()
+    ]
+
+
+def pack_area(
+    area_path: Path,
+    reftime: str,
+    remove: bool = False,
+    legends: Optional[List[Tuple[str, Path]]] = None,
+) -> Path:
+    """Pack the files of a run of an area folder into <reftime>.pack"""
+    entries = get_packable_files(area_path, reftime)
+    dest = area_path.joinpath(f"{reftime}{PACK_SUFFIX}")
+    tmp_dest = area_path.joinpath(f".{reftime}{PACK_SUFFIX}.tmp")
+    write_pack(tmp_dest, entries + (legends or []))
+    os.replace(tmp_dest, dest)
+
+    if remove:
+        for _, path in entries:
+            path.unlink()
+        for dirpath, _, _ in sorted(os.walk(area_path), reverse=True):
+            if Path(dirpath) != area_path and not os.listdir(dirpath):
+                os.rmdir(dirpath)
+    return dest
+
+
+@click.command()
+@click.argument("folder", type=click.Path(exists=True, file_okay=False, path_type=Path))
+@click.option("--remove", is_flag=True, help="Remove the files once packed")
+def pack(folder: Path, remove: bool) -> None:
+    """
+    Pack each area of a run folder (e.g. Tiles-00-lm2.2.web or
+    Magics-00-lm5.web) into a single archive, named after the reftime of
+    its .READY file. The legends of the run are copied into each archive.
+    """
+    legends = get_legends(folder)
+    for area_path in sorted(
+        p for p in folder.iterdir() if p.is_dir() and p.name != "legends"
+    ):
+        reftime = get_ready_reftime(area_path)
+        if not reftime:
+            click.echo(f"{area_path}: no .READY file found, skipped")
+            continue
+        dest = pack_area(area_path, reftime, remove=remove, legends=legends)
+        click.echo(f"{area_path}: packed into {dest.name}")
+
+
+if __name__ == "__main__":
+    pack()
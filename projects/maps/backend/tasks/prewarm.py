@@ -0,0 +1,261 @@
+import fcntl
+import json
+import os
+import queue
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import click
+from maps.endpoints.catalog import parse_map_name, read_map_file, scan_area
+from maps.endpoints.config import CACHE_PATH, PREWARM_VARIANTS
+from maps.endpoints.packfile import PACK_SUFFIX, open_pack
+from maps.endpoints.variants import SUPPORTED_VARIANTS, get_variant
+from maps.tasks.pack import get_run_files
+from restapi.config import DATA_PATH
+from restapi.utilities.logs import log
+
+READ_BUFFER = 1024 * 1024
+# progress is logged every this number of files
+LOG_EVERY = 500
+# last runs whose progress is kept
+MAX_PROGRESS = 64
+
+
+@dataclass
+class RunProgress:
+    run: str
+    files: int = 0
+    done: int = 0
+    bytes_read: int = 0
+    variants: int = 0
+    errors: int = 0
+    started: float = field(default_factory=time.time)
+    finished: Optional[float] = None
+
+    def __str__(self) -> str:
+        elapsed = (self.finished or time.time()) - self.started
+        return (
+            f"{self.run}: {self.done}/{self.files} files, "
+            f"{self.bytes_read // (1024 * 1024)} MB read, "
+            f"{self.variants} variants, {self.errors} errors in {elapsed:.1f}s"
+        )
+
+    def save(self, path: Path) -> None:
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(asdict(self), f)
+        os.replace(tmp_path, path)
+
+
+def get_progress_path(area_path: Path, reftime: str) -> Path:
+    """The progress of a run, shared by the workers"""
+    folder = CACHE_PATH.joinpath("prewarm", area_path.relative_to(DATA_PATH))
+    return folder.joinpath(f"progress.{reftime}.json")
+
+
+def prune_progress(folder: Path, reftime: str) -> None:
+    """Remove the progress of the runs older than the given one"""
+    for path in folder.iterdir():
+        # progress.<reftime>.json and its .progress.<reftime>.json.lock
+        if path.name.lstrip(".").split(".")[1] < reftime:
+            path.unlink(missing_ok=True)
+
+
+def read_progress(path: Path) -> Optional[RunProgress]:
+    try:
+        with open(path) as f:
+            return RunProgress(**json.load(f))
+    except (OSError, ValueError, TypeError):
+        return None
+
+
+def read_file(path: Path) -> int:
+    """Read a whole file to bring it into the page cache"""
+    size = 0
+    with open(path, "rb", buffering=0) as f:
+        while chunk := f.read(READ_BUFFER):
+            size += len(chunk)
+    return size
+
+
+def get_offset_label(key: str) -> Optional[str]:
+    """The offset of a map image key, 0006 or 0006_10, None if not a map"""
+    field_name, _, name = key.partition("/")
+    parsed = parse_map_name(field_name, name)
+    if not parsed:
+        return None
+    _, offset, level = parsed
+    return f"{offset}_{level}" if level else offset
+
+
+def prewarm_run(
+    area_path: Path,
+    reftime: str,
+    variants: List[str],
+    progress: Optional[RunProgress] = None,
+    progress_path: Optional[Path] = None,
+) -> RunProgress:
+    """
+    Warm up a new run: read its files into the page cache, shared by all
+    the workers, and encode the variants of its map images.
+    The progress is also written to progress_path, if given.
+    """
+    progress = progress or RunProgress(f"{area_path}@{reftime}")
+    base_path, area = area_path.parent, area_path.name
+    is_maps = not base_path.name.startswith("Tiles-")
+    pack_path = area_path.joinpath(f"{reftime}{PACK_SUFFIX}")
+    if pack_path.is_file():
+        # the mapped archive only needs to be in the page cache
+        entries: List[Tuple[Path, str]] = [(pack_path, "")]
+    else:
+        entries = list(get_run_files(area_path, reftime))
+        if is_maps:
+            legends_path = base_path.joinpath("legends")
+            if legends_path.is_dir():
+                entries.extend((p, "legends") for p in sorted(legends_path.iterdir()))
+    progress.files = len(entries)
+    log.info("Prewarming {} ({} files)", progress.run, progress.files)
+
+    for path, key in entries:
+        try:
+            progress.bytes_read += read_file(path)
+        except OSError as exc:
+            log.warning("Cannot prewarm {}: {}", path, exc)
+            progress.errors += 1
+        progress.done += 1
+        if progress.done % LOG_EVERY == 0:
+            log.info("Prewarming {}", progress)
+            if progress_path:
+                progress.save(progress_path)
+
+    if is_maps and variants:
+        images: Dict[Tuple[str, str], None] = {}
+        reader = open_pack(pack_path) if pack_path.is_file() else None
+        keys = reader.keys() if reader else (key for _, key in entries)
+        for key in keys:
+            field_name, _, name = key.partition("/")
+            if field_name != "legends" and get_offset_label(key):
+                images[(field_name, name)] = None
+        for field_name, name in images:
+            for variant in variants:
+                try:
+                    # the tasks do not start the catalog
+                    get_variant(
+                        base_path,
+                        area,
+                        field_name,
+                        name,
+                        reftime,
+                        variant,
+                        read=read_map_file,
+                    )
+                    progress.variants += 1
+                except (OSError, ValueError) as exc:
+                    log.warning("Cannot encode {} as {}: {}", name, variant, exc)
+                    progress.errors += 1
+
+    progress.finished = time.time()
+    if progress_path:
+        progress.save(progress_path)
+    log.info("Prewarmed {}", progress)
+    return progress
+
+
+class Prewarmer:
+    """
+    Warm up the new runs notified by the catalog, one at a time.
+    All the workers are notified: each run is warmed up by the first one
+    taking its lock, the others skip it once done.
+    """
+
+    def __init__(self, variants: List[str]) -> None:
+        self.variants = variants
+        self.progress: Dict[str, RunProgress] = {}
+        self._queue: "queue.Queue[Tuple[Path, str]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def submit(self, area_path: Path, reftime: str) -> None:
+        run = f"{area_path}@{reftime}"
+        self.progress[run] = RunProgress(run)
+        while len(self.progress) > MAX_PROGRESS:
+            self.progress.pop(next(iter(self.progress)))
+        self._queue.put((area_path, reftime))
+        self.start()
+
+    def start(self) -> None:
+        if self._thread:
+            return
+        with self._lock:
+            if self._thread:
+                return
+            self._thread = threading.Thread(
+                target=self._run, name="maps-prewarm", daemon=True
+            )
+            self._thread.start()
+
+    def warm(self, area_path: Path, reftime: str) -> Optional[RunProgress]:
+        """Warm up a run, unless another worker is doing or has done it"""
+        run = f"{area_path}@{reftime}"
+        progress_path = get_progress_path(area_path, reftime)
+        progress_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(progress_path.with_name(f".{progress_path.name}.lock"), "w") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                log.debug("{} being prewarmed by another worker", run)
+                return None
+            try:
+                done = read_progress(progress_path)
+                if done and done.finished:
+                    log.debug("{} already prewarmed", run)
+                    return done
+                progress = prewarm_run(
+                    area_path,
+                    reftime,
+                    self.variants,
+                    self.progress.get(run),
+                    progress_path,
+                )
+                prune_progress(progress_path.parent, reftime)
+                return progress
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _run(self) -> None:
+        while True:
+            area_path, reftime = self._queue.get()
+            try:
+                self.warm(area_path, reftime)
+            except Exception as exc:  # pragma: no cover
+                log.error("Prewarming of {} failed: {}", area_path, exc)
+
+
+# encoding the variants is CPU bound: left to the prewarm command by default
+prewarmer = Prewarmer(SUPPORTED_VARIANTS if PREWARM_VARIANTS else [])
+
+
+@click.command()
+@click.argument("folder", type=click.Path(exists=True, file_okay=False, path_type=Path))
+@click.option("--reftime", help="Run to warm up (default the last one)")
+@click.option("--no-variants", is_flag=True, help="Do not encode the variants")
+def prewarm(folder: Path, reftime: Optional[str], no_variants: bool) -> None:
+    """
+    Warm up the last run of each area of a run folder (e.g. Magics-00-lm5.web)
+    """
+    for area_path in sorted(
+        p for p in folder.iterdir() if p.is_dir() and p.name != "legends"
+    ):
+        area_reftime = reftime or scan_area(area_path).reftime
+        if not area_reftime:
+            click.echo(f"{area_path}: no .READY file found, skipped")
+            continue
+        variants = [] if no_variants else SUPPORTED_VARIANTS
+        click.echo(str(prewarm_run(area_path, area_reftime, variants)))
+
+
+if __name__ == "__main__":
+    prewarm()
@@ -0,0 +1,253 @@
+import io
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import click
+import numpy as np
+from maps.endpoints.catalog import LEVEL_FIELDS, parse_map_name, read_map_file
+from maps.endpoints.config import DATASETS, Boundaries
+from maps.tasks.ingest import get_dataset
+from maps.tasks.pack import get_ready_reftime
+from PIL import Image
+
+TILE_SIZE = 256
+MIN_ZOOM = 3
+MAX_ZOOM = 7
+# written when all the tiles of a frame at a zoom level are done, so that
+# an interrupted run is resumed from the missing ones, and removed at the end
+DONE_MARKER = ".z{zoom}.done"
+
+
+class TileJob(NamedTuple):
+    base_path: Path
+    area: str
+    key: str
+    reftime: str
+    # <reftime>.<offset>/<field>[/<level>] folder of the tiles
+    layer: str
+    zoom: int
+
+
+def get_tiles_path(folder: Path, dataset: str) -> Path:
+    """The tiles folder of a maps folder: Magics-00-lm5.web -> Tiles-00-lm5.web"""
+    run = folder.name.split("-")[1]
+    return folder.parent.joinpath(f"Tiles-{run}-{dataset}.web")
+
+
+def lon_to_tile(lon: float, zoom: int) -> float:
+    return (lon + 180) / 360 * 2**zoom
+
+
+def lat_to_tile(lat: float, zoom: int) -> float:
+    phi = math.radians(lat)
+    return (1 - math.asinh(math.tan(phi)) / math.pi) / 2 * 2**zoom
+
+
+def get_tile_range(boundaries: Boundaries, zoom: int) -> Tuple[range, range]:
+    """The x and y of the tiles covering the boundaries at a zoom level"""
+    (south, west), (north, east) = boundaries["SW"], boundaries["NE"]
+    last = 2**zoom - 1
+    x_start = max(0, math.floor(lon_to_tile(west, zoom)))
+    x_end = min(last, math.ceil(lon_to_tile(east, zoom)) - 1)
+    y_start = max(0, math.floor(lat_to_tile(north, zoom)))
+    y_end = min(last, math.ceil(lat_to_tile(south, zoom)) - 1)
+    return range(x_start, x_end + 1), range(y_start, y_end + 1)
+
+
+def get_pixel_lons(x: int, zoom: int) -> np.ndarray:
+    """Longitude of the centre of each column of a tile"""
+    pixels = x + (np.arange(TILE_SIZE) + 0.5) / TILE_SIZE
+    return pixels / 2**zoom * 360 - 180
+
+
+def get_pixel_lats(y: int, zoom: int) -> np.ndarray:
+    """Latitude of the centre of each row of a tile"""
+    pixels = y + (np.arange(TILE_SIZE) + 0.5) / TILE_SIZE
+    return np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * pixels / 2**zoom))))
+
+
+def render_tile(
+    frame: np.ndarray, boundaries: Boundaries, x: int, y: int, zoom: int
+) -> Optional[np.ndarray]:
+    """
+    Resample a frame on a regular lat/lon grid into a web mercator tile.
+    Nearest neighbour keeps the exact colors of the legend classes.
+    None if the tile is fully transparent.
+    """
+    (south, west), (north, east) = boundaries["SW"], boundaries["NE"]
+    height, width = frame.shape[:2]
+    cols = np.floor((get_pixel_lons(x, zoom) - west) / (east - west) * width)
+    rows = np.floor((north - get_pixel_lats(y, zoom)) / (north - south) * height)
+    cols_inside = (cols >= 0) & (cols < width)
+    rows_inside = (rows >= 0) & (rows < height)
+    if not cols_inside.any() or not rows_inside.any():
+        return None
+    tile = frame[
+        np.clip(rows, 0, height - 1).astype(np.intp)[:, None],
+        np.clip(cols, 0, width - 1).astype(np.intp)[None, :],
+    ]
+    tile[~(rows_inside[:, None] & cols_inside[None, :])] = 0
+    if not tile[..., 3].any():
+        return None
+    return tile
+
+
+def write_tile(tile: np.ndarray, dest: Path) -> None:
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    tmp_dest = dest.with_name(f".{dest.name}.tmp")
+    Image.fromarray(tile, "RGBA").save(tmp_dest, format="PNG", optimize=True)
+    # never seen half written
+    os.replace(tmp_dest, dest)
+
+
+def cut_frame(job: TileJob, dest_area: Path, boundaries: Boundaries) -> int:
+    """Cut a frame into the tiles of a zoom level, return how many were written"""
+    # each pool process would start its own live catalog
+    data = read_map_file(job.base_path, job.area, job.key, job.reftime)
+    with Image.open(io.BytesIO(data)) as img:
+        frame = np.asarray(img.convert("RGBA"))
+    layer_path = dest_area.joinpath(job.layer)
+    written = 0
+    x_range, y_range = get_tile_range(boundaries, job.zoom)
+    for x in x_range:
+        for y in y_range:
+            tile = render_tile(frame, boundaries, x, y, job.zoom)
+            # empty tiles are left to the client background
+            if tile is None:
+                continue
+            write_tile(tile, layer_path.joinpath(str(job.zoom), str(x), f"{y}.png"))
+            written += 1
+    layer_path.mkdir(parents=True, exist_ok=True)
+    layer_path.joinpath(DONE_MARKER.format(zoom=job.zoom)).touch()
+    return written
+
+
+def list_jobs(
+    base_path: Path,
+    area: str,
+    reftime: str,
+    fields: List[str],
+    zooms: range,
+) -> List[TileJob]:
+    """The (frame, zoom level) pairs of a run, whatever their progress"""
+    area_path = base_path.joinpath(area)
+    jobs: List[TileJob] = []
+    present = sorted(p.name for p in area_path.iterdir() if p.is_dir())
+    for field in fields or present:
+        field_path = area_path.joinpath(field)
+        if not field_path.is_dir():
+            continue
+        for name in sorted(p.name for p in field_path.iterdir()):
+            parsed = parse_map_name(field, name)
+            if not parsed or parsed[0] != reftime:
+                continue
+            _, offset, level = parsed
+            layer = f"{reftime}.{offset}/{field}"
+            if field in LEVEL_FIELDS:
+                layer = f"{layer}/{level}"
+            for zoom in zooms:
+                jobs.append(
+                    TileJob(base_path, area, f"{field}/{name}", reftime, layer, zoom)
+                )
+    return jobs
+
+
+def is_done(job: TileJob, dest_area: Path) -> bool:
+    return dest_area.joinpath(job.layer, DONE_MARKER.format(zoom=job.zoom)).exists()
+
+
+def clear_markers(jobs: List[TileJob], dest_area: Path) -> None:
+    for job in jobs:
+        marker = dest_area.joinpath(job.layer, DONE_MARKER.format(zoom=job.zoom))
+        marker.unlink(missing_ok=True)
+
+
+@click.command()
+@click.argument("folder", type=click.Path(exists=True, file_okay=False, path_type=Path))
+@click.option("--reftime", help="Run to tile (default the last ready one)")
+@click.option(
+    "--field",
+    "fields",
+    multiple=True,
+    help="Field to tile (default all the ones found), repeatable",
+)
+@click.option("--min-zoom", default=MIN_ZOOM, show_default=True)
+@click.option("--max-zoom", default=MAX_ZOOM, show_default=True)
+@click.option(
+    "--workers", type=int, help="Worker processes (default the number of CPUs)"
+)
+@click.option(
+    "--dest",
+    type=click.Path(file_okay=False, path_type=Path),
+    help="Tiles folder (default the Tiles-* folder next to the maps one)",
+)
+def tiles(
+    folder: Path,
+    reftime: Optional[str],
+    fields: Tuple[str],
+    min_zoom: int,
+    max_zoom: int,
+    workers: Optional[int],
+    dest: Optional[Path],
+) -> None:
+    """
+    Cut the maps of a run folder (e.g. Magics-00-lm5.web) into a web
+    mercator tile pyramid, laid out as <area>/<reftime>.<offset>/<field>/z/x/y,
+    and mark the run as ready once all the tiles are written. The frames
+    are georeferenced by the boundaries of their dataset. An interrupted
+    run is resumed by running the command again.
+    """
+    dataset = get_dataset(folder)
+    info = DATASETS.get(dataset)
+    if not info:
+        raise click.UsageError(f"{dataset}: boundaries not known, cannot be tiled")
+    area = info["area"]
+    if not folder.joinpath(area).is_dir():
+        raise click.UsageError(f"{folder}: no {area} folder found")
+    reftime = reftime or get_ready_reftime(folder.joinpath(area))
+    if not reftime:
+        click.echo(f"{folder}/{area}: no .READY file found, skipped")
+        return
+
+    dest_area = (dest or get_tiles_path(folder, dataset)).joinpath(area)
+    ready_path = dest_area.joinpath(f"{reftime}.READY")
+    if ready_path.exists():
+        click.echo(f"{dest_area}: run {reftime} already tiled")
+        return
+
+    jobs = list_jobs(folder, area, reftime, list(fields), range(min_zoom, max_zoom + 1))
+    pending = [job for job in jobs if not is_done(job, dest_area)]
+    click.echo(
+        f"{dest_area}: {len(pending)} of {len(jobs)} frames and zoom levels to tile"
+    )
+    failed = 0
+    written: Dict[int, int] = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(cut_frame, job, dest_area, info["boundaries"]): job
+            for job in pending
+        }
+        for future in as_completed(futures):
+            job = futures[future]
+            try:
+                written[job.zoom] = written.get(job.zoom, 0) + future.result()
+            except Exception as exc:
+                failed += 1
+                click.echo(f"{job.key} (zoom {job.zoom}) failed: {exc}")
+    for zoom, count in sorted(written.items()):
+        click.echo(f"{dest_area}: {count} tiles written at zoom {zoom}")
+    if failed or not jobs:
+        click.echo(f"{dest_area}: run {reftime} not complete")
+        raise SystemExit(1)
+
+    clear_markers(jobs, dest_area)
+    # the run is visible only once all its tiles are in place
+    ready_path.touch()
+    click.echo(f"{dest_area}: run {reftime} ready")
+
+
+if __name__ == "__main__":
+    tiles()
@@ -0,0 +1,64 @@
+from pathlib import Path
+
+from faker import Faker
+from maps.endpoints.config import AREAS, DEFAULT_PLATFORM, ENVS, RESOLUTIONS, RUNS
+from PIL import Image
+from restapi.config import DATA_PATH
+from restapi.tests import API_URI, BaseTests, FlaskClient
+
+
+class TestApp(BaseTests):
+    def test_api_animation(self, client: FlaskClient, faker: Faker) -> None:
+
+        run = RUNS[0]
+        res = RESOLUTIONS[0]
+        area = AREAS[0]
+        field = "prec1"
+        platform = DEFAULT_PLATFORM
+        env = ENVS[0]
+        reftime = faker.date_time().strftime("%Y%m%d%H")
+
+        endpoint = (
+            API_URI
+            + f"/maps/animation?field={field}&run={run}&res={res}&area={area}&platform={platform}&env={env}"
+        )
+
+        # maps are not ready yet
+        r = client.get(endpoint)
+        assert r.status_code == 404
+
+        # create filesystem
+        map_path = DATA_PATH.joinpath(platform, env, f"Magics-{run}-{res}.web", area)
+        field_dir = map_path.joinpath(field)
+        field_dir.mkdir(parents=True, exist_ok=True)
+        mapfile_paths = []
+        for offset in ["0000", "0001", "0002", "0003"]:
+            mapfile_path = field_dir.joinpath(f"{field}.{reftime}.{offset}.png")
+            Image.new("RGBA", (32, 32), faker.color_rgb()).save(mapfile_path)
+            mapfile_paths.append(mapfile_path)
+        readyfile_path = map_path.joinpath(f"{reftime}.READY")
+        open(readyfile_path, "a").close()
+
+        # animated webp with all the offsets
+        r = client.get(endpoint)
+        assert r.status_code == 200
+        assert r.headers["Content-Type"] == "image/webp"
+        etag = r.headers["ETag"]
+
+        # the animation is built once and then served as is
+        r = client.get(endpoint, headers={"If-None-Match": etag})
+        assert r.status_code == 304
+
+        # animated png with one frame every two offsets
+        r = client.get(f"{endpoint}&format=apng&step=2")
+        assert r.status_code == 200
+        assert r.headers["Content-Type"] == "image/apng"
+        assert r.headers["ETag"] != etag
+
+        r = client.get(f"{endpoint}&step=0")
+        assert r.status_code == 400
+
+        # delete the files used for the test
+        Path.unlink(readyfile_path)
+        for mapfile_path in mapfile_paths:
+            Path.unlink(mapfile_path)
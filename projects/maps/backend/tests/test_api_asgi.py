@@ -0,0 +1,69 @@
+from pathlib import Path
+
+from faker import Faker
+from maps.asgi import app
+from maps.endpoints.config import AREAS, DEFAULT_PLATFORM, ENVS, RESOLUTIONS, RUNS
+from restapi.config import DATA_PATH
+from restapi.tests import API_URI, BaseTests
+from starlette.testclient import TestClient
+
+
+class TestApp(BaseTests):
+    def test_api_asgi(self, faker: Faker) -> None:
+
+        run = RUNS[0]
+        res = RESOLUTIONS[0]
+        area = AREAS[0]
+        field = "snow3"
+        platform = DEFAULT_PLATFORM
+        env = ENVS[0]
+        reftime = faker.date_time().strftime("%Y%m%d%H")
+        params = f"field={field}&run={run}&res={res}&area={area}&platform={platform}&env={env}"
+
+        # create filesystem
+        map_path = DATA_PATH.joinpath(platform, env, f"Magics-{run}-{res}.web", area)
+        field_dir = map_path.joinpath(field)
+        field_dir.mkdir(parents=True, exist_ok=True)
+        mapfile_path = field_dir.joinpath(f"{field}.{reftime}.0003.png")
+        content = faker.binary(length=faker.pyint(100, 2000))
+        with open(mapfile_path, "wb") as f:
+            f.write(content)
+
+        with TestClient(app) as client:
+
+            # maps are not ready yet
+            r = client.get(f"{API_URI}/maps/ready?{params}")
+            assert r.status_code == 404
+
+            readyfile_path = map_path.joinpath(f"{reftime}.READY")
+            open(readyfile_path, "a").close()
+
+            r = client.get(f"{API_URI}/maps/ready?{params}")
+            assert r.status_code == 200
+            assert r.json() == {
+                "reftime": reftime,
+                "offsets": ["0003"],
+                "platform": platform,
+            }
+
+            # same validation of the Flask endpoints
+            r = client.get(f"{API_URI}/maps/ready?{params}&run=99")
+            assert r.status_code == 400
+
+            r = client.get(f"{API_URI}/maps/offset/0003?{params}")
+            assert r.status_code == 200
+            assert r.content == content
+            assert r.headers["Content-Type"] == "image/png"
+
+            r = client.get(
+                f"{API_URI}/maps/offset/0003?{params}",
+                headers={"If-None-Match": r.headers["ETag"]},
+            )
+            assert r.status_code == 304
+
+            r = client.get(f"{API_URI}/maps/offset/0006?{params}")
+            assert r.status_code == 404
+
+        # delete the files used for the test
+        Path.unlink(readyfile_path)
+        Path.unlink(mapfile_path)
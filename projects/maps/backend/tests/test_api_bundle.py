@@ -0,0 +1,94 @@
+import io
+import zipfile
+from pathlib import Path
+
+from faker import Faker
+from maps.endpoints.config import AREAS, DEFAULT_PLATFORM, ENVS, RESOLUTIONS, RUNS
+from restapi.config import DATA_PATH
+from restapi.tests import API_URI, BaseTests, FlaskClient
+
+
+class TestApp(BaseTests):
+    def test_api_bundle(self, client: FlaskClient, faker: Faker) -> None:
+
+        run = RUNS[0]
+        res = RESOLUTIONS[0]
+        area = AREAS[0]
+        field = "t2m"
+        platform = DEFAULT_PLATFORM
+        env = ENVS[0]
+        reftime = faker.date_time().strftime("%Y%m%d%H")
+
+        endpoint = (
+            API_URI
+            + f"/maps/bundle?field={field}&run={run}&res={res}&area={area}&platform={platform}&env={env}"
+        )
+
+        # create filesystem
+        map_path = DATA_PATH.joinpath(platform, env, f"Magics-{run}-{res}.web", area)
+        field_dir = map_path.joinpath(field)
+        field_dir.mkdir(parents=True, exist_ok=True)
+        contents = {}
+        for offset in ["0000", "0001", "0002"]:
+            mapfile_path = field_dir.joinpath(f"{field}.{reftime}.{offset}.png")
+            contents[mapfile_path.name] = faker.binary(length=faker.pyint(100, 2000))
+            with open(mapfile_path, "wb") as f:
+                f.write(contents[mapfile_path.name])
+
+        # maps are not ready yet
+        r = client.get(endpoint)
+        assert r.status_code == 404
+
+        readyfile_path = map_path.joinpath(f"{reftime}.READY")
+        open(readyfile_path, "a").close()
+
+        # get the whole bundle
+        r = client.get(endpoint)
+        assert r.status_code == 200
+        assert r.headers["Accept-Ranges"] == "bytes"
+        bundle = r.data
+        with zipfile.ZipFile(io.BytesIO(bundle)) as z:
+            assert z.testzip() is None
+            assert sorted(z.namelist()) == sorted(contents)
+            for name, content in contents.items():
+                assert z.read(name) == content
+
+        # restrict the offset range
+        r = client.get(f"{endpoint}&offset_from=1&offset_to=1")
+        assert r.status_code == 200
+        with zipfile.ZipFile(io.BytesIO(r.data)) as z:
+            assert z.namelist() == [f"{field}.{reftime}.0001.png"]
+
+        r = client.get(f"{endpoint}&offset_from=10")
+        assert r.status_code == 404
+
+        # resume an interrupted download
+        half = len(bundle) // 2
+        r = client.get(endpoint, headers={"Range": f"bytes={half}-"})
+        assert r.status_code == 206
+        assert r.data == bundle[half:]
+        content_range = f"bytes {half}-{len(bundle) - 1}/{len(bundle)}"
+        assert r.headers["Content-Range"] == content_range
+
+        r = client.get(endpoint, headers={"Range": "bytes=0-9"})
+        assert r.status_code == 206
+        assert r.data == bundle[:10]
+
+        # the range is ignored if the bundle has changed in the meantime
+        r = client.get(endpoint, headers={"Range": "bytes=0-9", "If-Range": '"old"'})
+        assert r.status_code == 200
+        assert r.data == bundle
+
+        r = client.get(endpoint, headers={"Range": f"bytes={len(bundle) + 10}-"})
+        assert r.status_code == 416
+
+        # unchanged bundle
+        r = client.get(endpoint)
+        etag = r.headers["ETag"]
+        r = client.get(endpoint, headers={"If-None-Match": etag})
+        assert r.status_code == 304
+
+        # delete the files used for the test
+        Path.unlink(readyfile_path)
+        for name in contents:
+            Path.unlink(field_dir.joinpath(name))
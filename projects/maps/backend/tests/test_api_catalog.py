@@ -0,0 +1,86 @@
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from faker import Faker
+from maps.endpoints.config import AREAS, DEFAULT_PLATFORM, RESOLUTIONS, RUNS
+from restapi.config import DATA_PATH
+from restapi.tests import API_URI, BaseTests, FlaskClient
+
+
+class TestApp(BaseTests):
+    def test_api_catalog(self, client: FlaskClient, faker: Faker) -> None:
+
+        run = RUNS[0]
+        res = RESOLUTIONS[0]
+        area = AREAS[0]
+        platform = DEFAULT_PLATFORM
+        env = "PROD"
+        reftime = faker.date_time().strftime("%Y%m%d%H")
+
+        endpoint = API_URI + "/maps/catalog"
+
+        # create filesystem
+        map_path = DATA_PATH.joinpath(platform, env, f"Magics-{run}-{res}.web", area)
+        field_dir = map_path.joinpath("t2m")
+        field_dir.mkdir(parents=True, exist_ok=True)
+        created = [
+            field_dir.joinpath(f"t2m.{reftime}.{offset}.png")
+            for offset in ("0000", "0001")
+        ]
+        flood_path = DATA_PATH.joinpath(platform, env, f"PROB-{run}-iff.web", area)
+        flood_dir = flood_path.joinpath("percentile")
+        flood_dir.mkdir(parents=True, exist_ok=True)
+        created.append(flood_dir.joinpath(f"perc6.{reftime}.0006_10.png"))
+        created.append(map_path.joinpath(f"{reftime}.READY"))
+        created.append(flood_path.joinpath(f"{reftime}.READY"))
+        for path in created:
+            open(path, "a").close()
+
+        r = client.get(endpoint)
+        assert r.status_code == 200
+        catalog = self.get_content(r)
+        assert isinstance(catalog, dict)
+        assert catalog["format"] == 1
+        assert catalog["version"]
+        assert catalog["platforms"][platform] is True
+        assert r.headers["ETag"] == f'"{catalog["version"]}"'
+
+        def find(res: str) -> Optional[Dict[str, Any]]:
+            for entry in catalog["maps"]:
+                if (
+                    entry["platform"] == platform
+                    and entry["env"] == env
+                    and entry["run"] == run
+                    and entry["res"] == res
+                    and entry["area"] == area
+                ):
+                    return entry
+            return None
+
+        maps = find(res)
+        assert maps is not None
+        assert maps["reftime"] == reftime
+        assert maps["fields"]["t2m"] == ["0000", "0001"]
+        flood = find("iff")
+        assert flood is not None
+        assert flood["fields"]["percentile"] == {"10": ["0006"]}
+
+        # an unchanged catalog costs nothing
+        etag = r.headers["ETag"]
+        r = client.get(endpoint, headers={"If-None-Match": etag})
+        assert r.status_code == 304
+
+        # the catalog changes along with the runs
+        Path.unlink(created[1])
+        r = client.get(endpoint, headers={"If-None-Match": etag})
+        assert r.status_code == 200
+        assert r.headers["ETag"] != etag
+        catalog = self.get_content(r)
+        assert isinstance(catalog, dict)
+        maps = find(res)
+        assert maps is not None
+        assert maps["fields"]["t2m"] == ["0000"]
+
+        # delete the files used for the test
+        for path in created:
+            path.unlink(missing_ok=True)
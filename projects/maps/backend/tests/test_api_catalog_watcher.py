@@ -0,0 +1,91 @@
+import shutil
+import time
+from pathlib import Path
+from typing import Callable, List, Tuple
+
+import pytest
+from faker import Faker
+from maps.endpoints.catalog import AREA_DEPTH, InotifyWatcher, RunCatalog
+from restapi.config import DATA_PATH
+from restapi.tests import BaseTests
+
+
+def wait_for(condition: Callable[[], bool], timeout: float = 10) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.1)
+    return condition()
+
+
+def add_run(area_path: Path, field: str, reftime: str) -> None:
+    field_dir = area_path.joinpath(field)
+    field_dir.mkdir(parents=True, exist_ok=True)
+    field_dir.joinpath(f"{field}.{reftime}.0000.png").write_bytes(b"png")
+    area_path.joinpath(f"{reftime}.READY").touch()
+
+
+class TestApp(BaseTests):
+    @pytest.mark.parametrize("watcher", ["poll", "inotify", "inotify-partial"])
+    def test_api_catalog_watcher(
+        self, watcher: str, faker: Faker, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+
+        field = "t2m"
+        reftime = faker.date_time().strftime("%Y%m%d%H")
+        new_reftime = faker.date_time().strftime("%Y%m%d%H")
+        while new_reftime == reftime:
+            new_reftime = faker.date_time().strftime("%Y%m%d%H")
+
+        # create filesystem
+        root = DATA_PATH.joinpath(f"catalog-{faker.pystr()}")
+        base_path = root.joinpath("G100", "PROD", "Magics-00-lm5.web")
+        area_path = base_path.joinpath("Italia")
+        add_run(area_path, field, reftime)
+        # a platform reported as not available
+        down_path = root.joinpath("MEUCCI", "PROD", "Magics-00-lm5.web")
+        add_run(down_path.joinpath("Italia"), field, reftime)
+
+        if watcher == "inotify-partial":
+            # as with fs.inotify.max_user_watches exhausted
+            add_watch = InotifyWatcher.add_watch
+
+            def fail_on_areas(self: InotifyWatcher, path: Path) -> bool:
+                if self.depth(path) >= AREA_DEPTH:
+                    self.unwatched.add(path)
+                    return False
+                return add_watch(self, path)
+
+            monkeypatch.setattr(InotifyWatcher, "add_watch", fail_on_areas)
+            watcher = "inotify"
+
+        notified: List[Tuple[Path, str]] = []
+        run_catalog = RunCatalog(
+            root,
+            watcher=watcher,
+            poll_interval=1,
+            scan_timeout=5,
+            available=lambda platform: platform != "MEUCCI",
+        )
+        run_catalog.subscribe(lambda path, r: notified.append((path, r)))
+
+        # the lookups do not wait for the initial scan
+        assert run_catalog.get_reftime(base_path, "Italia") == reftime
+        assert run_catalog.wait_ready(10)
+        assert run_catalog.get_reftime(base_path, "Italia") == reftime
+        assert run_catalog.get_offsets(base_path, "Italia", field) == ["0000"]
+        # the folders of the unavailable platforms are not accessed
+        assert run_catalog.get_reftime(down_path, "Italia") is None
+        assert not notified
+
+        version = run_catalog.version(base_path, "Italia")
+        add_run(area_path, field, new_reftime)
+        assert wait_for(
+            lambda: new_reftime in run_catalog.area(base_path, "Italia").reftimes
+        )
+        assert run_catalog.version(base_path, "Italia") != version
+        assert notified == [(area_path, new_reftime)]
+
+        # delete the files used for the test
+        shutil.rmtree(root)
@@ -0,0 +1,83 @@
+from pathlib import Path
+
+import numpy as np
+from faker import Faker
+from maps.endpoints.config import DEFAULT_PLATFORM, ENVS, RUNS
+from maps.endpoints.values import NO_CLASS, classify_frame
+from PIL import Image, ImageDraw
+from restapi.config import DATA_PATH
+from restapi.tests import API_URI, BaseTests, FlaskClient
+
+LEGEND_COLORS = [(0, 0, 255), (0, 255, 0), (255, 200, 0), (255, 0, 0)]
+
+
+class TestApp(BaseTests):
+    def test_api_classes(self, client: FlaskClient, faker: Faker) -> None:
+
+        run = RUNS[0]
+        res = "lm5"
+        area = "Area_Mediterranea"
+        field = "t2m"
+        platform = DEFAULT_PLATFORM
+        env = ENVS[0]
+        reftime = faker.date_time().strftime("%Y%m%d%H")
+
+        endpoint = (
+            API_URI
+            + f"/maps/class?field={field}&run={run}&res={res}&area={area}&platform={platform}&env={env}&offset=0000"
+        )
+
+        # create filesystem
+        base_path = DATA_PATH.joinpath(platform, env, f"Magics-{run}-{res}.web")
+        map_path = base_path.joinpath(area)
+        field_dir = map_path.joinpath(field)
+        field_dir.mkdir(parents=True, exist_ok=True)
+        mapfile_path = field_dir.joinpath(f"{field}.{reftime}.0000.png")
+        # west half in the lowest class, east half in the highest one
+        img = Image.new("RGBA", (200, 100), LEGEND_COLORS[0] + (255,))
+        ImageDraw.Draw(img).rectangle([100, 0, 199, 99], fill=LEGEND_COLORS[-1])
+        img.save(mapfile_path)
+        legend_dir = base_path.joinpath("legends")
+        legend_dir.mkdir(parents=True, exist_ok=True)
+        legend_path = legend_dir.joinpath(f"{field}.png")
+        legend = Image.new("RGBA", (300, 40), (255, 255, 255, 0))
+        draw = ImageDraw.Draw(legend)
+        for i, color in enumerate(LEGEND_COLORS):
+            draw.rectangle([10 + i * 70, 5, 79 + i * 70, 25], fill=color)
+        draw.text((10, 27), "0 5 10 20 40", fill=(0, 0, 0, 255))
+        legend.save(legend_path)
+        readyfile_path = map_path.joinpath(f"{reftime}.READY")
+        open(readyfile_path, "a").close()
+
+        r = client.get(f"{endpoint}&lat=40&lon=-20")
+        assert r.status_code == 200
+        response_data = self.get_content(r)
+        assert isinstance(response_data, dict)
+        assert response_data["reftime"] == reftime
+        assert response_data["offset"] == "0000"
+        assert response_data["color"] == "#0000ff"
+        assert response_data["class"] == 0
+
+        r = client.get(f"{endpoint}&lat=40&lon=30")
+        assert r.status_code == 200
+        response_data = self.get_content(r)
+        assert isinstance(response_data, dict)
+        assert response_data["class"] == 3
+
+        # outside of the map
+        r = client.get(f"{endpoint}&lat=60&lon=30")
+        assert r.status_code == 400
+
+        # the maps of this area are not georeferenced
+        r = client.get(f"{endpoint}&lat=40&lon=10".replace(area, "Italia"))
+        assert r.status_code == 404
+
+        # legends of more than 127 classes
+        colors = np.array([(i, 255 - i, 128) for i in range(200)])
+        pixels = np.array([[[199, 56, 128, 255], [0, 0, 0, 0]]], dtype=np.uint8)
+        assert classify_frame(pixels, colors).tolist() == [[199, NO_CLASS]]
+
+        # delete the files used for the test
+        Path.unlink(readyfile_path)
+        Path.unlink(mapfile_path)
+        Path.unlink(legend_path)
@@ -0,0 +1,72 @@
+import io
+from pathlib import Path
+
+from faker import Faker
+from maps.endpoints.config import DEFAULT_PLATFORM, ENVS, RUNS
+from PIL import Image
+from restapi.config import DATA_PATH
+from restapi.tests import API_URI, BaseTests, FlaskClient
+
+
+class TestApp(BaseTests):
+    def test_api_crops(self, client: FlaskClient, faker: Faker) -> None:
+
+        run = RUNS[0]
+        res = "lm5"
+        area = "Area_Mediterranea"
+        field = "t2m"
+        platform = DEFAULT_PLATFORM
+        env = ENVS[0]
+        reftime = faker.date_time().strftime("%Y%m%d%H")
+
+        endpoint = (
+            API_URI
+            + f"/maps/offset/0000?field={field}&run={run}&res={res}&area=Italia&platform={platform}&env={env}"
+        )
+
+        # create filesystem
+        base_path = DATA_PATH.joinpath(platform, env, f"Magics-{run}-{res}.web")
+        map_path = base_path.joinpath(area)
+        field_dir = map_path.joinpath(field)
+        field_dir.mkdir(parents=True, exist_ok=True)
+        mapfile_path = field_dir.joinpath(f"{field}.{reftime}.0000.png")
+        # 10 pixels per degree
+        Image.new("RGBA", (779, 297), (255, 0, 0, 255)).save(mapfile_path)
+        readyfile_path = map_path.joinpath(f"{reftime}.READY")
+        open(readyfile_path, "a").close()
+
+        r = client.get(f"{endpoint}&bbox=10,40,20,45")
+        assert r.status_code == 200
+        assert r.mimetype == "image/png"
+        etag = r.headers["ETag"]
+        content = self.get_content(r)
+        assert isinstance(content, bytes)
+        with Image.open(io.BytesIO(content)) as img:
+            assert abs(img.width - 100) <= 1
+            assert abs(img.height - 50) <= 1
+
+        # served from the crop of the first request
+        r = client.get(f"{endpoint}&bbox=10,40,20,45", headers={"If-None-Match": etag})
+        assert r.status_code == 304
+
+        r = client.get(f"{endpoint}&region=Sicilia")
+        assert r.status_code == 200
+
+        # outside of the georeferenced maps
+        r = client.get(f"{endpoint}&bbox=10,60,20,65")
+        assert r.status_code == 400
+        # empty box
+        r = client.get(f"{endpoint}&bbox=20,40,10,45")
+        assert r.status_code == 400
+        r = client.get(f"{endpoint}&bbox=10,40,20")
+        assert r.status_code == 400
+        r = client.get(f"{endpoint}&region=Sicilia&bbox=10,40,20,45")
+        assert r.status_code == 400
+        r = client.get(f"{endpoint}&region=Sicilia&size=small")
+        assert r.status_code == 400
+        r = client.get(f"{endpoint}&region=Atlantide")
+        assert r.status_code == 400
+
+        # delete the files used for the test
+        Path.unlink(readyfile_path)
+        Path.unlink(mapfile_path)
@@ -0,0 +1,93 @@
+import json
+from typing import Any, Dict, List
+
+import pytest
+from maps.endpoints.config import DEFAULT_PLATFORM
+from maps.endpoints.events import flask_streams, run_events
+from restapi.config import DATA_PATH
+from restapi.tests import API_URI, BaseTests, FlaskClient
+
+
+def parse_events(stream: str) -> List[Dict[str, Any]]:
+    events = []
+    for block in stream.split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines() if ": " in line)
+        if lines.get("event") == "run":
+            events.append(json.loads(lines["data"]))
+    return events
+
+
+class TestApp(BaseTests):
+    def test_api_events(
+        self, client: FlaskClient, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+
+        endpoint = API_URI + "/maps/events"
+        platform_path = DATA_PATH.joinpath(DEFAULT_PLATFORM, "PROD")
+        # the last event known by the client
+        run_events.publish(
+            platform_path.joinpath("Magics-12-lm5.web", "Italia"), "2022022212"
+        )
+        since = f"{DEFAULT_PLATFORM}/PROD/Magics-12-lm5.web/Italia/2022022212"
+        generation = run_events.generation
+
+        # the catalog notifications are shared by all the clients
+        run_events.publish(
+            platform_path.joinpath("Magics-00-lm5.web", "Italia"), "2022022300"
+        )
+        run_events.publish(
+            platform_path.joinpath("Tiles-12-lm2.2.web", "Italia"), "2022022312"
+        )
+        # not a run folder
+        run_events.publish(DATA_PATH.joinpath("other"), "2022022312")
+        assert run_events.generation == generation + 2
+
+        r = client.get(f"{endpoint}?since={since}&timeout=1")
+        assert r.status_code == 200
+        assert r.headers["Content-Type"].startswith("text/event-stream")
+        events = parse_events(r.get_data(as_text=True))
+        assert len(events) == 2
+        assert events[0]["kind"] == "maps"
+        assert events[0]["run"] == "00"
+        assert events[0]["dataset"] == "lm5"
+        assert events[0]["reftime"] == "2022022300"
+        assert events[0]["platform"] == DEFAULT_PLATFORM
+        assert events[1]["kind"] == "tiles"
+        # the same whatever the worker answering the reconnection
+        tiles_id = f"{DEFAULT_PLATFORM}/PROD/Tiles-12-lm2.2.web/Italia/2022022312"
+        assert events[1]["id"] == tiles_id
+
+        r = client.get(f"{endpoint}?since={since}&timeout=1&kind=tiles")
+        events = parse_events(r.get_data(as_text=True))
+        assert len(events) == 1
+        assert events[0]["dataset"] == "lm2.2"
+
+        # a reconnecting client only gets the following events
+        r = client.get(
+            f"{endpoint}?timeout=1", headers={"Last-Event-ID": events[0]["id"]}
+        )
+        events = parse_events(r.get_data(as_text=True))
+        assert [e["id"] for e in events] == [tiles_id]
+
+        # new clients only get new events
+        r = client.get(f"{endpoint}?timeout=1")
+        stream = r.get_data(as_text=True)
+        assert not parse_events(stream)
+        assert "heartbeat" in stream
+
+        # unknown event, e.g. after a restart
+        r = client.get(f"{endpoint}?since={DEFAULT_PLATFORM}/PROD/other&timeout=1")
+        assert "event: reset" in r.get_data(as_text=True)
+
+        # the streams of the Flask workers are limited
+        monkeypatch.setattr(flask_streams, "count", flask_streams.size)
+        r = client.get(f"{endpoint}?timeout=1")
+        assert r.status_code == 503
+        monkeypatch.undo()
+        r = client.get(f"{endpoint}?timeout=1")
+        assert r.status_code == 200
+        r.get_data()
+        assert flask_streams.count == 0
+
+        r = client.get(f"{endpoint}?run=06")
+        assert r.status_code == 400
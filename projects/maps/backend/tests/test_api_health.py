@@ -0,0 +1,40 @@
+from faker import Faker
+from maps.endpoints.config import PLATFORMS
+from maps.endpoints.health import PlatformMonitor
+from restapi.config import DATA_PATH
+from restapi.tests import BaseTests
+
+
+class TestApp(BaseTests):
+    def test_platform_monitor(self, faker: Faker) -> None:
+
+        missing = f"missing-{faker.pystr()}"
+        DATA_PATH.joinpath(PLATFORMS[0]).mkdir(parents=True, exist_ok=True)
+        monitor = PlatformMonitor(
+            [PLATFORMS[0], missing], interval=3600, timeout=2, fall=3, rise=2
+        )
+
+        # the first probes are done before answering
+        assert monitor.is_up(PLATFORMS[0])
+        assert not monitor.is_up(missing)
+        generation = monitor.generation
+
+        # a platform goes down only after `fall` failed probes
+        monitor.update(PLATFORMS[0], False)
+        monitor.update(PLATFORMS[0], False)
+        assert monitor.is_up(PLATFORMS[0])
+        # a success in the middle resets the count
+        monitor.update(PLATFORMS[0], True)
+        monitor.update(PLATFORMS[0], False)
+        monitor.update(PLATFORMS[0], False)
+        assert monitor.is_up(PLATFORMS[0])
+        monitor.update(PLATFORMS[0], False)
+        assert not monitor.is_up(PLATFORMS[0])
+        assert monitor.generation == generation + 1
+
+        # and comes back after `rise` successful ones
+        monitor.probe_all()
+        assert not monitor.is_up(PLATFORMS[0])
+        monitor.probe_all()
+        assert monitor.is_up(PLATFORMS[0])
+        assert not monitor.is_up(missing)
@@ -0,0 +1,87 @@
+from pathlib import Path
+
+from faker import Faker
+from maps.endpoints.cache import SegmentedLRUCache
+from maps.endpoints.config import AREAS, DEFAULT_PLATFORM, ENVS, RESOLUTIONS, RUNS
+from maps.endpoints.delivery import drop_hot_images, hot_images
+from restapi.config import DATA_PATH
+from restapi.tests import API_URI, BaseTests, FlaskClient
+
+
+class TestApp(BaseTests):
+    def test_segmented_lru(self) -> None:
+
+        cache = SegmentedLRUCache("test", 100)
+        for i in range(5):
+            cache.set(i, f"value{i}", 10)
+        # requested twice: promoted to the protected segment
+        assert cache.get(0) == "value0"
+        assert cache.get(1) == "value1"
+
+        # a scan of entries requested once does not evict them
+        for i in range(5, 50):
+            cache.set(i, f"value{i}", 10)
+        assert cache.size <= 100
+        assert cache.get(0) == "value0"
+        assert cache.get(1) == "value1"
+        assert cache.get(5) is None
+
+        # too large for the probation segment
+        cache.set("large", "value", 30)
+        assert cache.get("large") is None
+
+        cache.discard(lambda k: k == 0)
+        assert cache.get(0) is None
+        assert cache.get(1) == "value1"
+
+    def test_api_hot_images(self, client: FlaskClient, faker: Faker) -> None:
+
+        run = RUNS[0]
+        res = RESOLUTIONS[0]
+        area = AREAS[0]
+        field = "humidity"
+        platform = DEFAULT_PLATFORM
+        env = ENVS[0]
+        reftime = faker.date_time().strftime("%Y%m%d%H")
+
+        endpoint = (
+            API_URI
+            + f"/maps/offset/0000?field={field}&run={run}&res={res}&area={area}&platform={platform}&env={env}"
+        )
+
+        # create filesystem
+        map_path = DATA_PATH.joinpath(platform, env, f"Magics-{run}-{res}.web", area)
+        field_dir = map_path.joinpath(field)
+        field_dir.mkdir(parents=True, exist_ok=True)
+        mapfile_path = field_dir.joinpath(f"{field}.{reftime}.0000.png")
+        content = faker.binary(length=1024)
+        mapfile_path.write_bytes(content)
+        readyfile_path = map_path.joinpath(f"{reftime}.READY")
+        open(readyfile_path, "a").close()
+
+        r = client.get(endpoint, headers={"Accept": "image/png"})
+        assert r.status_code == 200
+        assert r.data == content
+        etag = r.headers["ETag"]
+
+        # the cached image is sent without reading the file again
+        mapfile_path.write_bytes(faker.binary(length=1024))
+        r = client.get(endpoint, headers={"Accept": "image/png"})
+        assert r.status_code == 200
+        assert r.data == content
+        assert r.headers["ETag"] == etag
+
+        r = client.get(endpoint, headers={"Accept": "image/png", "If-None-Match": etag})
+        assert r.status_code == 304
+
+        # a new run drops the images of the older ones
+        drop_hot_images(map_path, "2099010100")
+        key = (map_path.parent, area, f"{field}/{mapfile_path.name}", reftime)
+        assert hot_images.get(key) is None
+        r = client.get(endpoint, headers={"Accept": "image/png"})
+        assert r.status_code == 200
+        assert r.data != content
+
+        # delete the files used for the test
+        Path.unlink(readyfile_path)
+        Path.unlink(mapfile_path)
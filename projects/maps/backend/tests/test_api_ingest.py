@@ -0,0 +1,92 @@
+import json
+from pathlib import Path
+
+from click.testing import CliRunner
+from faker import Faker
+from maps.endpoints.config import AREAS, DATASETS, DEFAULT_PLATFORM, ENVS, RUNS
+from maps.tasks.ingest import ingest
+from restapi.config import DATA_PATH
+from restapi.tests import API_URI, BaseTests, FlaskClient
+
+
+class TestApp(BaseTests):
+    def test_api_ingest(self, client: FlaskClient, faker: Faker) -> None:
+
+        run = RUNS[0]
+        res = "lm2.2"
+        area = AREAS[0]
+        field = "t2m"
+        platform = DEFAULT_PLATFORM
+        env = ENVS[0]
+        reftime = faker.date_time().strftime("%Y%m%d%H")
+
+        endpoint = (
+            API_URI
+            + f"/maps/ready?field={field}&run={run}&res={res}&area={area}&platform={platform}&env={env}"
+        )
+
+        # create filesystem
+        run_path = DATA_PATH.joinpath(platform, env, f"Magics-{run}-{res}.web")
+        map_path = run_path.joinpath(area)
+        field_dir = map_path.joinpath(field)
+        field_dir.mkdir(parents=True, exist_ok=True)
+        info = DATASETS[res]
+        offsets = [
+            f"{o:04d}"
+            for o in range(info["start_offset"], info["end_offset"] + 1, info["step"])
+        ]
+        map_files = [
+            field_dir.joinpath(f"{field}.{reftime}.{offset}.png") for offset in offsets
+        ]
+        for mapfile_path in map_files[:-1]:
+            mapfile_path.write_bytes(faker.binary(length=64))
+        readyfile_path = map_path.joinpath(f"{reftime}.READY")
+        manifest_path = map_path.joinpath(f"{reftime}.manifest.json")
+
+        args = [str(run_path), "--reftime", reftime, "--field", field, "--ready"]
+
+        # the last offset is missing: the run is not marked as ready
+        result = CliRunner().invoke(ingest, args)
+        assert result.exit_code == 1
+        assert map_files[-1].name in result.output
+        assert not readyfile_path.exists()
+        manifest = json.loads(manifest_path.read_text())
+        assert not manifest["complete"]
+        assert manifest["missing"] == [f"{field}/{map_files[-1].name}"]
+
+        map_files[-1].write_bytes(faker.binary(length=64))
+        result = CliRunner().invoke(ingest, args)
+        assert result.exit_code == 0
+        assert readyfile_path.exists()
+        manifest = json.loads(manifest_path.read_text())
+        assert manifest["complete"]
+        assert manifest["reftime"] == reftime
+        size, checksum = manifest["files"][f"{field}/{map_files[0].name}"]
+        assert size == 64
+        assert len(checksum) == 8
+
+        # the offsets are read from the manifest
+        r = client.get(endpoint)
+        assert r.status_code == 200
+        response_data = self.get_content(r)
+        assert isinstance(response_data, dict)
+        assert response_data["reftime"] == reftime
+        assert response_data["offsets"] == offsets
+
+        # by default all the fields of the dataset are expected
+        result = CliRunner().invoke(ingest, [str(run_path), "--reftime", reftime])
+        assert result.exit_code == 1
+        manifest = json.loads(manifest_path.read_text())
+        assert not manifest["complete"]
+        assert f"{field}/{map_files[0].name}" in manifest["files"]
+        assert not any(key.startswith(f"{field}/") for key in manifest["missing"])
+        # accumulated fields are expected every period hours
+        assert f"prec3/prec3.{reftime}.0003.png" in manifest["missing"]
+        assert f"prec3/prec3.{reftime}.0004.png" not in manifest["missing"]
+        assert not any(key.startswith("percentile/") for key in manifest["missing"])
+
+        # delete the files used for the test
+        Path.unlink(readyfile_path)
+        Path.unlink(manifest_path)
+        for mapfile_path in map_files:
+            Path.unlink(mapfile_path)
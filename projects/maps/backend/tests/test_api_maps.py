@@ -1,7 +1,9 @@
 import datetime
+import os
 from pathlib import Path
 
 from faker import Faker
+from maps.endpoints.cache import ReadyCache
 from maps.endpoints.config import (
     AREAS,
     DEFAULT_PLATFORM,
@@ -109,6 +111,7 @@ def test_api_maps(self, client: FlaskClient, faker: Faker) -> None:
         ready_res = self.get_content(r)
         assert isinstance(ready_res, dict)
         assert ready_res["platform"] == platform
+        assert ready_res["skipped"] == [no_avail_platform]
 
         # not specify a platform with both the platform available
         # create the filesystem for the other platform
@@ -137,6 +140,7 @@ def test_api_maps(self, client: FlaskClient, faker: Faker) -> None:
         ready_res = self.get_content(r)
         assert isinstance(ready_res, dict)
         assert ready_res["platform"] == no_avail_platform
+        assert "skipped" not in ready_res
 
         # get a map that does not exists
         endpoint = (
@@ -162,6 +166,19 @@ def test_api_maps(self, client: FlaskClient, faker: Faker) -> None:
         # check if the retrieved file is the same created (and if it's complete)
         assert retrieved_map_content == fcontent
 
+        # the map is unchanged: conditional requests are answered with a 304
+        etag = r.headers["ETag"]
+        last_modified = r.headers["Last-Modified"]
+        assert "max-age" in r.headers["Cache-Control"]
+        r = client.get(endpoint, headers={"If-None-Match": etag})
+        assert r.status_code == 304
+        assert not r.data
+        r = client.get(endpoint, headers={"If-Modified-Since": last_modified})
+        assert r.status_code == 304
+        r = client.get(endpoint, headers={"If-None-Match": '"outdated"'})
+        assert r.status_code == 200
+        assert r.data.decode("utf-8") == fcontent
+
         # TEST LEGEND RETRIEVING
         # legend file does not exists
         leg_endpoint = (
@@ -188,6 +205,15 @@ def test_api_maps(self, client: FlaskClient, faker: Faker) -> None:
         # check if the retrieved file is the same created (and if it's complete)
         assert retrieved_legend_content == fcontent
 
+        # the legend is written again: its validators change
+        etag = r.headers["ETag"]
+        stat = cosmo_legend_path.stat()
+        cosmo_legend_path.write_text(faker.paragraph())
+        os.utime(cosmo_legend_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        r = client.get(leg_endpoint, headers={"If-None-Match": etag})
+        assert r.status_code == 200
+        assert r.headers["ETag"] != etag
+
         # PERCENTILE CASE
         field = "percentile"
         level_pe = LEVELS_PE[0]
@@ -336,3 +362,63 @@ def test_api_maps(self, client: FlaskClient, faker: Faker) -> None:
         Path.unlink(perc_legend_path)
         Path.unlink(prob_mapfile_path)
         Path.unlink(prob_legend_path)
+
+    def test_api_ready_cache(self, client: FlaskClient, faker: Faker) -> None:
+
+        # an entry is valid as long as its token is the same
+        cache = ReadyCache("test")
+        cache.set("key", ("token", 1), "value")
+        assert cache.get("key", ("token", 1)) == "value"
+        assert cache.get("key", ("token", 2)) is None
+        # and dropped once the token has changed
+        assert cache.get("key", ("token", 1)) is None
+
+        run = RUNS[1]
+        res = RESOLUTIONS[1]
+        area = AREAS[2]
+        field = "t2m"
+        platform = DEFAULT_PLATFORM
+        env = ENVS[0]
+        reftime_dt = faker.date_time()
+        reftime = reftime_dt.strftime("%Y%m%d%H")
+        new_reftime = (reftime_dt + datetime.timedelta(days=1)).strftime("%Y%m%d%H")
+
+        endpoint = (
+            API_URI
+            + f"/maps/ready?field={field}&run={run}&res={res}&area={area}&platform={platform}&env={env}"
+        )
+
+        # create filesystem
+        map_path = DATA_PATH.joinpath(platform, env, f"Magics-{run}-{res}.web", area)
+        field_dir = map_path.joinpath(field)
+        field_dir.mkdir(parents=True, exist_ok=True)
+        mapfile_path = field_dir.joinpath(f"{field}.{reftime}.0006.png")
+        mapfile_path.write_bytes(faker.binary(length=64))
+        readyfile_path = map_path.joinpath(f"{reftime}.READY")
+        open(readyfile_path, "a").close()
+
+        r = client.get(endpoint)
+        assert r.status_code == 200
+        response_data = self.get_content(r)
+        assert isinstance(response_data, dict)
+        assert response_data["reftime"] == reftime
+        assert response_data["offsets"] == ["0006"]
+
+        # the cached response is dropped as soon as a new run lands
+        new_mapfile_path = field_dir.joinpath(f"{field}.{new_reftime}.0012.png")
+        new_mapfile_path.write_bytes(faker.binary(length=64))
+        new_readyfile_path = map_path.joinpath(f"{new_reftime}.READY")
+        open(new_readyfile_path, "a").close()
+
+        r = client.get(endpoint)
+        assert r.status_code == 200
+        response_data = self.get_content(r)
+        assert isinstance(response_data, dict)
+        assert response_data["reftime"] == new_reftime
+        assert response_data["offsets"] == ["0012"]
+
+        # delete the files used for the test
+        Path.unlink(readyfile_path)
+        Path.unlink(new_readyfile_path)
+        Path.unlink(mapfile_path)
+        Path.unlink(new_mapfile_path)
@@ -0,0 +1,34 @@
+from faker import Faker
+from maps.endpoints.config import AREAS, DEFAULT_PLATFORM, ENVS, RESOLUTIONS, RUNS
+from restapi.tests import API_URI, BaseTests, FlaskClient
+
+
+class TestApp(BaseTests):
+    def test_api_metrics(self, client: FlaskClient, faker: Faker) -> None:
+
+        run = RUNS[0]
+        res = RESOLUTIONS[0]
+        area = AREAS[0]
+        field = "humidity"
+        platform = DEFAULT_PLATFORM
+        env = ENVS[0]
+
+        # no .READY files for this product
+        r = client.get(
+            f"{API_URI}/maps/ready?field={field}&run={run}&res={res}&area={area}&platform={platform}&env={env}"
+        )
+        assert r.status_code in (404, 503)
+        status = r.status_code
+
+        r = client.get(f"{API_URI}/metrics")
+        assert r.status_code == 200
+        assert r.headers["Content-Type"].startswith("text/plain")
+        metrics = r.data.decode()
+        assert 'maps_request_duration_seconds_bucket{endpoint="MapSet"' in metrics
+        assert (
+            "maps_requests_total{"
+            f'endpoint="MapSet",field="{field}",platform="{platform}",status="{status}"'
+            "}"
+        ) in metrics
+        assert 'maps_cache_requests_total{cache="ready",result="miss"}' in metrics
+        assert "maps_catalog_scan_duration_seconds_count" in metrics
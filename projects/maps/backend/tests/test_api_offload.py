@@ -0,0 +1,89 @@
+from pathlib import Path
+
+import pytest
+from faker import Faker
+from maps.endpoints import delivery
+from maps.endpoints.config import (
+    ACCEL_LOCATION,
+    AREAS,
+    DEFAULT_PLATFORM,
+    ENVS,
+    RESOLUTIONS,
+    RUNS,
+)
+from restapi.config import DATA_PATH
+from restapi.tests import API_URI, BaseTests, FlaskClient
+
+
+class TestApp(BaseTests):
+    @pytest.mark.parametrize("mode", ["accel", "sendfile"])
+    def test_api_offload(
+        self,
+        mode: str,
+        client: FlaskClient,
+        faker: Faker,
+        monkeypatch: pytest.MonkeyPatch,
+    ) -> None:
+
+        run = RUNS[0]
+        res = RESOLUTIONS[0]
+        area = AREAS[0]
+        field = "t2m"
+        platform = DEFAULT_PLATFORM
+        env = ENVS[0]
+        reftime = faker.date_time().strftime("%Y%m%d%H")
+
+        query = f"field={field}&run={run}&res={res}&area={area}&platform={platform}&env={env}"
+
+        # create filesystem
+        base_path = DATA_PATH.joinpath(platform, env, f"Magics-{run}-{res}.web")
+        map_path = base_path.joinpath(area)
+        field_dir = map_path.joinpath(field)
+        field_dir.mkdir(parents=True, exist_ok=True)
+        mapfile_path = field_dir.joinpath(f"{field}.{reftime}.0000.png")
+        mapfile_path.write_bytes(faker.binary(length=256))
+        legend_dir = base_path.joinpath("legends")
+        legend_dir.mkdir(parents=True, exist_ok=True)
+        legend_path = legend_dir.joinpath(f"{field}.png")
+        legend_path.write_bytes(faker.binary(length=256))
+        readyfile_path = map_path.joinpath(f"{reftime}.READY")
+        open(readyfile_path, "a").close()
+
+        # as configured by MAPS_SENDFILE_MODE, with the hot images disabled
+        monkeypatch.setattr(delivery, "SENDFILE_MODE", mode)
+        monkeypatch.setattr(delivery.hot_images, "max_size", 0)
+
+        for endpoint, path in (
+            (f"/maps/offset/0000?{query}", mapfile_path),
+            (f"/maps/legend?{query}", legend_path),
+        ):
+            r = client.get(API_URI + endpoint, headers={"Accept": "image/png"})
+            assert r.status_code == 200
+            # the file is sent by the frontend server
+            assert not r.data
+            assert r.mimetype == "image/png"
+            assert r.headers["ETag"]
+            if mode == "accel":
+                relative_path = path.relative_to(DATA_PATH).as_posix()
+                location = ACCEL_LOCATION.rstrip("/")
+                expected = f"{location}/{relative_path}"
+                assert r.headers["X-Accel-Redirect"] == expected
+                assert "X-Sendfile" not in r.headers
+            else:
+                assert r.headers["X-Sendfile"] == str(path)
+                assert "X-Accel-Redirect" not in r.headers
+
+            # the validators are still checked by the app
+            etag = r.headers["ETag"]
+            r = client.get(
+                API_URI + endpoint,
+                headers={"Accept": "image/png", "If-None-Match": etag},
+            )
+            assert r.status_code == 304
+            assert "X-Accel-Redirect" not in r.headers
+            assert "X-Sendfile" not in r.headers
+
+        # delete the files used for the test
+        Path.unlink(readyfile_path)
+        Path.unlink(mapfile_path)
+        Path.unlink(legend_path)
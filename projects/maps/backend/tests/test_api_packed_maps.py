@@ -0,0 +1,180 @@
+import datetime
+import io
+import os
+import zipfile
+from pathlib import Path
+
+from click.testing import CliRunner
+from faker import Faker
+from maps.endpoints.config import AREAS, DEFAULT_PLATFORM, ENVS, RESOLUTIONS, RUNS
+from maps.endpoints.packfile import (
+    PACK_SUFFIX,
+    PackReader,
+    close_packs,
+    open_pack,
+    write_pack,
+)
+from maps.tasks.pack import pack
+from restapi.config import DATA_PATH
+from restapi.tests import API_URI, BaseTests, FlaskClient
+
+
+class TestApp(BaseTests):
+    def test_api_packed_maps(self, client: FlaskClient, faker: Faker) -> None:
+
+        run = RUNS[0]
+        res = RESOLUTIONS[0]
+        area = AREAS[0]
+        field = "wind"
+        platform = DEFAULT_PLATFORM
+        env = ENVS[0]
+        reftime = faker.date_time().strftime("%Y%m%d%H")
+        params = f"field={field}&run={run}&res={res}&area={area}&platform={platform}&env={env}"
+
+        # create a packed run: no loose map files at all
+        map_path = DATA_PATH.joinpath(platform, env, f"Magics-{run}-{res}.web", area)
+        map_path.mkdir(parents=True, exist_ok=True)
+        contents = {
+            f"{field}/{field}.{reftime}.{offset}.png": faker.binary(length=500)
+            for offset in ["0000", "0003"]
+        }
+        contents["legends/wind.png"] = faker.binary(length=100)
+        tmp_files = []
+        for i, content in enumerate(contents.values()):
+            tmp_file = map_path.joinpath(f"tmp{i}")
+            with open(tmp_file, "wb") as f:
+                f.write(content)
+            tmp_files.append(tmp_file)
+        pack_path = map_path.joinpath(f"{reftime}.pack")
+        write_pack(pack_path, zip(contents.keys(), tmp_files))
+        for tmp_file in tmp_files:
+            Path.unlink(tmp_file)
+        readyfile_path = map_path.joinpath(f"{reftime}.READY")
+        open(readyfile_path, "a").close()
+
+        # offsets are listed from the archive index
+        r = client.get(f"{API_URI}/maps/ready?{params}")
+        assert r.status_code == 200
+        ready_res = self.get_content(r)
+        assert isinstance(ready_res, dict)
+        assert ready_res["reftime"] == reftime
+        assert ready_res["offsets"] == ["0000", "0003"]
+
+        # map images are read from the archive
+        r = client.get(f"{API_URI}/maps/offset/0003?{params}")
+        assert r.status_code == 200
+        assert r.data == contents[f"{field}/{field}.{reftime}.0003.png"]
+        r = client.get(
+            f"{API_URI}/maps/offset/0003?{params}",
+            headers={"If-None-Match": r.headers["ETag"]},
+        )
+        assert r.status_code == 304
+
+        r = client.get(f"{API_URI}/maps/offset/0001?{params}")
+        assert r.status_code == 404
+
+        # and so the legend
+        r = client.get(f"{API_URI}/maps/legend?{params}")
+        assert r.status_code == 200
+        assert r.data == contents["legends/wind.png"]
+
+        # bundles are built from the archive as well
+        r = client.get(f"{API_URI}/maps/bundle?{params}")
+        assert r.status_code == 200
+        with zipfile.ZipFile(io.BytesIO(r.data)) as z:
+            assert z.testzip() is None
+            assert (
+                z.read(f"{field}.{reftime}.0000.png")
+                == contents[f"{field}/{field}.{reftime}.0000.png"]
+            )
+
+        # delete the files used for the test
+        Path.unlink(readyfile_path)
+        Path.unlink(pack_path)
+
+    def test_pack_task(self, client: FlaskClient, faker: Faker) -> None:
+
+        run = RUNS[1]
+        res = RESOLUTIONS[0]
+        area = AREAS[3]
+        field = "wind"
+        platform = DEFAULT_PLATFORM
+        env = ENVS[0]
+        reftime_dt = faker.date_time()
+        old_reftime = reftime_dt.strftime("%Y%m%d%H")
+        reftime = (reftime_dt + datetime.timedelta(days=1)).strftime("%Y%m%d%H")
+        params = f"field={field}&run={run}&res={res}&area={area}&platform={platform}&env={env}"
+
+        # an older run retained in the same folder, along with the new one
+        run_path = DATA_PATH.joinpath(platform, env, f"Magics-{run}-{res}.web")
+        map_path = run_path.joinpath(area)
+        field_dir = map_path.joinpath(field)
+        field_dir.mkdir(parents=True, exist_ok=True)
+        old_mapfile_path = field_dir.joinpath(f"{field}.{old_reftime}.0000.png")
+        old_mapfile_path.write_bytes(faker.binary(length=100))
+        mapfile_path = field_dir.joinpath(f"{field}.{reftime}.0000.png")
+        mapfile_path.write_bytes(faker.binary(length=100))
+        # left by an interrupted copy
+        tmpfile_path = field_dir.joinpath(f".{field}.{reftime}.0006.png.tmp")
+        tmpfile_path.write_bytes(faker.binary(length=100))
+        readyfiles = [map_path.joinpath(f"{r}.READY") for r in (old_reftime, reftime)]
+        for readyfile_path in readyfiles:
+            open(readyfile_path, "a").close()
+
+        result = CliRunner().invoke(pack, [str(run_path), "--remove"])
+        assert result.exit_code == 0
+
+        # only the files of the new run are packed (and removed)
+        pack_path = map_path.joinpath(f"{reftime}.pack")
+        assert list(PackReader(pack_path).keys(f"{field}/")) == [
+            f"{field}/{mapfile_path.name}"
+        ]
+        assert not mapfile_path.exists()
+        assert old_mapfile_path.exists()
+        assert tmpfile_path.exists()
+
+        # both the runs can still be retrieved
+        for run_reftime in (old_reftime, reftime):
+            endpoint = f"{API_URI}/maps/offset/0000?{params}&reftime={run_reftime}"
+            r = client.get(endpoint, headers={"Accept": "image/png"})
+            assert r.status_code == 200
+
+        # delete the files used for the test
+        for readyfile_path in readyfiles:
+            Path.unlink(readyfile_path)
+        Path.unlink(pack_path)
+        Path.unlink(old_mapfile_path)
+        Path.unlink(tmpfile_path)
+
+    def test_repacked_archive(self) -> None:
+
+        folder = DATA_PATH.joinpath("repacked")
+        folder.mkdir(parents=True, exist_ok=True)
+        pack_path = folder.joinpath(f"2022022300{PACK_SUFFIX}")
+        files = []
+        for name, content in (("k", b"old"), ("k2", b"new")):
+            files.append(folder.joinpath(name))
+            files[-1].write_bytes(content)
+
+        write_pack(pack_path, [("k", files[0])])
+        reader = open_pack(pack_path)
+        assert reader and bytes(reader.get("k") or b"") == b"old"
+        assert open_pack(pack_path) is reader
+
+        # the run is packed again under the same name
+        tmp_path = folder.joinpath(f".{pack_path.name}.tmp")
+        write_pack(tmp_path, [("k", files[1]), ("k2", files[1])])
+        os.replace(tmp_path, pack_path)
+        reader = open_pack(pack_path)
+        assert reader and bytes(reader.get("k") or b"") == b"new"
+        assert reader.locate("k2")
+
+        # the archives of the removed runs are released
+        close_packs(folder)
+        Path.unlink(pack_path)
+        assert open_pack(pack_path) is None
+
+        # delete the files used for the test
+        for path in files:
+            Path.unlink(path)
+        folder.rmdir()
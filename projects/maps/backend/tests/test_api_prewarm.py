@@ -0,0 +1,91 @@
+import fcntl
+from pathlib import Path
+from typing import List, Tuple
+
+from faker import Faker
+from maps.endpoints.catalog import RunCatalog
+from maps.endpoints.config import (
+    AREAS,
+    DEFAULT_PLATFORM,
+    ENVS,
+    RESOLUTIONS,
+    RUNS,
+    get_cache_path,
+)
+from maps.endpoints.variants import SUPPORTED_VARIANTS
+from maps.tasks.prewarm import Prewarmer, get_progress_path, prewarm_run, read_progress
+from PIL import Image
+from restapi.config import DATA_PATH
+from restapi.tests import BaseTests
+
+
+class TestApp(BaseTests):
+    def test_prewarm(self, faker: Faker) -> None:
+
+        run = RUNS[1]
+        res = RESOLUTIONS[1]
+        area = AREAS[1]
+        field = "cloud_hml"
+        platform = DEFAULT_PLATFORM
+        env = ENVS[0]
+        reftime = faker.date_time().strftime("%Y%m%d%H")
+
+        # create filesystem
+        base_path = DATA_PATH.joinpath(platform, env, f"Magics-{run}-{res}.web")
+        map_path = base_path.joinpath(area)
+        field_dir = map_path.joinpath(field)
+        field_dir.mkdir(parents=True, exist_ok=True)
+        mapfile_path = field_dir.joinpath(f"{field}.{reftime}.0012.png")
+        Image.new("RGBA", (32, 32), faker.color_rgb()).save(mapfile_path)
+
+        # the new runs are notified by the catalog, once started
+        notified: List[Tuple[Path, str]] = []
+        run_catalog = RunCatalog(DATA_PATH, watcher="poll", poll_interval=3600)
+        run_catalog.subscribe(lambda path, r: notified.append((path, r)))
+        run_catalog.start()
+        assert run_catalog.wait_ready(10)
+        readyfile_path = map_path.joinpath(f"{reftime}.READY")
+        open(readyfile_path, "a").close()
+        run_catalog.refresh_area(map_path, force=True)
+        assert notified == [(map_path, reftime)]
+
+        progress = prewarm_run(map_path, reftime, SUPPORTED_VARIANTS)
+        assert progress.files == 1
+        assert progress.done == 1
+        assert progress.errors == 0
+        assert progress.bytes_read == mapfile_path.stat().st_size
+        assert progress.variants == len(SUPPORTED_VARIANTS)
+        assert progress.finished
+
+        # and the variants already encoded
+        cache_path = get_cache_path("variants", base_path, area, field)
+        for variant in SUPPORTED_VARIANTS:
+            assert cache_path.joinpath(f"{mapfile_path.stem}.{variant}").is_file()
+
+        # a run is warmed up by a single worker
+        progress_path = get_progress_path(map_path, reftime)
+        progress_path.parent.mkdir(parents=True, exist_ok=True)
+        old_progress_path = progress_path.with_name("progress.1970010100.json")
+        old_progress_path.touch()
+        lock_path = progress_path.with_name(f".{progress_path.name}.lock")
+        with open(lock_path, "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            # held by another worker
+            assert Prewarmer([]).warm(map_path, reftime) is None
+            fcntl.flock(lock, fcntl.LOCK_UN)
+        assert not progress_path.exists()
+
+        progress = Prewarmer([]).warm(map_path, reftime)
+        assert progress and progress.finished
+        # the progress is shared with the other workers
+        assert read_progress(progress_path) == progress
+        # only the one of the last run is kept
+        assert not old_progress_path.exists()
+        # the other workers skip the run once done
+        assert Prewarmer([]).warm(map_path, reftime) == progress
+
+        # delete the files used for the test
+        Path.unlink(progress_path)
+        Path.unlink(lock_path)
+        Path.unlink(readyfile_path)
+        Path.unlink(mapfile_path)
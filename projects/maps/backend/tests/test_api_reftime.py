@@ -0,0 +1,90 @@
+import datetime
+from pathlib import Path
+
+from faker import Faker
+from maps.endpoints.catalog import walk_areas
+from maps.endpoints.config import AREAS, DEFAULT_PLATFORM, ENVS, RESOLUTIONS, RUNS
+from maps.endpoints.retention import prune_area
+from restapi.config import DATA_PATH
+from restapi.tests import API_URI, BaseTests, FlaskClient
+
+
+class TestApp(BaseTests):
+    def test_api_reftime(self, client: FlaskClient, faker: Faker) -> None:
+
+        run = RUNS[0]
+        res = RESOLUTIONS[0]
+        area = AREAS[0]
+        field = "snow6"
+        platform = DEFAULT_PLATFORM
+        env = ENVS[0]
+        reftime_dt = faker.date_time()
+        old_reftime = reftime_dt.strftime("%Y%m%d%H")
+        reftime = (reftime_dt + datetime.timedelta(days=1)).strftime("%Y%m%d%H")
+        params = f"field={field}&run={run}&res={res}&area={area}&platform={platform}&env={env}"
+
+        # create filesystem: two runs retained in the same folder
+        map_path = DATA_PATH.joinpath(platform, env, f"Magics-{run}-{res}.web", area)
+        field_dir = map_path.joinpath(field)
+        field_dir.mkdir(parents=True, exist_ok=True)
+        contents = {}
+        for r, offsets in ((old_reftime, ["0006", "0009"]), (reftime, ["0006"])):
+            for offset in offsets:
+                mapfile_path = field_dir.joinpath(f"{field}.{r}.{offset}.png")
+                contents[(r, offset)] = faker.binary(length=faker.pyint(100, 2000))
+                with open(mapfile_path, "wb") as f:
+                    f.write(contents[(r, offset)])
+            open(map_path.joinpath(f"{r}.READY"), "a").close()
+
+        # the last run by default
+        r = client.get(f"{API_URI}/maps/ready?{params}")
+        assert r.status_code == 200
+        ready_res = self.get_content(r)
+        assert isinstance(ready_res, dict)
+        assert ready_res["reftime"] == reftime
+        assert ready_res["offsets"] == ["0006"]
+
+        # a previous run
+        r = client.get(f"{API_URI}/maps/ready?{params}&reftime={old_reftime}")
+        assert r.status_code == 200
+        ready_res = self.get_content(r)
+        assert isinstance(ready_res, dict)
+        assert ready_res["reftime"] == old_reftime
+        assert ready_res["offsets"] == ["0006", "0009"]
+
+        r = client.get(f"{API_URI}/maps/offset/0006?{params}")
+        assert r.status_code == 200
+        assert r.data == contents[(reftime, "0006")]
+        r = client.get(f"{API_URI}/maps/offset/0006?{params}&reftime={old_reftime}")
+        assert r.status_code == 200
+        assert r.data == contents[(old_reftime, "0006")]
+        r = client.get(f"{API_URI}/maps/offset/0009?{params}")
+        assert r.status_code == 404
+
+        # runs not available
+        unknown = (reftime_dt + datetime.timedelta(days=2)).strftime("%Y%m%d%H")
+        r = client.get(f"{API_URI}/maps/ready?{params}&reftime={unknown}")
+        assert r.status_code == 404
+        r = client.get(f"{API_URI}/maps/offset/0006?{params}&reftime={unknown}")
+        assert r.status_code == 404
+        r = client.get(f"{API_URI}/maps/legend?{params}&reftime={unknown}")
+        assert r.status_code == 404
+        r = client.get(f"{API_URI}/maps/ready?{params}&reftime=yesterday")
+        assert r.status_code == 400
+
+        # retention: the platforms not available are not walked
+        assert map_path in walk_areas(DATA_PATH)
+        assert map_path not in walk_areas(DATA_PATH, lambda p: p != platform)
+
+        # retention: only the last run is kept
+        assert prune_area(map_path, keep=1) == [old_reftime]
+        assert not map_path.joinpath(f"{old_reftime}.READY").exists()
+        assert not field_dir.joinpath(f"{field}.{old_reftime}.0009.png").exists()
+        r = client.get(f"{API_URI}/maps/ready?{params}&reftime={old_reftime}")
+        assert r.status_code == 404
+        r = client.get(f"{API_URI}/maps/ready?{params}")
+        assert r.status_code == 200
+
+        # delete the files used for the test
+        Path.unlink(map_path.joinpath(f"{reftime}.READY"))
+        Path.unlink(field_dir.joinpath(f"{field}.{reftime}.0006.png"))
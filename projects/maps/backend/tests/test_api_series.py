@@ -0,0 +1,79 @@
+from pathlib import Path
+
+from faker import Faker
+from maps.endpoints.config import DEFAULT_PLATFORM, ENVS, RUNS
+from PIL import Image, ImageDraw
+from restapi.config import DATA_PATH
+from restapi.tests import API_URI, BaseTests, FlaskClient
+
+LEGEND_COLORS = [(0, 0, 255), (0, 255, 0), (255, 200, 0), (255, 0, 0)]
+
+
+class TestApp(BaseTests):
+    def test_api_series(self, client: FlaskClient, faker: Faker) -> None:
+
+        run = RUNS[0]
+        res = "lm5"
+        area = "Area_Mediterranea"
+        field = "t2m"
+        platform = DEFAULT_PLATFORM
+        env = ENVS[0]
+        reftime = faker.date_time().strftime("%Y%m%d%H")
+
+        endpoint = (
+            API_URI
+            + f"/maps/series?field={field}&run={run}&res={res}&area={area}&platform={platform}&env={env}"
+        )
+
+        # create filesystem
+        base_path = DATA_PATH.joinpath(platform, env, f"Magics-{run}-{res}.web")
+        map_path = base_path.joinpath(area)
+        field_dir = map_path.joinpath(field)
+        field_dir.mkdir(parents=True, exist_ok=True)
+        # the west half goes through the classes, the east half is steady
+        map_files = []
+        for i, color in enumerate(LEGEND_COLORS[:3]):
+            mapfile_path = field_dir.joinpath(f"{field}.{reftime}.{i:04d}.png")
+            img = Image.new("RGBA", (200, 100), color + (255,))
+            ImageDraw.Draw(img).rectangle([100, 0, 199, 99], fill=LEGEND_COLORS[3])
+            img.save(mapfile_path)
+            map_files.append(mapfile_path)
+        legend_dir = base_path.joinpath("legends")
+        legend_dir.mkdir(parents=True, exist_ok=True)
+        legend_path = legend_dir.joinpath(f"{field}.png")
+        legend = Image.new("RGBA", (300, 40), (255, 255, 255, 0))
+        draw = ImageDraw.Draw(legend)
+        for i, color in enumerate(LEGEND_COLORS):
+            draw.rectangle([10 + i * 70, 5, 79 + i * 70, 25], fill=color)
+        legend.save(legend_path)
+        readyfile_path = map_path.joinpath(f"{reftime}.READY")
+        open(readyfile_path, "a").close()
+
+        r = client.get(f"{endpoint}&lat=40&lon=-20&lat=40&lon=30")
+        assert r.status_code == 200
+        response_data = self.get_content(r)
+        assert isinstance(response_data, dict)
+        assert response_data["reftime"] == reftime
+        assert response_data["offsets"] == ["0000", "0001", "0002"]
+        west, east = response_data["points"]
+        assert west["lon"] == -20
+        assert west["classes"] == [0, 1, 2]
+        assert east["classes"] == [3, 3, 3]
+
+        # the stack of the run is reused
+        r = client.get(f"{endpoint}&lat=45&lon=-25")
+        assert r.status_code == 200
+        response_data = self.get_content(r)
+        assert isinstance(response_data, dict)
+        assert response_data["points"][0]["classes"] == [0, 1, 2]
+
+        r = client.get(f"{endpoint}&lat=40&lon=-20&lat=41")
+        assert r.status_code == 400
+        r = client.get(f"{endpoint}&lat=60&lon=-20")
+        assert r.status_code == 400
+
+        # delete the files used for the test
+        Path.unlink(readyfile_path)
+        Path.unlink(legend_path)
+        for mapfile_path in map_files:
+            Path.unlink(mapfile_path)
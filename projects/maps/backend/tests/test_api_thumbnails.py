@@ -0,0 +1,71 @@
+import io
+from pathlib import Path
+
+from faker import Faker
+from maps.endpoints.config import AREAS, DEFAULT_PLATFORM, ENVS, RESOLUTIONS, RUNS
+from PIL import Image
+from restapi.config import DATA_PATH
+from restapi.tests import API_URI, BaseTests, FlaskClient
+
+
+class TestApp(BaseTests):
+    def test_api_thumbnails(self, client: FlaskClient, faker: Faker) -> None:
+
+        run = RUNS[0]
+        res = RESOLUTIONS[0]
+        area = AREAS[0]
+        field = "pressure"
+        platform = DEFAULT_PLATFORM
+        env = ENVS[0]
+        reftime = faker.date_time().strftime("%Y%m%d%H")
+
+        endpoint = (
+            API_URI
+            + f"/maps/offset/0000?field={field}&run={run}&res={res}&area={area}&platform={platform}&env={env}"
+        )
+
+        # create filesystem
+        map_path = DATA_PATH.joinpath(platform, env, f"Magics-{run}-{res}.web", area)
+        field_dir = map_path.joinpath(field)
+        field_dir.mkdir(parents=True, exist_ok=True)
+        mapfile_path = field_dir.joinpath(f"{field}.{reftime}.0000.png")
+        Image.new("RGBA", (400, 200), faker.color_rgb()).save(mapfile_path)
+        readyfile_path = map_path.joinpath(f"{reftime}.READY")
+        open(readyfile_path, "a").close()
+
+        # the aspect ratio is kept
+        r = client.get(f"{endpoint}&width=100", headers={"Accept": "*/*"})
+        assert r.status_code == 200
+        assert r.headers["Content-Type"] == "image/png"
+        with Image.open(io.BytesIO(r.data)) as img:
+            assert img.size == (100, 50)
+        etag = r.headers["ETag"]
+
+        r = client.get(f"{endpoint}&width=100", headers={"If-None-Match": etag})
+        assert r.status_code == 304
+
+        r = client.get(f"{endpoint}&height=100&width=300")
+        assert r.status_code == 200
+        with Image.open(io.BytesIO(r.data)) as img:
+            assert img.size == (200, 100)
+        assert r.headers["ETag"] != etag
+
+        r = client.get(f"{endpoint}&size=small")
+        assert r.status_code == 200
+        with Image.open(io.BytesIO(r.data)) as img:
+            assert img.size == (160, 80)
+
+        # images are never scaled up
+        r = client.get(f"{endpoint}&size=large")
+        assert r.status_code == 200
+        with Image.open(io.BytesIO(r.data)) as img:
+            assert img.size == (400, 200)
+
+        r = client.get(f"{endpoint}&width=1")
+        assert r.status_code == 400
+        r = client.get(f"{endpoint}&size=huge")
+        assert r.status_code == 400
+
+        # delete the files used for the test
+        Path.unlink(readyfile_path)
+        Path.unlink(mapfile_path)
@@ -0,0 +1,87 @@
+import shutil
+from pathlib import Path
+
+from click.testing import CliRunner
+from faker import Faker
+from maps.endpoints.config import DATASETS, DEFAULT_PLATFORM, RUNS
+from maps.tasks.tiles import get_tile_range, tiles
+from PIL import Image, ImageDraw
+from restapi.config import DATA_PATH
+from restapi.tests import API_URI, BaseTests, FlaskClient
+
+
+class TestApp(BaseTests):
+    def test_api_tile_pyramid(self, client: FlaskClient, faker: Faker) -> None:
+
+        run = RUNS[0]
+        dataset = "lm5"
+        area = "Area_Mediterranea"
+        field = "t2m"
+        platform = DEFAULT_PLATFORM
+        env = "PROD"
+        reftime = faker.date_time().strftime("%Y%m%d%H")
+
+        endpoint = API_URI + f"/tiles?dataset={dataset}&run={run}"
+
+        # create filesystem
+        run_path = DATA_PATH.joinpath(platform, env, f"Magics-{run}-{dataset}.web")
+        map_path = run_path.joinpath(area)
+        field_dir = map_path.joinpath(field)
+        field_dir.mkdir(parents=True, exist_ok=True)
+        map_files = [
+            field_dir.joinpath(f"{field}.{reftime}.{offset}.png")
+            for offset in ("0000", "0001")
+        ]
+        # transparent but for a box around Italy
+        for mapfile_path in map_files:
+            img = Image.new("RGBA", (779, 297), (0, 0, 0, 0))
+            ImageDraw.Draw(img).rectangle([370, 80, 570, 220], fill=(255, 0, 0, 255))
+            img.save(mapfile_path)
+        readyfile_path = map_path.joinpath(f"{reftime}.READY")
+        open(readyfile_path, "a").close()
+
+        tiles_path = DATA_PATH.joinpath(platform, env, f"Tiles-{run}-{dataset}.web")
+        tiles_area = tiles_path.joinpath(area)
+        layer_path = tiles_area.joinpath(f"{reftime}.0000", field)
+        # zoom 3 of the first offset was done by an interrupted run
+        layer_path.mkdir(parents=True, exist_ok=True)
+        layer_path.joinpath(".z3.done").touch()
+
+        args = [str(run_path), "--min-zoom", "3", "--max-zoom", "4", "--workers", "1"]
+        result = CliRunner().invoke(tiles, args)
+        assert result.exit_code == 0
+        assert "3 of 4 frames" in result.output
+        assert tiles_area.joinpath(f"{reftime}.READY").exists()
+        assert not layer_path.joinpath("3").exists()
+        assert not layer_path.joinpath(".z3.done").exists()
+        tile_files = list(layer_path.joinpath("4").glob("*/*.png"))
+        assert tile_files
+        # the transparent tiles are not written
+        written = sum(1 for _ in tiles_area.joinpath(f"{reftime}.0001").rglob("*.png"))
+        covering = 0
+        for zoom in (3, 4):
+            x_range, y_range = get_tile_range(DATASETS[dataset]["boundaries"], zoom)
+            covering += len(x_range) * len(y_range)
+        assert 0 < written < covering
+        with Image.open(tile_files[0]) as tile:
+            assert tile.size == (256, 256)
+            assert tile.mode == "RGBA"
+
+        r = client.get(endpoint)
+        assert r.status_code == 200
+        response_data = self.get_content(r)
+        assert isinstance(response_data, dict)
+        assert response_data["reftime"] == reftime
+
+        # a run already tiled is left untouched
+        result = CliRunner().invoke(tiles, args)
+        assert result.exit_code == 0
+        assert "already tiled" in result.output
+
+        # delete the files used for the test
+        Path.unlink(readyfile_path)
+        for mapfile_path in map_files:
+            Path.unlink(mapfile_path)
+        Path.unlink(tiles_area.joinpath(f"{reftime}.READY"))
+        for offset in ("0000", "0001"):
+            shutil.rmtree(tiles_area.joinpath(f"{reftime}.{offset}"))
@@ -2,6 +2,7 @@
 
 from faker import Faker
 from maps.endpoints.config import DATASETS, DEFAULT_PLATFORM, RUNS
+from maps.endpoints.packfile import write_pack
 from restapi.config import DATA_PATH
 from restapi.tests import API_URI, BaseTests, FlaskClient
 
@@ -55,5 +56,31 @@ def test_api_tiles(self, client: FlaskClient, faker: Faker) -> None:
         # check the response is the same
         assert self.get_content(r) == tiles_metadata
 
+        # tiles are not packed yet
+        tile_endpoint = f"{API_URI}/tiles/{dataset}/{run}/{reftime}.0006/t2m/4/8/5.png"
+        r = client.get(tile_endpoint)
+        assert r.status_code == 404
+
+        # pack the tiles of the run
+        tile_content = faker.binary(length=faker.pyint(100, 2000))
+        tile_path = tiles_path.joinpath("tile.png")
+        with open(tile_path, "wb") as f:
+            f.write(tile_content)
+        tiles_pack_path = tiles_path.joinpath(f"{reftime}.pack")
+        write_pack(tiles_pack_path, [(f"{reftime}.0006/t2m/4/8/5.png", tile_path)])
+        Path.unlink(tile_path)
+
+        r = client.get(tile_endpoint)
+        assert r.status_code == 200
+        assert r.data == tile_content
+        assert r.headers["Content-Type"] == "image/png"
+        r = client.get(tile_endpoint, headers={"If-None-Match": r.headers["ETag"]})
+        assert r.status_code == 304
+
+        # tile not in the archive
+        r = client.get(f"{API_URI}/tiles/{dataset}/{run}/{reftime}.0006/t2m/4/8/6.png")
+        assert r.status_code == 404
+
         # delete the files used for the test
+        Path.unlink(tiles_pack_path)
         Path.unlink(tiles_readyfile_path)
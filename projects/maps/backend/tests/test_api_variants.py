@@ -0,0 +1,59 @@
+from pathlib import Path
+
+from faker import Faker
+from maps.endpoints.config import AREAS, DEFAULT_PLATFORM, ENVS, RESOLUTIONS, RUNS
+from maps.endpoints.variants import SUPPORTED_VARIANTS
+from PIL import Image
+from restapi.config import DATA_PATH
+from restapi.tests import API_URI, BaseTests, FlaskClient
+
+
+class TestApp(BaseTests):
+    def test_api_variants(self, client: FlaskClient, faker: Faker) -> None:
+
+        run = RUNS[0]
+        res = RESOLUTIONS[0]
+        area = AREAS[0]
+        field = "cloud"
+        platform = DEFAULT_PLATFORM
+        env = ENVS[0]
+        reftime = faker.date_time().strftime("%Y%m%d%H")
+
+        endpoint = (
+            API_URI
+            + f"/maps/offset/0000?field={field}&run={run}&res={res}&area={area}&platform={platform}&env={env}"
+        )
+
+        # create filesystem
+        map_path = DATA_PATH.joinpath(platform, env, f"Magics-{run}-{res}.web", area)
+        field_dir = map_path.joinpath(field)
+        field_dir.mkdir(parents=True, exist_ok=True)
+        mapfile_path = field_dir.joinpath(f"{field}.{reftime}.0000.png")
+        Image.new("RGBA", (64, 64), faker.color_rgb()).save(mapfile_path)
+        readyfile_path = map_path.joinpath(f"{reftime}.READY")
+        open(readyfile_path, "a").close()
+
+        # a generic client gets the original png
+        r = client.get(endpoint, headers={"Accept": "*/*"})
+        assert r.status_code == 200
+        assert r.headers["Content-Type"] == "image/png"
+        png_etag = r.headers["ETag"]
+
+        for variant in SUPPORTED_VARIANTS:
+            mime = f"image/{variant}"
+            r = client.get(endpoint, headers={"Accept": f"{mime},*/*;q=0.8"})
+            assert r.status_code == 200
+            assert r.headers["Content-Type"] == mime
+            assert "Accept" in r.headers["Vary"]
+            assert r.headers["ETag"] != png_etag
+            variant_etag = r.headers["ETag"]
+
+            # the variant is encoded once
+            r = client.get(
+                endpoint, headers={"Accept": mime, "If-None-Match": variant_etag}
+            )
+            assert r.status_code == 304
+
+        # delete the files used for the test
+        Path.unlink(readyfile_path)
+        Path.unlink(mapfile_path)